@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmarks of the hot parts of the engine, on the real data files.
+#
+# > python Benchmark.py json [$MovieMetadataFilePath]
+# > python Benchmark.py search [$FeaturesType] [$DirectoryOfProfiles]
+# > python Benchmark.py server [$DirectoryOfProfiles] [$Port]
+#
+
+import Tools as rtools
+import MovieMetadataReader as movMtdata
+import MovieSearchIndex as searchIndex
+import UserProfiles as usrProfiles
+import env
+
+import asyncio
+import json
+import numpy as np
+import os
+import sys
+import time
+
+
+# The fields of movies_metadata.csv read by getData with getElemFromJson : column, idLabel, nameLabel, intVal
+JSON_FIELDS = [
+    [1, 'id', 'name', True]             # belongs_to_collection
+    , [3, 'id', 'name', True]           # genres
+    , [17, 'iso_639_1', 'name', False]  # spoken_languages
+]
+
+
+
+#--------
+# To compare the throughput of getElemFromJson and of the previous version (getElemFromJsonSplit)
+# on the fields of the metadata file
+#--------
+# metadataFile : path to the movies_metadata.csv file (string)
+# repeat : number of times the fields are parsed by each version (integer)
+# @return : dict version -> [fields per second, MB per second] && print the results
+#--------
+def JsonParserBenchmark(metadataFile, repeat = 3):
+
+    # The fields are read before : only the parsing is timed
+    fields = []
+    for inst in rtools.readcsvRows(metadataFile, False):
+        if len(inst) == 24:
+            fields += [[inst[column], idLabel, nameLabel, intVal] for column, idLabel, nameLabel, intVal in JSON_FIELDS]
+
+    nbBytes = sum(len(field[0]) for field in fields)
+
+    print(str(len(set(field[0] for field in fields))) + " distinct fields on " + str(len(fields)))
+
+    res = {}
+
+    for name, parser in [["getElemFromJson", rtools.getElemFromJson], ["getElemFromJsonSplit", rtools.getElemFromJsonSplit]]:
+
+        best = float("inf")
+        nbErrors = 0
+
+        for i in range(repeat):
+
+            lookUp = {}
+            nbErrors = 0
+
+            # Each run starts without the fields already parsed
+            rtools.parseJsonField.cache_clear()
+            start = time.perf_counter()
+
+            for json, idLabel, nameLabel, intVal in fields:
+                try:
+                    parser(json, idLabel, nameLabel, lookUp, intVal)
+                except ValueError:
+                    # The split version can fail on the names with commas or colons
+                    nbErrors += 1
+
+            best = min(best, time.perf_counter() - start)
+
+        res[name] = [len(fields) / best, nbBytes / best / 1e6]
+
+        print(name + " : " + str(len(fields)) + " fields in " + str(round(best, 3)) + "s -> "
+              + str(int(res[name][0])) + " fields/s, " + str(round(res[name][1], 2)) + " MB/s"
+              + ("" if nbErrors == 0 else " (" + str(nbErrors) + " errors)"))
+
+    return res
+
+
+
+#--------
+# To compare the search index (MovieSearchIndex.topMovies) with the exact search (all the lists)
+# for several numbers of lists searched
+#--------
+# FeaturesType : the parameters of the movies (string) (the index is built for them if it is not)
+# InputDir : path to the directory of the registered profiles with / at the end (string)
+#            the queries are the registered profiles of FeaturesType, or random vectors if there are none
+# N : number of movies searched per query (integer)
+# nbQueries : maximum number of queries (integer)
+# @return : dict nprobe -> [recall@N, p50 latency (ms), p99 latency (ms)] && print the results
+#--------
+def SearchIndexBenchmark(FeaturesType = "BASIC", InputDir = "", N = 10, nbQueries = 200):
+
+    if not os.path.exists(env.SEARCH_INDEX_FILE + searchIndex.SEARCH_FILES['info']) or searchIndex.MovieSearchIndexRetriever()['FeaturesType'] != FeaturesType:
+        start = time.perf_counter()
+        # On the movie metadata of the profiles, if there are some
+        metadataDir = usrProfiles.UserProfilesMetadataDir(InputDir) if os.path.exists(InputDir + env.PROFILES_COLUMNS) else ""
+        searchIndex.MovieSearchIndexBuilder(FeaturesType, log=True, MetadataDir=metadataDir)
+        print("Index built in " + str(round(time.perf_counter() - start, 2)) + "s")
+
+    index = searchIndex.MovieSearchIndexRetriever()
+
+    queries = None
+    if os.path.exists(InputDir + env.PROFILES_COLUMNS) and usrProfiles.UserProfilesInfo(InputDir)[0] == FeaturesType:
+        queries = usrProfiles.UserProfilesRetriever(FeaturesType, index['columns'], InputDir)[0]
+
+    if queries is None or len(queries) == 0:
+        print("No registered profiles of " + FeaturesType + " : random queries")
+        queries = np.random.default_rng(0).standard_normal((nbQueries, len(index['columns'])))
+
+    queries = np.asarray(queries[:nbQueries], dtype='float32')
+    nbLists = len(index['centroids'])
+
+    # The exact results : all the lists are searched
+    exact = [set(movie_id for movie_id, score in searchIndex.topMovies(query, N, nbLists)) for query in queries]
+
+    res = {}
+
+    for nprobe in sorted(set([1, 2, 4, 8, 16, 32, nbLists])):
+
+        if nprobe > nbLists:
+            continue
+
+        latencies = []
+        found = 0
+
+        for query, expected in zip(queries, exact):
+            start = time.perf_counter()
+            movies = searchIndex.topMovies(query, N, nprobe)
+            latencies += [time.perf_counter() - start]
+            found += len(expected.intersection(movie_id for movie_id, score in movies))
+
+        res[nprobe] = [found / max(1, sum(len(expected) for expected in exact))
+                       , np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 99) * 1e3]
+
+        print("nprobe " + str(nprobe) + "/" + str(nbLists) + " : recall@" + str(N) + " " + str(round(res[nprobe][0], 3))
+              + ", p50 " + str(round(res[nprobe][1], 3)) + "ms, p99 " + str(round(res[nprobe][2], 3)) + "ms")
+
+    return res
+
+
+
+#--------
+# To measure the latency of the prediction server (PredictionServer, already started) under concurrent requests
+#--------
+# InputDir : path to the directory of the registered profiles with / at the end (string) (the users of the requests)
+# port : the port of the server (integer) (0 : env.SERVER_PORT)
+# nbRequests : number of requests (integer)
+# concurrency : number of connections sending requests at the same time (integer)
+# nbMovies : number of movies per /predict request (integer) (one request in 10 is a /top request)
+# @return : dict with the p50 and p99 latencies (ms) seen by the clients, the requests per second, and the server's statistics
+#           && print them
+#--------
+def ServerBenchmark(InputDir = "", port = 0, nbRequests = 2000, concurrency = 32, nbMovies = 20):
+
+    host = env.SERVER_HOST
+    port = port if port != 0 else env.SERVER_PORT
+
+    rng = np.random.default_rng(0)
+    users = np.memmap(InputDir + env.PROFILES_ROWINDEX, dtype='int64', mode='r')
+    movieIds = np.memmap(movMtdata.metadataPath(env.MMDT_ROWINDEX, usrProfiles.UserProfilesMetadataDir(InputDir)), dtype='int64', mode='r')
+
+    targets = []
+    for i in range(nbRequests):
+        user_id = int(users[rng.integers(len(users))])
+        if i % 10 == 9:
+            targets.append("/top?user=" + str(user_id) + "&n=10")
+        else:
+            targets.append("/predict?user=" + str(user_id) + "&movies=" + ",".join(str(movie_id) for movie_id in rng.choice(movieIds, nbMovies).tolist()))
+
+    latencies = []
+
+    async def client(targetsOfClient):
+
+        reader, writer = await asyncio.open_connection(host, port)
+
+        for target in targetsOfClient:
+
+            start = time.perf_counter()
+
+            writer.write(("GET " + target + " HTTP/1.1\r\nHost: " + host + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in [b"\r\n", b""]:
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+
+            body = await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+
+        writer.close()
+
+        return body
+
+    async def run():
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(targets[i::concurrency]) for i in range(concurrency)])
+        seconds = time.perf_counter() - start
+
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(("GET /stats HTTP/1.0\r\nHost: " + host + "\r\n\r\n").encode("latin-1"))
+        answer = await reader.read()
+        writer.close()
+
+        return seconds, json.loads(answer.split(b"\r\n\r\n", 1)[1])
+
+    seconds, serverStats = asyncio.run(run())
+
+    res = {'p50_ms': np.percentile(latencies, 50) * 1e3, 'p99_ms': np.percentile(latencies, 99) * 1e3, 'requests_per_s': nbRequests / seconds, 'server': serverStats}
+
+    print(str(nbRequests) + " requests on " + str(concurrency) + " connections in " + str(round(seconds, 2)) + "s -> " + str(int(res['requests_per_s'])) + " requests/s")
+    print("client : p50 " + str(round(res['p50_ms'], 3)) + "ms, p99 " + str(round(res['p99_ms'], 3)) + "ms")
+    print("server : " + json.dumps(serverStats))
+
+    return res
+
+
+
+def Main():
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ["json", "search", "server"]:
+        print("Usage : python Benchmark.py json [$MovieMetadataFilePath]")
+        print("        python Benchmark.py search [$FeaturesType] [$DirectoryOfProfiles]")
+        print("        python Benchmark.py server [$DirectoryOfProfiles] [$Port]")
+        return
+
+    if sys.argv[1] == "json":
+        JsonParserBenchmark(sys.argv[2] if len(sys.argv) > 2 else "movies_metadata.csv")
+
+    if sys.argv[1] == "search":
+        SearchIndexBenchmark(sys.argv[2] if len(sys.argv) > 2 else "BASIC", sys.argv[3] if len(sys.argv) > 3 else "")
+
+    if sys.argv[1] == "server":
+        ServerBenchmark(sys.argv[2] if len(sys.argv) > 2 else "", int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+#
+# Cross-validation of the engine on the ratings file alone : the ratings are split in folds in memory,
+# the profiles are trained on the other folds and scored on each fold (no evaluation file, no temporary file).
+#
+# By user : the ratings of each user are spread at random over the folds (the fold k is predicted from the other folds).
+# By time : the ratings are split in slices of time (with the timestamp column), the slice k is predicted from the slices before it.
+# With one fold, it is a holdout : env.CV_HOLDOUT_PART of the ratings of each user (by user), or the last ratings (by time).
+#
+# > python CrossValidation.py [$DirectoryOfInputDataFiles] [USER|TIME] [$NbFolds]
+#
+
+import Tools as rtools
+import LinearRegressionGradientDescent as LRGR
+import LRPredictor
+import MovieMetadataReader as movMtdata
+import RatingsReader as ratingsReader
+import env
+
+import multiprocessing
+import numpy as np
+import sys
+import time
+
+
+# The data of the current process (filled by initFoldWorker)
+workerData = {}
+
+
+
+# @foldsOfRatings : To give a fold to each rating
+#-------
+# ratings : dict of numpy.arrays with the keys 'userPtr' and 'timestamp' (as from RatingsReader.RatingsRetriever)
+# nbFolds : number of folds (integer) (1 : holdout)
+# splitBy : "USER" or "TIME" (string)
+# seed : seed of the random split by user (integer)
+# @return : numpy.array (int8) of the fold of each rating
+#       - "USER" : the fold, between 0 and nbFolds - 1 (with one fold : 0 for the predicted ratings, -1 for the others)
+#       - "TIME" : the slice of time, between 0 and nbFolds. The slice 0 is only used for the training.
+#-------
+def foldsOfRatings(ratings, nbFolds, splitBy, seed = 0):
+
+    nbRatings = int(ratings['userPtr'][-1]) if len(ratings['userPtr']) != 0 else 0
+
+    if splitBy == "TIME":
+
+        # The slices have the same number of ratings (the holdout is the last env.CV_HOLDOUT_PART of the ratings)
+        quantiles = [1 - env.CV_HOLDOUT_PART] if nbFolds == 1 else np.arange(1, nbFolds + 1) / (nbFolds + 1)
+        order = np.argsort(ratings['timestamp'], kind='stable')
+
+        folds = np.zeros(nbRatings, dtype='int8')
+        folds[order] = np.searchsorted((np.asarray(quantiles) * nbRatings).astype('int64'), np.arange(nbRatings), side='right')
+
+        return folds
+
+    rng = np.random.default_rng(seed)
+
+    if nbFolds == 1:
+        return np.where(rng.random(nbRatings) < env.CV_HOLDOUT_PART, 0, -1).astype('int8')
+
+    # A random permutation of the folds inside each user : the folds of a user have the same size (by one)
+    positions = np.arange(nbRatings) - np.repeat(ratings['userPtr'][:-1], np.diff(ratings['userPtr']))
+    folds = ((positions + rng.integers(0, nbFolds, len(ratings['userPtr']) - 1).repeat(np.diff(ratings['userPtr']))) % nbFolds).astype('int8')
+
+    # Shuffling the ratings of each user (the order of a user's ratings is kept for the training)
+    shuffle = np.lexsort((rng.random(nbRatings), np.repeat(np.arange(len(ratings['userPtr']) - 1), np.diff(ratings['userPtr']))))
+    folds[shuffle] = folds.copy()
+
+    return folds
+
+if env.TESTMODE:
+    testRatings = {'userPtr': np.array([0, 3, 10]), 'timestamp': np.array([5, 1, 9, 2, 8, 3, 7, 4, 6, 0])}
+    testFolds = foldsOfRatings(testRatings, 3, "USER")
+    # Each user has its ratings in all the folds, with sizes that differ by one at most
+    assert sorted(testFolds[:3].tolist()) == [0, 1, 2] and sorted(np.bincount(testFolds[3:]).tolist()) == [2, 2, 3]
+    # 10 ratings in 3 + 1 slices of time
+    assert foldsOfRatings(testRatings, 3, "TIME").tolist() == [2, 0, 3, 1, 3, 1, 3, 1, 2, 0]
+    assert foldsOfRatings(testRatings, 1, "TIME").tolist() == [0, 0, 1, 0, 1, 0, 0, 0, 0, 0]
+
+
+
+# @foldMasks : To get the ratings used for the training and for the scoring of a fold
+#-------
+# folds : numpy.array of the fold of each rating (see foldsOfRatings)
+# fold : the scored fold (integer) (the first fold is 0)
+# splitBy : "USER" or "TIME" (string)
+# @return : two numpy.arrays of booleans (one per rating) : the training ratings, the scored ratings
+#-------
+def foldMasks(folds, fold, splitBy):
+
+    if splitBy == "TIME":
+        # The slices of time before the scored one
+        return folds <= fold, folds == fold + 1
+
+    return folds != fold, folds == fold
+
+
+
+# @initFoldWorker : To open the ratings in the current process (a worker of the pool, or the main process)
+#-------
+# ratingsFile : path to the ratings file (string) (its cache is built before, see RatingsReader)
+# folds : numpy.array of the fold of each rating (see foldsOfRatings)
+# splitBy : "USER" or "TIME" (string)
+# maxRate : maxRate in data (5 in our case)
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+#-------
+def initFoldWorker(ratingsFile, folds, splitBy, maxRate, MetadataDir = ""):
+
+    ratings = ratingsReader.RatingsRetriever(ratingsFile)[0]
+
+    dfIndex = movMtdata.MovieMetadataFiles(MetadataDir)['dfIndex']
+
+    # dfTF's row of each rating (-1 : the movie is not in our dataset)
+    movieIds = np.array(dfIndex, dtype='int64')
+    order = np.argsort(movieIds, kind='stable')
+    positions = np.minimum(np.searchsorted(movieIds[order], ratings['movieId']), max(0, len(order) - 1))
+    found = (movieIds[order][positions] == ratings['movieId']) if len(order) != 0 else np.zeros(len(ratings['movieId']), dtype=bool)
+
+    workerData['ratings'] = ratings
+    workerData['rows'] = np.where(found, order[positions] if len(order) != 0 else 0, -1)
+    workerData['userOfRating'] = np.repeat(np.arange(len(ratings['userId']), dtype='int64'), np.diff(ratings['userPtr']))
+    workerData['folds'] = folds
+    workerData['splitBy'] = splitBy
+    workerData['maxRate'] = maxRate
+    workerData['MetadataDir'] = MetadataDir
+
+
+
+# @RunFold : To train the profiles on the other folds and score the ratings of a fold
+#-------
+# foldArgs : (fold, FeaturesType, RatingType)
+# @return : [fold, RMSE, MAE, coverage, number of scored ratings, number of ratings of the fold, seconds]
+#-------
+# Only the users with ratings in the fold are trained, by groups of env.SHARD_NB_USERS users (as in EngineRunnerLRPred).
+# The ratings of the movies that are not in our dataset can't be predicted : they lower the coverage.
+#-------
+def RunFold(foldArgs):
+
+    fold, FeaturesType, RatingType = foldArgs
+
+    start = time.time()
+
+    ratings = workerData['ratings']
+    rows = workerData['rows']
+    userOfRating = workerData['userOfRating']
+    maxRate = workerData['maxRate']
+
+    dfTF = movMtdata.MovieMetadataRetriever(LRPredictor.featureTypes[FeaturesType], True, workerData['MetadataDir'])[0]
+
+    trainMask, testMask = foldMasks(workerData['folds'], fold, workerData['splitBy'])
+    trainMask &= rows >= 0
+
+    testRatings = np.flatnonzero(testMask)
+    scoredRatings = testRatings[rows[testRatings] >= 0]
+    trainRatings = np.flatnonzero(trainMask)
+
+    # The users to be trained : with ratings to be scored, and with training ratings
+    nbUsers = len(ratings['userId'])
+    trainCounts = np.bincount(userOfRating[trainRatings], minlength=nbUsers)
+    users = np.unique(userOfRating[scoredRatings])
+    users = users[trainCounts[users] != 0]
+
+    # The training ratings of these users, and the ratings to be scored, in the order of the users
+    trainRatings = trainRatings[np.isin(userOfRating[trainRatings], users)]
+    scoredRatings = scoredRatings[np.isin(userOfRating[scoredRatings], users)]
+    trainPtr = np.concatenate([[0], np.cumsum(trainCounts[users])]).astype('int64')
+    scoredPtr = np.concatenate([[0], np.cumsum(np.bincount(userOfRating[scoredRatings], minlength=nbUsers)[users])]).astype('int64')
+
+    # The rate is divided by maxRate to normalize the value (as in readRatingsByUser)
+    rates = ratings['rating'][trainRatings].astype('float64') / float(maxRate)
+
+    predictions = np.zeros(len(scoredRatings))
+
+    for first in range(0, len(users), env.SHARD_NB_USERS):
+
+        last = min(first + env.SHARD_NB_USERS, len(users))
+        rowsSlice = slice(trainPtr[first], trainPtr[last])
+
+        userProfiles = LRGR.LinearRegressionAllUsers(trainPtr[first:last + 1] - trainPtr[first], rtools.rowsAsArray(dfTF, rows[trainRatings[rowsSlice]]), rates[rowsSlice])
+
+        for user, userProfile in zip(range(first, last), userProfiles):
+            scored = slice(scoredPtr[user], scoredPtr[user + 1])
+            predictions[scored] = LRPredictor.ScoreMovies(userProfile, rows[scoredRatings[scored]], dfTF, maxRate, RatingType)
+
+    targets = {'userId': ratings['userId'][userOfRating[testRatings]], 'movieId': ratings['movieId'][testRatings], 'rating': ratings['rating'][testRatings]}
+    metrics = rtools.evaluationMetrics(targets, {'userId': ratings['userId'][userOfRating[scoredRatings]], 'movieId': ratings['movieId'][scoredRatings], 'rating': predictions})
+
+    return [fold, metrics['RMSE'], metrics['MAE'], metrics['coverage'], metrics['nbScored'], len(testRatings), time.time() - start]
+
+
+
+""" CrossValidationRunner : Main Function """
+# Cross-validation of a configuration of the engine on the ratings file (see the top of the file).
+#-------
+# ratingsFile : path to the ratings file (string)
+# FeaturesType, RatingType : the configuration (strings) (see EngineRunnerLRPred)
+# nbFolds : number of folds (integer) (0 : env.CV_NB_FOLDS, 1 : holdout)
+# splitBy : "USER" or "TIME" (string) (empty : env.CV_SPLIT)
+# log : to display the logs
+# nbWorkers : number of processes, a fold per process (integer) (0 : env.NB_WORKERS, 1 : no parallelization)
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : list of [fold, RMSE, MAE, coverage, number of scored ratings, number of ratings of the fold, seconds] per fold,
+#           and the aggregate RMSE (on all the scored ratings) && print them
+#-------
+# The movie metadata must have been processed before (see MovieMetadataReader.MovieMetadataProcessor).
+# The learning rate and the epochs are env.LEARNINGRATE and env.EPOCHS.
+#-------
+def CrossValidationRunner(ratingsFile, FeaturesType = "INTERMEDIATE", RatingType = "DOTPRODUCT", nbFolds = 0, splitBy = "", log = False, nbWorkers = 0, MetadataDir = ""):
+
+    if FeaturesType not in LRPredictor.featureTypes:
+        print("FeaturesType not right")
+        return [], 0
+
+    if RatingType not in ["DOTPRODUCT", "BRAYCURTIS", "COSINE"]:
+        print("DistanceType not right")
+        return [], 0
+
+    if nbFolds == 0:
+        nbFolds = env.CV_NB_FOLDS
+
+    if splitBy == "":
+        splitBy = env.CV_SPLIT
+
+    if splitBy not in ["USER", "TIME"]:
+        print("splitBy not right")
+        return [], 0
+
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+
+    # Max value of rating
+    maxRate = 5
+
+    start = time.time()
+
+    # The cache of the ratings is built once, before the workers open it
+    ratings = ratingsReader.RatingsRetriever(ratingsFile, log)[0]
+    folds = foldsOfRatings(ratings, nbFolds, splitBy, env.CV_SEED)
+
+    if not env.MMDT_SPARSE:
+        movMtdata.MovieMetadataNormalizedFile(LRPredictor.featureTypes[FeaturesType], MetadataDir)
+
+    workerArgs = (ratingsFile, folds, splitBy, maxRate, MetadataDir)
+    foldsArgs = [(fold, FeaturesType, RatingType) for fold in range(nbFolds)]
+
+    if nbWorkers == 1:
+        initFoldWorker(*workerArgs)
+        res = list(map(RunFold, foldsArgs))
+    else:
+        with multiprocessing.Pool(min(nbWorkers, nbFolds), initializer=initFoldWorker, initargs=workerArgs) as pool:
+            res = pool.map(RunFold, foldsArgs)
+
+    nbScored = sum(row[4] for row in res)
+    aggregateRMSE = np.sqrt(sum(row[1] ** 2 * row[4] for row in res) / nbScored) if nbScored != 0 else 0
+
+    print("Cross-validation " + FeaturesType + " " + RatingType + " by " + splitBy + " : " + str(nbFolds) + (" folds" if nbFolds > 1 else " holdout"))
+    for fold, rmse, mae, coverage, scored, nbRatings, seconds in res:
+        print("fold " + str(fold) + " : rmse " + str(round(rmse, 4)) + ", mae " + str(round(mae, 4)) + ", coverage " + str(round(coverage, 4))
+              + " (" + str(scored) + " of " + str(nbRatings) + " ratings), " + str(round(seconds, 2)) + "s")
+    print("Aggregate rmse : " + str(round(aggregateRMSE, 4)) + " (folds : mean " + str(round(np.mean([row[1] for row in res]), 4))
+          + ", std " + str(round(np.std([row[1] for row in res]), 4)) + ")")
+
+    if log:
+        print("Cross-validation execution time : " + str(time.time() - start))
+
+    return res, aggregateRMSE
+
+
+
+if __name__ == "__main__":
+
+    dataDirectory = sys.argv[1] if len(sys.argv) > 1 else ""
+    splitBy = sys.argv[2] if len(sys.argv) > 2 else ""
+    nbFolds = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    metadataDir = movMtdata.MovieMetadataProcessor(dataDirectory + env.IN_MOVIES_METADATA, "", False)
+
+    CrossValidationRunner(dataDirectory + env.IN_RATINGS, env.FEATURE_TYPE, env.RATING_TYPE, nbFolds, splitBy, MetadataDir = metadataDir)
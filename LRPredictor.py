@@ -3,78 +3,587 @@
 # Algorithm that will train using previous ratings and predict on new values.
 # It will take the already processed MoviesMetadata (.dat) to train.
 #
-# Warning : it is assumed that the training file (ratings.csv) has the users in sorted and in order
+# The training file (ratings.csv) doesn't need to be sorted by users (see sortingRatingsByUser)
 #
 
 import Tools as rtools
 import LinearRegressionGradientDescent as LRGR
 import MovieMetadataReader as movMtdata
+import RatingsReader as ratingsReader
+
+import env
 
 import csv
+import os
 import time
+import heapq
+import shutil
+import operator
+import tempfile
+import itertools
+import multiprocessing
+import numpy as np
 from scipy.spatial import distance
+import UserProfiles as usrProfiles
 
 
+# The options of the list of parameters that can be used (see EngineRunnerLRPred)
+featureTypes = {"BASIC":["genre", "releaseDate"]
+, "INTERMEDIATE": ["genre", "releaseDate", "popularity", "voteAverage"]
+, "ADVANCED": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime"]
+, "ALL": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime", "collection", "language"]}
 
-# @RunPrediction : To Run the training on an user and making predictions for a list of movies
+
+# @RoundScores : To turn the scores of ScoreMovies into ratings
+#-------
+# pred : numpy.array of the scores
+# maxRate : maxRate in data (5 in our case)
+# @return : numpy.array of the predictions, rounded at 0.5 and bounded by maxRate
+#-------
+def RoundScores(pred, maxRate):
+    
+    # To round the prediction at 0.5 (adding 0. to avoid writing -0.0)
+    pred = np.round(pred * 2) / 2 + 0.
+    
+    # Needs a better solution, in case the value is too big
+    return np.minimum(pred, maxRate)
+
+
+
+# @ScoreMovies : To compute, in one matrix operation, the predictions of a user profile for a set of movies
+#-------
+# userProfile : numpy.array of the user's feature vector (as returned by the gradient descent)
+# moviesRows : list (or numpy.array) of dfTF's row numbers of the movies to be rated (integers)
+# dfTF : numpy.array (or scipy.sparse matrix) of the movie's feature vector
+# maxRate : maxRate in data (5 in our case)
+# RatingType : how to compute the prediction from the userProfile (string) (see below the main function for further understanding)
+# @return : numpy.array of the predictions, rounded at 0.5 and bounded by maxRate (one per row of moviesRows)
+#-------
+def ScoreMovies(userProfile, moviesRows, dfTF, maxRate, RatingType):
+    
+    # The feature vectors of all the movies to be rated (a matrix Num_Movies x Num_Parameters)
+    movies = rtools.rowsAsArray(dfTF, moviesRows)
+    userProfile = np.asarray(userProfile, dtype='float64')
+    
+    if RatingType == "DOTPRODUCT":
+        pred = movies.dot(userProfile)
+        
+    elif RatingType == "COSINE":
+        # Cosine distance : 1 - (u.v) / (|u| * |v|), as in scipy.spatial.distance.cosine
+        norms = np.sqrt(np.einsum('ij,ij->i', movies, movies)) * np.sqrt(userProfile.dot(userProfile))
+        pred = np.clip(1.0 - movies.dot(userProfile) / norms, 0.0, 2.0) * maxRate
+        
+    elif RatingType == "BRAYCURTIS":
+        # Bray-Curtis distance : Sum(|u - v|) / Sum(|u + v|), as in scipy.spatial.distance.braycurtis
+        pred = np.abs(movies - userProfile).sum(axis=1) / np.abs(movies + userProfile).sum(axis=1) * maxRate
+        
+    else :
+        # For safety, but will not be called.
+        pred = np.full(len(movies), maxRate / 2.)
+    
+    return RoundScores(pred, maxRate)
+
+if env.TESTMODE:
+    testTF = rtools.normalize(np.array([[1,0,0,1,0],[0,1,1,0,0],[1,1,0,0,1]]))
+    testProfile = np.array([0.5,-0.2,0.1,0.9,0.3])
+    for testType, testDist in [["DOTPRODUCT", None], ["COSINE", distance.cosine], ["BRAYCURTIS", distance.braycurtis]]:
+        testPred = ScoreMovies(testProfile, [2, 0], testTF, 5, testType)
+        for testPos, testRow in enumerate([2, 0]):
+            testRef = testTF[testRow].dot(testProfile) if testDist is None else testDist(testTF[testRow], testProfile) * 5
+            assert testPred[testPos] == min(round(testRef * 2) / 2, 5)
+
+
+
+# @ScorePairs : To compute, in one matrix operation, the scores of many couples (user profile, movie) (as ScoreMovies, before RoundScores)
+#-------
+# userProfiles : numpy.array (Num_Couples x Num_Parameters) of the profiles
+# movies : numpy.array (Num_Couples x Num_Parameters) of the movies' feature vectors (the row i is scored with the profile i)
+# maxRate, RatingType : as in ScoreMovies
+# @return : numpy.array of the scores (one per couple)
+#-------
+def ScorePairs(userProfiles, movies, maxRate, RatingType):
+    
+    userProfiles = np.asarray(userProfiles, dtype='float64')
+    movies = np.asarray(movies, dtype='float64')
+    
+    if RatingType == "DOTPRODUCT":
+        return np.einsum('ij,ij->i', movies, userProfiles)
+    
+    if RatingType == "COSINE":
+        norms = np.sqrt(np.einsum('ij,ij->i', movies, movies)) * np.sqrt(np.einsum('ij,ij->i', userProfiles, userProfiles))
+        return np.clip(1.0 - np.einsum('ij,ij->i', movies, userProfiles) / norms, 0.0, 2.0) * maxRate
+    
+    if RatingType == "BRAYCURTIS":
+        return np.abs(movies - userProfiles).sum(axis=1) / np.abs(movies + userProfiles).sum(axis=1) * maxRate
+    
+    return np.full(len(movies), maxRate / 2.)
+
+
+
+# @ScoreAllMovies : To compute the scores of all the movies for several user profiles (as ScorePairs, for every couple)
+#-------
+# userProfiles : numpy.array (Num_Users x Num_Parameters) of the profiles
+# dfTF : numpy.array (Num_Movies x Num_Parameters) of the movie's feature vectors (or scipy.sparse matrix)
+# maxRate, RatingType : as in ScoreMovies
+# blockRows : number of movies scored at once by BRAYCURTIS (its values are Num_Users x blockRows x Num_Parameters)
+#             (0 : as many as env.SCORE_BLOCK_VALUES values allow)
+# @return : numpy.array (Num_Users x Num_Movies) of the scores
+#-------
+def ScoreAllMovies(userProfiles, dfTF, maxRate, RatingType, blockRows = 0):
+    
+    userProfiles = np.asarray(userProfiles, dtype='float64')
+    movies = rtools.rowsAsArray(dfTF, slice(None))
+    
+    if RatingType in ["DOTPRODUCT", "COSINE"]:
+        
+        dots = userProfiles.dot(movies.T)
+        
+        if RatingType == "DOTPRODUCT":
+            return dots
+        
+        norms = np.sqrt(np.einsum('ij,ij->i', userProfiles, userProfiles))[:, np.newaxis] * np.sqrt(np.einsum('ij,ij->i', movies, movies))[np.newaxis, :]
+        return np.clip(1.0 - dots / norms, 0.0, 2.0) * maxRate
+    
+    if RatingType == "BRAYCURTIS":
+        
+        scores = np.zeros((len(userProfiles), len(movies)))
+        
+        # The memory of a block doesn't depend on the number of users
+        if blockRows == 0:
+            blockRows = max(1, env.SCORE_BLOCK_VALUES // max(1, len(userProfiles) * movies.shape[1]))
+        
+        for first in range(0, len(movies), blockRows):
+            block = movies[np.newaxis, first:first + blockRows, :]
+            profiles = userProfiles[:, np.newaxis, :]
+            scores[:, first:first + blockRows] = np.abs(block - profiles).sum(axis=2) / np.abs(block + profiles).sum(axis=2) * maxRate
+        
+        return scores
+    
+    return np.full((len(userProfiles), len(movies)), maxRate / 2.)
+
+if env.TESTMODE:
+    testProfiles = np.array([[0.5,-0.2,0.1,0.9,0.3], [0.1,0.4,-0.3,0.2,0.6]])
+    for testType in ["DOTPRODUCT", "COSINE", "BRAYCURTIS"]:
+        testAll = ScoreAllMovies(testProfiles, testTF, 5, testType, 2)
+        assert np.allclose(ScoreAllMovies(testProfiles, testTF, 5, testType), testAll)
+        for testUser in range(2):
+            testPred = ScoreMovies(testProfiles[testUser], [0, 1, 2], testTF, 5, testType)
+            assert np.allclose(ScorePairs(np.tile(testProfiles[testUser], (3, 1)), testTF, 5, testType), testAll[testUser])
+            assert RoundScores(testAll[testUser], 5).tolist() == testPred.tolist()
+
+
+
+# @PredictionsFromProfile : To make predictions of a user profile for a list of movies
 #-------
 # user_id : the user id (integer)
-# userRatedMovies : list of numpy.array and float (example [ np.array([1,2,0,1,2]), 5, np.array([1,2,7,1,2]), 0])
-#                   Alternatively, there will be each instance and their ratings (x and t).
-#                   In the example : x_1 = np.array([1,2,0,1,2]), t_1 = 5, x_2 = np.array([1,2,7,1,2]), t_1 = 0
+# userProfile : numpy.array of the user's feature vector
 # moviesToBeRated : list of movie_id that want ratings (list of strings)
 # dfTF : numpy.array of the movie's feature vector
-# dfIndex : dfTF's row indexes as a list of strings
+# dfLookUp : dict that gives dfTF's row number of a movie_id (dict string -> integer)
 # maxRate : maxRate in data (5 in our case)
 # RatingType : how to compute the prediction from the userProfile (string) (see below the main function for further understanding)
 # @return : (string) the predictions will be saved in the output string. (a line per prediction)
 #-------
-def RunPrediction(user_id, userRatedMovies, moviesToBeRated, dfTF, dfIndex, maxRate, RatingType):
+def PredictionsFromProfile(user_id, userProfile, moviesToBeRated, dfTF, dfLookUp, maxRate, RatingType):
+    
+    # Keeping only the movies that are in our dataset, and their row numbers
+    moviesRated = [movieid for movieid in moviesToBeRated if movieid in dfLookUp]
+    
+    if len(moviesRated) == 0:
+        return ""
+    
+    moviesRows = [dfLookUp[movieid] for movieid in moviesRated]
+    
+    # Make all the predictions at once
+    preds = ScoreMovies(userProfile, moviesRows, dfTF, maxRate, RatingType)
+    
+    # write the ratings in the output string (a line per prediction)
+    prefix = str(user_id) + ","
+    
+    return "".join([prefix + movieid + "," + str(pred) + "\n" for movieid, pred in zip(moviesRated, preds.tolist())])
 
-    predictions = ""
+
+
+# @RunPrediction : To Run the training on an user and making predictions for a list of movies
+#-------
+# user_id : the user id (integer)
+# moviesX : numpy.array (Num_Movies x Num_Parameters) of the rated movies' feature vectors (x)
+# ratesT : numpy.array (Num_Movies) of their ratings (t)
+# moviesToBeRated, dfTF, dfLookUp, maxRate, RatingType : as in PredictionsFromProfile
+# @return : (string) the predictions will be saved in the output string. (a line per prediction)
+#-------
+def RunPrediction(user_id, moviesX, ratesT, moviesToBeRated, dfTF, dfLookUp, maxRate, RatingType):
     
     # Computing the Linear Regression to find the user profile
-    userProfile = LRGR.LinearRegressionGradientDescent(userRatedMovies)
+    userProfile = LRGR.LinearRegressionSolver(moviesX, ratesT)
+    
+    return PredictionsFromProfile(user_id, userProfile, moviesToBeRated, dfTF, dfLookUp, maxRate, RatingType)
+
+
+
+# @usersToCSR : To gather the ratings of many users as a CSR structure (user -> movie rows, ratings)
+#-------
+# usersRatings : list of (user_id, list of movie_id, list of rates, ...) (as in a shard)
+# dfLookUp : dict that gives dfTF's row number of a movie_id (dict string -> integer)
+# @return : kept (list of the positions in usersRatings of the users with at least one movie in our dataset),
+#           userPtr (numpy.array, first position of each kept user in ratedRows), 
+#           ratedRows (numpy.array of dfTF's row numbers), ratedRates (numpy.array of the rates)
+#-------
+def usersToCSR(usersRatings, dfLookUp):
+    
+    kept = []
+    userPtr = [0]
+    ratedRows = []
+    ratedRates = []
     
-    # For every movie that needs prediction
-    for movieid in moviesToBeRated:
+    for position, user in enumerate(usersRatings):
         
-        # If the movie is in our dataset
-        if movieid in dfIndex:
+        movieIds, rates = user[1], user[2]
+        
+        # The rated movies and their ratings (only the ones within our movie's database)
+        rows = [dfLookUp[movie_id] for movie_id in movieIds if movie_id in dfLookUp]
+        
+        if len(rows) == 0:
+            continue
+        
+        kept.append(position)
+        ratedRows += rows
+        ratedRates += [rate for movie_id, rate in zip(movieIds, rates) if movie_id in dfLookUp]
+        userPtr.append(len(ratedRows))
+    
+    return kept, np.array(userPtr, dtype='int64'), np.array(ratedRows, dtype='int64'), np.array(ratedRates)
+
+
+
+# The Movie's Metadata of the current process (filled by initWorker)
+workerData = {}
+
+
+
+# @initWorker : To open the Movie's Metadata in the current process (a worker of the pool, or the main process)
+#-------
+# neededColumns : list of string indicating the columns (parameters) of the data that will be kept.
+# RatingType : how to compute the prediction from the userProfile (string)
+# maxRate : maxRate in data (5 in our case)
+# MetadataDir : the directory of the processed Movie's Metadata (string) (see MovieMetadataReader.metadataPath)
+# log : to display the logs
+# @return : (void) workerData will be filled with dfTF (normalized), dfLookUp, RatingType and maxRate
+#-------
+# Each worker opens the same normalized movieDF memmap (read only) rather than receiving the matrix from the main process.
+# The normalized matrix is registered by the first run (see MovieMetadataReader.MovieMetadataNormalizedFile).
+#-------
+def initWorker(neededColumns, RatingType, maxRate, MetadataDir = "", log = False):
+    
+    if log:
+        print("----------------------------------------")
+        print("Reading Movie's Metadata from .dat files")
+        print("----------------------------------------")
+    
+    start = time.time()
+    
+    # Getting the MovieMetadata as normalized matrix, its row indexes as list of strings and the LookUp movie_id -> row
+    dfTF, dfIndex, dfLookUp = movMtdata.MovieMetadataRetriever(neededColumns, True, MetadataDir)
+                                                                  
+    end = time.time()
+    if log:
+        print( "Reading Memmap normalized DataMatrix & index execution time : " + str(end - start)) 
+    
+    workerData['dfTF'] = dfTF
+    workerData['dfLookUp'] = dfLookUp
+    workerData['RatingType'] = RatingType
+    workerData['maxRate'] = maxRate
+
+
+
+# @RunPredictionShard : To Run the training and the predictions for a shard of users
+#-------
+# shard : list of (user_id, list of movie_id rated, list of rates, list of movie_id to be rated)
+# @return : (string) the predictions of all the users of the shard, in the same order. (a line per prediction)
+#-------
+# All the users of the shard are trained at once (LinearRegressionAllUsers)
+#-------
+def RunPredictionShard(shard):
+    
+    dfTF = workerData['dfTF']
+    dfLookUp = workerData['dfLookUp']
+    
+    kept, userPtr, ratedRows, ratedRates = usersToCSR(shard, dfLookUp)
+    
+    # The users' profiles (a row per kept user)
+    userProfiles = LRGR.LinearRegressionAllUsers(userPtr, rtools.rowsAsArray(dfTF, ratedRows), ratedRates)
+    
+    predictions = []
+    
+    for position, userProfile in zip(kept, userProfiles):
+        
+        user_id, moviesToBeRated = shard[position][0], shard[position][3]
+        
+        predictions.append(PredictionsFromProfile(user_id, userProfile, moviesToBeRated, dfTF, dfLookUp, workerData['maxRate'], workerData['RatingType']))
+    
+    return "".join(predictions)
+
+
+
+# @TrainShard : To Run the training for a shard of users
+#-------
+# shard : list of (user_id, list of movie_id rated, list of rates, ...)
+# @return : the user ids (numpy.array) and their profiles (numpy.array Num_Users x Num_Parameters)
+#           (only the users with at least one movie in our dataset)
+#-------
+def TrainShard(shard):
+    
+    dfTF = workerData['dfTF']
+    
+    kept, userPtr, ratedRows, ratedRates = usersToCSR(shard, workerData['dfLookUp'])
+    
+    userIds = np.array([shard[position][0] for position in kept], dtype='int64')
+    
+    return userIds, LRGR.LinearRegressionAllUsers(userPtr, rtools.rowsAsArray(dfTF, ratedRows), ratedRates)
+
+
+
+# @UpdateShard : To continue the training for a shard of users from their current profiles
+#-------
+# shard : list of (user_id, list of movie_id rated, list of rates, current profile (numpy.array) or None for a new user)
+# @return : the user ids (numpy.array) and their updated profiles (numpy.array Num_Users x Num_Parameters)
+#           (only the users with at least one movie in our dataset)
+#-------
+def UpdateShard(shard):
+    
+    dfTF = workerData['dfTF']
+    
+    kept, userPtr, ratedRows, ratedRates = usersToCSR(shard, workerData['dfLookUp'])
+    
+    userIds = np.array([shard[position][0] for position in kept], dtype='int64')
+    moviesX = rtools.rowsAsArray(dfTF, ratedRows)
+    
+    # The initialization : the current profile, or the first movie's profile for a new user
+    thetas = np.array(moviesX[userPtr[:-1]], dtype='float64')
+    for row, position in enumerate(kept):
+        if shard[position][3] is not None:
+            thetas[row] = shard[position][3]
+    
+    return userIds, LRGR.LinearRegressionAllUsers(userPtr, moviesX, ratedRates, thetas = thetas)
+
+
+
+# @readRatingsRows : To read the training file, row per row
+#-------
+# trainingFile : path to the ratings file (string)
+# maxRate : maxRate in data (5 in our case). The rates are divided by it.
+# counts : dict with the keys 'rownum' and 'errornum', updated with the number of read and skipped lines (dict)
+# log : to display the logs
+# @return : generator of (user_id (integer), movie_id (string), rate (float)), in the order of the file
+#-------
+def readRatingsRows(trainingFile, maxRate, counts, log = False):
+    
+    # The file is read by chunks of typed columns
+    for chunk in rtools.readCsvArraysChunks(trainingFile, rtools.RATINGS_COLUMNS, counts, log):
+        
+        # rate : The rate is divided by maxRate to normalize the value
+        rates = chunk['rating'].astype('float64') / float(maxRate)
+        
+        yield from zip(chunk['userId'].tolist(), chunk['movieId'].astype(str).tolist(), rates.tolist())
+
+
+
+# @sortingRatingsByUser : To sort the ratings by user_id, with a bounded memory (external sort)
+#-------
+# ratingsRows : iterable of (user_id, movie_id, rate) in any order (as from readRatingsRows)
+# chunkRows : maximum number of rows kept in memory (integer) (0 : env.SORT_CHUNK_ROWS)
+# tmpDir : directory of the temporary chunk files (string) (empty : env.SORT_TMP_DIR, or the system's one)
+# @return : generator of (user_id, movie_id, rate) sorted by user_id.
+#           The ratings of a same user stay in the order of the file.
+#-------
+# The rows are read by chunks of chunkRows. Each chunk is sorted and written to a temporary file,
+# then the files are merged (heapq.merge). If all the rows fit in one chunk, nothing is written.
+#-------
+def sortingRatingsByUser(ratingsRows, chunkRows = 0, tmpDir = ""):
+    
+    if chunkRows == 0:
+        chunkRows = env.SORT_CHUNK_ROWS
+    
+    if tmpDir == "":
+        tmpDir = env.SORT_TMP_DIR
+    
+    ratingsRows = iter(ratingsRows)
+    
+    # The first chunk
+    chunk = list(itertools.islice(ratingsRows, chunkRows))
+    
+    # sort is stable : the order of the file is kept for a same user
+    chunk.sort(key=operator.itemgetter(0))
+    
+    if len(chunk) < chunkRows:
+        
+        # All the rows are in memory
+        yield from chunk
+        return
+    
+    spillDir = tempfile.mkdtemp(prefix="ratings_", dir=(tmpDir if tmpDir != "" else None))
+    spillFiles = []
+    
+    try:
+        
+        while len(chunk) != 0:
             
-            # Get the movie index in the indexes list
-            movieIndex = list(dfIndex).index(movieid)
-                            
-            # Make prediction
+            # Writing the sorted chunk
+            spillName = os.path.join(spillDir, "chunk_" + str(len(spillFiles)) + ".csv")
+            with open(spillName, "w", encoding="utf8") as output:
+                writer = csv.writer(output, lineterminator='\n')
+                writer.writerows(chunk)
+            spillFiles.append(spillName)
             
-            if RatingType == "DOTPRODUCT":                            
-                pred = dfTF[movieIndex].dot(userProfile)
-                
-            elif RatingType == "COSINE":
-                pred = distance.cosine(dfTF[movieIndex], userProfile) * maxRate
-                
-            elif RatingType == "BRAYCURTIS":
-                pred = distance.braycurtis(dfTF[movieIndex], userProfile) * maxRate
-                
-            else :
-                # For safety, but will not be called.
-                pred = maxRate / 2.
-                
-            # To round the prediction at 0.5
-            pred = round(pred * 2) /2
+            chunk = list(itertools.islice(ratingsRows, chunkRows))
+            chunk.sort(key=operator.itemgetter(0))
+        
+        inputs = [open(spillName, "r", encoding="utf8") for spillName in spillFiles]
+        
+        try:
             
-            # Needs a better solution, in case the value is too big
-            if pred > maxRate: 
-                pred = maxRate
-                         
-            # write this rating in the output string
-            predictions += str(user_id) + "," + str(movieid) + "," + str(pred) + "\n"
+            # The chunks are read back in the order of the file : heapq.merge keeps this order for a same user
+            readers = [((int(row[0]), row[1], float(row[2])) for row in csv.reader(ifile)) for ifile in inputs]
+            yield from heapq.merge(*readers, key=operator.itemgetter(0))
             
-                
-        #else: 
-            #print("Skipped Movie item, because not in the index : " + movieid)
+        finally:
+            for ifile in inputs:
+                ifile.close()
+    
+    finally:
+        shutil.rmtree(spillDir, ignore_errors=True)
+
+
+
+# @groupingRatingsByUser : To group the ratings of consecutive rows of a same user
+#-------
+# ratingsRows : iterable of (user_id, movie_id, rate), sorted by user_id
+# @return : generator of (user_id (integer), list of movie_id (strings), list of rates (floats))
+#-------
+def groupingRatingsByUser(ratingsRows):
+    
+    last_user_id = None
+    movieIds = []
+    rates = []
+    
+    for user_id, movie_id, rate in ratingsRows:
+        
+        # A new user is being read ... Give the last user
+        if user_id != last_user_id:
             
-    return predictions
+            if len(movieIds) != 0:
+                yield last_user_id, movieIds, rates
+            
+            # Remise à Zéro : To pass unto the new user
+            last_user_id = user_id
+            movieIds = []
+            rates = []
+        
+        movieIds.append(movie_id)
+        rates.append(rate)
+    
+    # The last user of the file
+    if len(movieIds) != 0:
+        yield last_user_id, movieIds, rates
+
+
+
+# @cacheRatingsByUser : To get the ratings by user from the ratings' cache (see RatingsReader)
+#-------
+# trainingFile : path to the ratings file (string)
+# maxRate : maxRate in data (5 in our case). The rates are divided by it.
+# counts : dict with the keys 'rownum' and 'errornum', updated with the number of ratings and skipped lines (dict)
+# log : to display the logs
+# @return : generator of (user_id (integer), list of movie_id (strings), list of rates (floats)), sorted by user_id
+#-------
+def cacheRatingsByUser(trainingFile, maxRate, counts, log = False):
+    
+    ratings, errornum = ratingsReader.RatingsRetriever(trainingFile, log)
+    
+    userPtr = ratings['userPtr']
+    nbUsers = len(ratings['userId'])
+    
+    counts['rownum'] += int(userPtr[-1]) if len(userPtr) != 0 else 0
+    counts['errornum'] += errornum
+    
+    # By blocks of users, to convert the columns at once
+    for first in range(0, nbUsers, 10000):
+        
+        last = min(first + 10000, nbUsers)
+        ptr = (userPtr[first:last + 1] - userPtr[first]).tolist()
+        rows = slice(userPtr[first], userPtr[last])
+        
+        users = ratings['userId'][first:last].tolist()
+        movieIds = ratings['movieId'][rows].astype(str).tolist()
+        rates = (ratings['rating'][rows].astype('float64') / float(maxRate)).tolist()
+        
+        for pos, user_id in enumerate(users):
+            yield user_id, movieIds[ptr[pos]:ptr[pos + 1]], rates[ptr[pos]:ptr[pos + 1]]
+
+
+
+# @readRatingsByUser : To read the training file and group the ratings by user
+#-------
+# trainingFile : path to the ratings file (string)
+# maxRate : maxRate in data (5 in our case). The rates are divided by it.
+# counts : dict with the keys 'rownum' and 'errornum', updated with the number of read and skipped lines (dict)
+# log : to display the logs
+# sortedUsers : True if the users are already sorted in the file, False to sort them first (see sortingRatingsByUser)
+#               (None : env.RATINGS_SORTED)
+# useCache : True to read the ratings from their .dat cache (built if needed, see RatingsReader) (None : env.RATINGS_CACHE)
+# @return : generator of (user_id (integer), list of movie_id (strings), list of rates (floats))
+#-------
+def readRatingsByUser(trainingFile, maxRate, counts, log = False, sortedUsers = None, useCache = None):
+    
+    if useCache is None:
+        useCache = env.RATINGS_CACHE
+    
+    if useCache:
+        # The cache is sorted by users
+        return cacheRatingsByUser(trainingFile, maxRate, counts, log)
+    
+    if sortedUsers is None:
+        sortedUsers = env.RATINGS_SORTED
+    
+    ratingsRows = readRatingsRows(trainingFile, maxRate, counts, log)
+    
+    if not sortedUsers:
+        ratingsRows = sortingRatingsByUser(ratingsRows)
+    
+    return groupingRatingsByUser(ratingsRows)
+
+if env.TESTMODE:
+    # Three chunks of two rows : the user 1 is in the first and the last chunk
+    testRows = [(2, "a", 0.1), (1, "b", 0.2), (3, "c", 0.3), (2, "d", 0.4), (1, "e", 0.5)]
+    assert list(groupingRatingsByUser(sortingRatingsByUser(testRows, 2))) == [(1, ["b", "e"], [0.2, 0.5]), (2, ["a", "d"], [0.1, 0.4]), (3, ["c"], [0.3])]
+    assert list(groupingRatingsByUser(sortingRatingsByUser(testRows, 10))) == [(1, ["b", "e"], [0.2, 0.5]), (2, ["a", "d"], [0.1, 0.4]), (3, ["c"], [0.3])]
+
+
+
+# @shardingUsers : To group the users needed for the evaluation by shards
+#-------
+# usersRatings : generator of (user_id, list of movie_id, list of rates) (as from readRatingsByUser)
+# evalutionByUser : dict user_id -> list of movie_id to be rated (as from Tools.readCsvEvaluationData)
+#                   None to keep all the users (with no movie to be rated)
+# shardSize : number of users per shard (integer)
+# @return : generator of shards, a shard is a list of (user_id, list of movie_id, list of rates, list of movie_id to be rated)
+#-------
+def shardingUsers(usersRatings, evalutionByUser, shardSize):
+    
+    shard = []
+    
+    for user_id, movieIds, rates in usersRatings:
+        
+        # This user is needed for the evaluation
+        if evalutionByUser is None or user_id in evalutionByUser:
+            
+            shard.append((user_id, movieIds, rates, [] if evalutionByUser is None else evalutionByUser[user_id]))
+            
+            if len(shard) == shardSize:
+                yield shard
+                shard = []
+    
+    if len(shard) != 0:
+        yield shard
 
 
 
@@ -94,17 +603,13 @@ def RunPrediction(user_id, userRatedMovies, moviesToBeRated, dfTF, dfIndex, maxR
 #              "COSINE" is to take the cosine distance between the userProfile and the movie Feature Vecture
 #              "BRAYCURTIS" is to take the bray-curtis distance (used in biology)
 # log : to display the logs
+# nbWorkers : number of processes that will train and predict the users (integer) (0 : env.NB_WORKERS, 1 : no parallelization)
+# shardSize : number of users given at once to a worker (integer) (0 : env.SHARD_NB_USERS)
+# MetadataDir : the directory of the processed Movie's Metadata (string) (see MovieMetadataReader.metadataPath)
 # @return : the output will saved it a file (path should be indicated in FileArgs[2])
 #
 #
-def EngineRunnerLRPred(FileArgs, FeaturesType = "BASIC", RatingType = "DOTPRODUCT", log = True):
-    
-    # The options of the list of parameters that can be used
-    featureTypes = {"BASIC":["genre", "releaseDate"]
-    , "INTERMEDIATE": ["genre", "releaseDate", "popularity", "voteAverage"]
-    , "ADVANCED": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime"]
-    , "ALL": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime", "collection", "language"]}
-        
+def EngineRunnerLRPred(FileArgs, FeaturesType = "BASIC", RatingType = "DOTPRODUCT", log = True, nbWorkers = 0, shardSize = 0, MetadataDir = ""):
     
     # Checking that all the parameters have been specified
     
@@ -125,147 +630,326 @@ def EngineRunnerLRPred(FileArgs, FeaturesType = "BASIC", RatingType = "DOTPRODUC
         return
     
     
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+    
+    if shardSize == 0:
+        shardSize = env.SHARD_NB_USERS
+    
+    # Max value of rating 
+    maxRate = 5
+    
+    # The arguments to open the Movie's Metadata (in this process or in each worker)
+    workerArgs = (featureTypes[FeaturesType], RatingType, maxRate, MetadataDir)
+    
+    if nbWorkers == 1:
+        # Without parallelization, the Movie's Metadata is opened in this process
+        initWorker(*workerArgs, log)
+    elif not env.MMDT_SPARSE:
+        # The normalized matrix is registered once, before the workers open it
+        movMtdata.MovieMetadataNormalizedFile(featureTypes[FeaturesType], MetadataDir)
+    
+    
     if log:
-        print("----------------------------------------")
-        print("Reading Movie's Metadata from .dat files")
-        print("----------------------------------------")
+        print("--------------------------------")
+        print("Reading Evaluation Ratings")
+        print("--------------------------------")
     
     start = time.time()
     
-    # Getting the MovieMetadata as matrix and its row indexes as list of strings
-    dfTF, dfIndex = movMtdata.MovieMetadataRetriever(featureTypes[FeaturesType])
-                                                                  
+    evalutionByUser = rtools.readCsvEvaluationData(testFile, log)
+    
     end = time.time()
     if log:
-        print( "Reading Memmap DataMatrix & index execution time : " + str(end - start)) 
+        print( "Reading the evaluation file execution time : " + str(end - start))
     
     
     if log:
-        print("-----------------------------------")
-        print("Normalize Data Frame on Movie Data")
-        print("-----------------------------------")    
+        print("---------------------------------------------")
+        print("Reading Ratings And Online Prediction by user")
+        print("---------------------------------------------")
     
     start = time.time()
     
-    dfTF = rtools.normalize(dfTF)
+    # To count the read and skipped lines of the trainingFile
+    counts = {'rownum': 0, 'errornum': 0}
     
+    # The shards of users (only the ones needed for the evaluation)
+    usersRatings = readRatingsByUser(trainingFile, maxRate, counts, log)
+    shards = shardingUsers(usersRatings, evalutionByUser, shardSize)
+    
+    # Opening the outputFile to write the output
+    ofile = open(outputFile, "w", encoding="utf8")
+    ofile.write("userId,movieId,rating\n")
+    
+    if nbWorkers == 1:
+        
+        for predictions in map(RunPredictionShard, shards):
+            ofile.write(predictions)
+            
+    else:
+        
+        if log:
+            print("Training and Prediction with " + str(nbWorkers) + " workers")
+        
+        # Each worker opens the .dat files by itself. imap keeps the order of the shards (the order of the users)
+        with multiprocessing.Pool(nbWorkers, initializer=initWorker, initargs=workerArgs) as pool:
+            for predictions in pool.imap(RunPredictionShard, shards):
+                ofile.write(predictions)
+    
+    ofile.close()
+    
+    if log:
+        print("Finish reading file "+ trainingFile +" : number of lines : "+ str(counts['rownum']) + ': number of skipped lines : ' + str(counts['errornum']))
+   
     end = time.time()
     if log:
-        print( "Data Normalization execution time : " + str(end - start))
+        print( "Training and Prediction execution time : " + str(end - start))
+        print("End of EngineRunnerLRPred")
+
 
+
+""" EngineRunnerLRTrain : Training only """
+# This function train the linear Regression model for every user of the trainingFile
+# and register the users' profiles (see UserProfiles.UserProfilesWriter), for EngineRunnerLRPredict.
+#-------
+# trainingFile : path to the file that has the previous ratings (string)
+# FeaturesType : The parameters of the movie metadata that will be taken into account. (string) (as in EngineRunnerLRPred)
+# log : to display the logs
+# nbWorkers, shardSize : as in EngineRunnerLRPred
+# OutputDir : path to the directory for the profiles files with / at the end. (string)
+# MetadataDir : the directory of the processed Movie's Metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : (void) the profiles will be saved in .dat files
+#-------
+def EngineRunnerLRTrain(trainingFile, FeaturesType = "BASIC", log = True, nbWorkers = 0, shardSize = 0, OutputDir = "", MetadataDir = ""):
+    
+    if FeaturesType not in featureTypes: 
+        print("FeaturesType not right")
+        return
+    
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+    
+    if shardSize == 0:
+        shardSize = env.SHARD_NB_USERS
+    
+    # Max value of rating 
+    maxRate = 5
+    
+    # The rating type is not used for the training
+    workerArgs = (featureTypes[FeaturesType], "DOTPRODUCT", maxRate, MetadataDir)
+    
+    if nbWorkers == 1:
+        initWorker(*workerArgs, log)
+    elif not env.MMDT_SPARSE:
+        # The normalized matrix is registered once, before the workers open it
+        movMtdata.MovieMetadataNormalizedFile(featureTypes[FeaturesType], MetadataDir)
     
     if log:
         print("--------------------------------")
-        print("Reading Evaluation Ratings")
+        print("Reading Ratings And Training")
         print("--------------------------------")
     
     start = time.time()
     
-    evalutionByUser = rtools.readCsvEvaluationData(testFile, log)
+    counts = {'rownum': 0, 'errornum': 0}
+    
+    # The shards of all the users
+    shards = shardingUsers(readRatingsByUser(trainingFile, maxRate, counts, log), None, shardSize)
+    
+    if nbWorkers == 1:
+        results = list(map(TrainShard, shards))
+    else:
+        with multiprocessing.Pool(nbWorkers, initializer=initWorker, initargs=workerArgs) as pool:
+            results = list(pool.imap(TrainShard, shards))
+    
+    # No profile to register : the previous profiles are kept
+    if sum(len(ids) for ids, profiles in results) == 0:
+        print("No user of " + trainingFile + " has a rated movie in the dataset : no profile registered")
+        return
+    
+    userIds = np.concatenate([ids for ids, profiles in results])
+    userProfiles = np.concatenate([profiles for ids, profiles in results])
+    
+    # Registering the profiles with the columns that have been used
+    columns = movMtdata.MovieMetadataColumns(featureTypes[FeaturesType], None, MetadataDir)[1]
+    usrProfiles.UserProfilesWriter(userIds, userProfiles, FeaturesType, columns, OutputDir, movMtdata.metadataDirectory(MetadataDir))
     
     end = time.time()
     if log:
-        print( "Reading the evaluation file execution time : " + str(end - start))
+        print("Finish reading file "+ trainingFile +" : number of lines : "+ str(counts['rownum']) + ': number of skipped lines : ' + str(counts['errornum']))
+        print("Number of user profiles : " + str(len(userIds)))
+        print( "Training execution time : " + str(end - start))
+        print("End of EngineRunnerLRTrain")
+
+
+
+""" EngineRunnerLRPredict : Prediction only """
+# This function make the predictions from the registered users' profiles (see EngineRunnerLRTrain), without training.
+#-------
+# FileArgs: List of the paths for [EvaluationDataFile, OutputFile] (list of string)
+# FeaturesType : must be the same as the one of the training (string)
+# RatingType : as in EngineRunnerLRPred (string)
+# log : to display the logs
+# InputDir : path to the directory of the profiles files with / at the end. (string)
+# MetadataDir : the directory of the processed Movie's Metadata (string) (empty : the one of the training, see UserProfilesWriter)
+# @return : the output will saved it a file (path should be indicated in FileArgs[1])
+#           && True if the predictions have been written, False otherwise (the reason is printed)
+#-------
+def EngineRunnerLRPredict(FileArgs, FeaturesType = "BASIC", RatingType = "DOTPRODUCT", log = True, InputDir = "", MetadataDir = ""):
     
+    if len(FileArgs) == 2 :
+        testFile = FileArgs[0]
+        outputFile = FileArgs[1]
+    else : 
+        print("Number of FileArgs not right")
+        return False
     
-    if log:
-        print("---------------------------------------------")
-        print("Reading Ratings And Online Prediction by user")
-        print("---------------------------------------------")
+    if FeaturesType not in featureTypes: 
+        print("FeaturesType not right")
+        return False
+    
+    if RatingType not in ["DOTPRODUCT", "BRAYCURTIS", "COSINE"]:
+        print("DistanceType not right")
+        return False
     
     # Max value of rating 
     maxRate = 5
     
-    start = time.time()
+    # The movies of the training
+    if MetadataDir == "":
+        MetadataDir = usrProfiles.UserProfilesMetadataDir(InputDir)
     
-    # Opening the trainingFile with the previous ratings
-    ifile = open(trainingFile, "r", encoding="utf8")
-    reader = csv.reader(ifile, delimiter=",")
+    # Getting the profiles, and checking that they have been trained with the same columns
+    columns = movMtdata.MovieMetadataColumns(featureTypes[FeaturesType], None, MetadataDir)[1]
+    userProfiles, userLookUp = usrProfiles.UserProfilesRetriever(FeaturesType, columns, InputDir)
     
-    rownum = 0
-    errornum = 0
+    if userProfiles is None:
+        return False
     
-    # The first user (assuming the file has been sorted)
-    last_user_id = 1    
+    initWorker(featureTypes[FeaturesType], RatingType, maxRate, MetadataDir, log)
+    dfTF = workerData['dfTF']
+    dfLookUp = workerData['dfLookUp']
     
-    # List that we will kept the rated movies and their ratings (for each user)
-    userRatedMovies = []
+    evalutionByUser = rtools.readCsvEvaluationData(testFile, log)
+    
+    if log:
+        print("--------------------------------")
+        print("Prediction from the user profiles")
+        print("--------------------------------")
+    
+    start = time.time()
     
-    # Opening the outputFile to write the output
     ofile = open(outputFile, "w", encoding="utf8")
     ofile.write("userId,movieId,rating\n")
     
-    for row in reader:
+    for user_id, moviesToBeRated in evalutionByUser.items():
         
-        try:
-            
-            if len(row) != 4:
-                errornum += 1
-                continue
-        
-            if row[0] == 'userId':
-                continue
-                    
-            if log and rownum % 500000 == 0:
-                print("Reading file "+ trainingFile +" : line count ... "+ str(rownum))
-            
-            # user_id 
-            user_id = (int(row[0]))      
-            
-            # movie_id
-            movie_id = (row[1])   
-            
-            # rate : The rate is divided by maxRate to normalize the value
-            rate = float(row[2]) / float(maxRate)
-                
-            # A new user is being read ... Predict fot the last user
-            if user_id != last_user_id:
-                
-                # Run Prediction for the last user.  		
-        		  
-                if len(userRatedMovies) != 0:
-                                        
-                    # This user is needed for the evaluation
-                    if last_user_id in evalutionByUser:
-                        
-                        predictions = RunPrediction(last_user_id, userRatedMovies, evalutionByUser[last_user_id], dfTF, dfIndex, maxRate, RatingType)
-                        
-                        ofile.write(predictions)                        
-                        
-                    #else: 
-                        #print ("User not demanded for evaluation.")
-                        
-                            
-                # Remise à Zéro : To pass unto the new user
-                last_user_id = user_id
-                
-                # If the rated movie is within our movie's databas
-                if movie_id in dfIndex:
-                    
-                    # Adding the movie feature vector and its rate
-                    userRatedMovies = [dfTF[list(dfIndex).index(movie_id)],rate]
-
-            # No new user.    
-            # If the rated movie is within our movie's database
-            elif movie_id in dfIndex:
-                
-                 # Adding the movie feature vector and its rate
-                 userRatedMovies += [dfTF[list(dfIndex).index(movie_id)],rate]
-            
-            rownum += 1
-            
-        except:
-            errornum += 1
-            pass
+        # The users without profile can't be predicted
+        if user_id in userLookUp:
+            ofile.write(PredictionsFromProfile(user_id, userProfiles[userLookUp[user_id]], moviesToBeRated, dfTF, dfLookUp, maxRate, RatingType))
     
     ofile.close()
-    ifile.close()
     
-    if log:
-        print("Finish reading file "+ trainingFile +" : number of lines : "+ str(rownum) + ': number of skipped lines : ' + str(errornum))
-   
     end = time.time()
     if log:
-        print( "Training and Prediction execution time : " + str(end - start))
-        print("End of EngineRunnerLRPred")
+        print( "Prediction execution time : " + str(end - start))
+        print("End of EngineRunnerLRPredict")
+    
+    return True
 
+
+
+""" EngineRunnerLRUpdate : Incremental Training """
+# This function continue the training of the registered users' profiles (see EngineRunnerLRTrain) with new ratings.
+# Only the users of the deltaFile are trained (from their current profile) and written back.
+#-------
+# deltaFile : path to the file that has the new ratings (string) (same columns as ratings.csv)
+# FeaturesType : must be the same as the one of the training (string)
+# log : to display the logs
+# nbWorkers, shardSize : as in EngineRunnerLRPred
+# InputDir : path to the directory of the profiles files with / at the end. (string)
+# MetadataDir : the directory of the processed Movie's Metadata (string) (empty : the one of the training, see UserProfilesWriter)
+# @return : True if the profiles files have been updated (or if no profile had to be), False otherwise (the reason is printed)
+#-------
+def EngineRunnerLRUpdate(deltaFile, FeaturesType = "BASIC", log = True, nbWorkers = 0, shardSize = 0, InputDir = "", MetadataDir = ""):
+    
+    if FeaturesType not in featureTypes: 
+        print("FeaturesType not right")
+        return False
+    
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+    
+    if shardSize == 0:
+        shardSize = env.SHARD_NB_USERS
+    
+    # Max value of rating 
+    maxRate = 5
+    
+    # The movies of the training
+    if MetadataDir == "":
+        MetadataDir = usrProfiles.UserProfilesMetadataDir(InputDir)
+    
+    # Getting the profiles, and checking that they have been trained with the same columns
+    columns = movMtdata.MovieMetadataColumns(featureTypes[FeaturesType], None, MetadataDir)[1]
+    userProfiles, userLookUp = usrProfiles.UserProfilesRetriever(FeaturesType, columns, InputDir)
+    
+    if userProfiles is None:
+        return False
+    
+    workerArgs = (featureTypes[FeaturesType], "DOTPRODUCT", maxRate, MetadataDir)
+    
+    if nbWorkers == 1:
+        initWorker(*workerArgs, log)
+    elif not env.MMDT_SPARSE:
+        # The normalized matrix is registered once, before the workers open it
+        movMtdata.MovieMetadataNormalizedFile(featureTypes[FeaturesType], MetadataDir)
+    
+    if log:
+        print("--------------------------------")
+        print("Reading New Ratings And Training")
+        print("--------------------------------")
+    
+    start = time.time()
+    
+    counts = {'rownum': 0, 'errornum': 0}
+    
+    # The new ratings by user (the delta file might not be sorted)
+    deltaByUser = readRatingsByUser(deltaFile, maxRate, counts, log, False, False)
+    
+    # The shards of the users of the delta, with their current profile
+    shards = []
+    nbUsers = 0
+    for user_id, movieIds, rates in deltaByUser:
+        
+        nbUsers += 1
+        
+        if len(shards) == 0 or len(shards[-1]) == shardSize:
+            shards.append([])
+        
+        theta = np.array(userProfiles[userLookUp[user_id]]) if user_id in userLookUp else None
+        shards[-1].append((user_id, movieIds, rates, theta))
+    
+    del userProfiles
+    
+    if nbWorkers == 1:
+        results = list(map(UpdateShard, shards))
+    else:
+        with multiprocessing.Pool(nbWorkers, initializer=initWorker, initargs=workerArgs) as pool:
+            results = list(pool.imap(UpdateShard, shards))
+    
+    if sum(len(ids) for ids, profiles in results) == 0:
+        print("No user of " + deltaFile + " has a rated movie in the dataset : no profile updated")
+    else:
+        userIds = np.concatenate([ids for ids, profiles in results])
+        usrProfiles.UserProfilesUpdater(userIds.tolist(), np.concatenate([profiles for ids, profiles in results]), InputDir)
+    
+    end = time.time()
+    if log:
+        print("Finish reading file "+ deltaFile +" : number of lines : "+ str(counts['rownum']) + ': number of skipped lines : ' + str(counts['errornum']))
+        print("Number of updated user profiles : " + str(nbUsers))
+        print( "Incremental Training execution time : " + str(end - start))
+        print("End of EngineRunnerLRUpdate")
+    
+    return True
@@ -5,6 +5,7 @@
 
 import env
 import numpy as np
+import scipy.sparse as sparse
 import Tools as rtools
 
 
@@ -63,6 +64,221 @@ def LinearRegressionGradientDescent(userRatedMovies, epochs = 0, learningRate =
     
     return theta
 
+# @LinearRegressionSolver : Compute the user profile from a matrix of movies and a vector of ratings
+#-------
+# moviesX : numpy.array (Num_Movies x Num_Parameters) of the rated movies' profiles (x), one row per movie (or a scipy.sparse matrix)
+# ratesT : numpy.array (Num_Movies) of the ratings (t)
+# epochs, learningRate : as in LinearRegressionGradientDescent (0 : env.EPOCHS, env.LEARNINGRATE)
+# method : how to compute the user profile (string) (empty : env.SOLVER)
+#          "SAMPLE" : the gradient descent movie per movie (same result as LinearRegressionGradientDescent)
+#          "MINIBATCH" : the gradient descent by batches of batchSize movies (mean of the gradients of the batch)
+#          "BATCH" : the gradient descent over all the movies at once
+#          "RIDGE" : the closed-form least squares of the predictions x.theta, with a ridge penalty ridgeLambda
+# batchSize : number of movies per batch for "MINIBATCH" (0 : env.BATCH_SIZE)
+# ridgeLambda : the ridge penalty for "RIDGE" (None : env.RIDGE_LAMBDA)
+#               (0 : no penalty, the least squares of minimum norm when the movies don't fix the profile)
+# theta : the initial user profile (None : the first movie's profile)
+# @return : a numpy.array (Num_Parameters), the user profile from these ratings.
+#-------
+def LinearRegressionSolver(moviesX, ratesT, epochs = 0, learningRate = 0, method = "", batchSize = 0, ridgeLambda = None, theta = None):
+
+    # The updates are element per element : the rows of a sparse matrix are used as numpy.array
+    moviesX = moviesX.toarray() if sparse.issparse(moviesX) else np.asarray(moviesX)
+    
+    if len(moviesX) == 0:
+        return
+    ratesT = np.asarray(ratesT, dtype='float64')
+    
+    if method == "":
+        method = env.SOLVER
+    
+    if method == "RIDGE":
+        
+        if ridgeLambda is None:
+            ridgeLambda = env.RIDGE_LAMBDA
+        
+        # Solving (X'X + lambda * I) theta = X't
+        gram = moviesX.T.dot(moviesX) + ridgeLambda * np.identity(moviesX.shape[1])
+        
+        if ridgeLambda == 0:
+            # X'X might be singular
+            return np.linalg.pinv(gram, hermitian=True).dot(moviesX.T.dot(ratesT))
+        
+        return np.linalg.solve(gram, moviesX.T.dot(ratesT))
+    
+    # Number of Epochs to learn for one regression.
+    if epochs == 0:
+        epochs = env.EPOCHS
+    
+    # Learning Rate for the gradient Descent
+    if learningRate == 0:
+        learningRate = env.LEARNINGRATE
+    
+    numMovies = len(moviesX)
+    
+    if method == "SAMPLE":
+        batchSize = 1
+    elif method == "BATCH":
+        batchSize = numMovies
+    elif batchSize == 0:
+        batchSize = env.BATCH_SIZE
+    
+    # The User Profile Initialization : The first movie's profile
+    if theta is None:
+        theta = np.array(moviesX[0])
+    
+    # For every epoch
+    for epoch in range(epochs):
+        
+        if batchSize == 1:
+            
+            # Movie per movie, as in LinearRegressionGradientDescent
+            for movie_i in range(numMovies):
+                xi = moviesX[movie_i]
+                loss = theta * xi - ratesT[movie_i]
+                theta = theta - learningRate * loss * xi
+            
+            continue
+        
+        # For every batch of movies
+        for first in range(0, numMovies, batchSize):
+            
+            xb = moviesX[first:first + batchSize]
+            
+            # The losses Y-T of the batch (Num_Batch x Num_Parameters)
+            loss = theta * xb - ratesT[first:first + batchSize, np.newaxis]
+            
+            # Update the User Profile - LearningRate * mean(loss * X)
+            theta = theta - learningRate * (loss * xb).mean(axis=0)
+    
+    return theta
+
+# @LinearRegressionAllUsers : Compute the user profiles of many users at once
+#-------
+# userPtr : numpy.array (Num_Users + 1) of the first row of each user in moviesX (as the indptr of a CSR matrix)
+#           The rows of the user u are moviesX[userPtr[u]:userPtr[u+1]]. Every user must have at least one row.
+# moviesX : numpy.array (Num_Ratings x Num_Parameters) of the rated movies' profiles (x) of all the users (or a scipy.sparse matrix)
+# ratesT : numpy.array (Num_Ratings) of the ratings (t) of all the users
+# epochs, learningRate, method, batchSize, ridgeLambda : as in LinearRegressionSolver
+# thetas : the initial users' profiles (Num_Users x Num_Parameters) (None : the first movie's profile of each user)
+# @return : a numpy.array (Num_Users x Num_Parameters), a user profile per row.
+#           The row u is the same as LinearRegressionSolver on the rows of the user u.
+#-------
+def LinearRegressionAllUsers(userPtr, moviesX, ratesT, epochs = 0, learningRate = 0, method = "", batchSize = 0, ridgeLambda = None, thetas = None):
+    
+    userPtr = np.asarray(userPtr, dtype='int64')
+    moviesX = moviesX.toarray() if sparse.issparse(moviesX) else np.asarray(moviesX)
+    ratesT = np.asarray(ratesT, dtype='float64')
+    
+    if method == "":
+        method = env.SOLVER
+    
+    if epochs == 0:
+        epochs = env.EPOCHS
+    
+    if learningRate == 0:
+        learningRate = env.LEARNINGRATE
+    
+    if ridgeLambda is None:
+        ridgeLambda = env.RIDGE_LAMBDA
+    
+    counts = np.diff(userPtr)
+    starts = userPtr[:-1]
+    
+    if thetas is None:
+        thetas = np.array(moviesX[starts], dtype='float64')
+    else:
+        thetas = np.array(thetas, dtype='float64')
+    
+    if len(counts) == 0:
+        return thetas
+    
+    if method == "RIDGE":
+        
+        numParams = moviesX.shape[1]
+        
+        # By groups of users, so that the (Num_Ratings x Num_Parameters x Num_Parameters) products stay small
+        maxRows = max(1, env.RIDGE_CHUNK_VALUES // (numParams * numParams))
+        
+        first = 0
+        while first < len(counts):
+            
+            last = first + 1
+            while last < len(counts) and userPtr[last + 1] - userPtr[first] <= maxRows:
+                last += 1
+            
+            xc = moviesX[userPtr[first]:userPtr[last]]
+            localStarts = starts[first:last] - userPtr[first]
+            
+            # Solving (X'X + lambda * I) theta = X't for every user of the group
+            gram = np.add.reduceat(np.einsum('ni,nj->nij', xc, xc), localStarts) + ridgeLambda * np.identity(numParams)
+            xt = np.add.reduceat(xc * ratesT[userPtr[first]:userPtr[last], np.newaxis], localStarts)
+            if ridgeLambda == 0:
+                thetas[first:last] = np.matmul(np.linalg.pinv(gram, hermitian=True), xt[:, :, np.newaxis])[:, :, 0]
+            else:
+                thetas[first:last] = np.linalg.solve(gram, xt[:, :, np.newaxis])[:, :, 0]
+            
+            first = last
+        
+        return thetas
+    
+    if method == "BATCH":
+        
+        # The mean gradient is theta * mean(x * x) - mean(t * x) : the means are computed once per user
+        meanXX = np.add.reduceat(moviesX * moviesX, starts) / counts[:, np.newaxis]
+        meanTX = np.add.reduceat(moviesX * ratesT[:, np.newaxis], starts) / counts[:, np.newaxis]
+        
+        for epoch in range(epochs):
+            thetas = thetas - learningRate * (thetas * meanXX - meanTX)
+        
+        return thetas
+    
+    if method == "SAMPLE":
+        batchSize = 1
+    elif batchSize == 0:
+        batchSize = env.BATCH_SIZE
+    
+    # The users sorted by decreasing number of ratings : the users still learning at a step are the first ones
+    order = np.argsort(-counts, kind='stable')
+    sortedCounts = counts[order]
+    sortedStarts = starts[order]
+    sortedThetas = thetas[order]
+    
+    # Number of users that have more than k ratings, for every k
+    nbActive = np.searchsorted(-sortedCounts, -np.arange(sortedCounts[0]), side='left')
+    
+    # For every epoch
+    for epoch in range(epochs):
+        
+        # The k-th movie (or batch of movies) of every user at the same time
+        for step, first in enumerate(range(0, sortedCounts[0], batchSize)):
+            
+            nb = nbActive[first]
+            
+            if batchSize == 1:
+                
+                # As in LinearRegressionGradientDescent, with a movie per user
+                rows = sortedStarts[:nb] + first
+                xi = moviesX[rows]
+                loss = sortedThetas[:nb] * xi - ratesT[rows][:, np.newaxis]
+                sortedThetas[:nb] = sortedThetas[:nb] - learningRate * loss * xi
+                continue
+            
+            # The size of the batch of each user (the last one might be smaller)
+            lens = np.minimum(sortedCounts[:nb] - first, batchSize)
+            offsets = np.cumsum(lens) - lens
+            rows = np.repeat(sortedStarts[:nb] + first - offsets, lens) + np.arange(lens.sum())
+            
+            xb = moviesX[rows]
+            loss = np.repeat(sortedThetas[:nb], lens, axis=0) * xb - ratesT[rows][:, np.newaxis]
+            
+            # Update the User Profiles - LearningRate * mean(loss * X) by user
+            sortedThetas[:nb] = sortedThetas[:nb] - learningRate * np.add.reduceat(loss * xb, offsets) / lens[:, np.newaxis]
+    
+    thetas[order] = sortedThetas
+    
+    return thetas
+
 if env.TESTMODE:
     
     x1 = rtools.normalize(np.array([[1,0,0,1,0]]))[0]
@@ -78,4 +294,43 @@ if env.TESTMODE:
     y2 = round( x2.dot(userProfile) * 2) / 2
     
     assert abs(y1 - t1) <=  1 
-    assert abs(y2 - t2) <=  1 
\ No newline at end of file
+    assert abs(y2 - t2) <=  1
+    
+    # The solver on the stacked matrix gives the same profile as the reference movie per movie
+    testX = np.array([x1, x2])
+    testT = np.array([t1, t2])
+    assert np.array_equal(LinearRegressionSolver(testX, testT, 1, 0.8, "SAMPLE"), userProfile)
+    
+    # With batches of one movie, the mini batch is the same as the reference
+    assert np.allclose(LinearRegressionSolver(testX, testT, 3, 0.8, "MINIBATCH", 1), LinearRegressionGradientDescent(test, 3, 0.8))
+    
+    # The closed form fits the predictions x.theta
+    testProfile = LinearRegressionSolver(testX, testT, method = "RIDGE", ridgeLambda = 1e-6)
+    assert abs(x1.dot(testProfile) - t1) <= 1e-3
+    assert abs(x2.dot(testProfile) - t2) <= 1e-3
+    
+    # Without penalty, the two movies are fitted exactly (less movies than parameters)
+    testProfile = LinearRegressionSolver(testX, testT, method = "RIDGE", ridgeLambda = 0)
+    assert abs(x1.dot(testProfile) - t1) <= 1e-9
+    assert abs(x2.dot(testProfile) - t2) <= 1e-9
+    
+    # All the users at once give the same profiles as user per user
+    testX = rtools.normalize(np.array([[1,0,0,1,0],[0,1,1,0,0],[1,1,0,0,1],[0,0,1,1,1],[1,0,1,0,0],[0,1,0,1,0]]))
+    testT = np.array([1, 0, 0.5, 0.7, 0.2, 0.9])
+    testPtr = np.array([0, 2, 3, 6])
+    for testMethod in ["SAMPLE", "MINIBATCH", "BATCH", "RIDGE"]:
+        testProfiles = LinearRegressionAllUsers(testPtr, testX, testT, 3, 0.8, testMethod, 2)
+        assert np.array_equal(LinearRegressionAllUsers(testPtr, sparse.csr_matrix(testX), testT, 3, 0.8, testMethod, 2), testProfiles)
+        for testUser in range(3):
+            testRows = slice(testPtr[testUser], testPtr[testUser + 1])
+            testProfile = LinearRegressionSolver(testX[testRows], testT[testRows], 3, 0.8, testMethod, 2)
+            if testMethod == "SAMPLE":
+                assert np.array_equal(testProfiles[testUser], testProfile)
+            else:
+                assert np.allclose(testProfiles[testUser], testProfile)
+    
+    # Without penalty, all the users at once give the same profiles as user per user
+    testProfiles = LinearRegressionAllUsers(testPtr, testX, testT, method = "RIDGE", ridgeLambda = 0)
+    for testUser in range(3):
+        testRows = slice(testPtr[testUser], testPtr[testUser + 1])
+        assert np.allclose(testProfiles[testUser], LinearRegressionSolver(testX[testRows], testT[testRows], method = "RIDGE", ridgeLambda = 0))
@@ -19,11 +19,13 @@ import sys
 # featureTypes : list of parametres configuration to be used from Movie Metadata Matrix (list of strings)
 # ratingTypes : list of rating's prediction computation to be done (list of strings)
 # Log : to display the logs
-# @return : (void) && print the dict containing the rmse for each configurations.
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : (void) && print the dict containing the rmse for each configurations, then their MAE and coverage.
 #--------
-def Evaluate(trainFile, testFile, testTargetFile, featureTypes = ["INTERMEDIATE"], ratingTypes = ["DOTPRODUCT", "COSINE", "BRAYCURTIS"], Log = False):
+def Evaluate(trainFile, testFile, testTargetFile, featureTypes = ["INTERMEDIATE"], ratingTypes = ["DOTPRODUCT", "COSINE", "BRAYCURTIS"], Log = False, MetadataDir = ""):
     
     res = {}
+    metrics = {}
     
     for featureType in featureTypes :
     
@@ -31,11 +33,16 @@ def Evaluate(trainFile, testFile, testTargetFile, featureTypes = ["INTERMEDIATE"
             
             resultFile = featureType+"_"+ratingType+"_Evaluate.csv"
             
-            LRPredictor.EngineRunnerLRPred([trainFile, testFile, resultFile], featureType, ratingType, Log)
-            res[featureType+"_"+ratingType] = rtools.RMSEeval(testTargetFile, resultFile)            
+            LRPredictor.EngineRunnerLRPred([trainFile, testFile, resultFile], featureType, ratingType, Log, MetadataDir = MetadataDir)
+            metrics[featureType+"_"+ratingType] = rtools.RMSEeval(testTargetFile, resultFile, True)
+            res[featureType+"_"+ratingType] = metrics[featureType+"_"+ratingType]['RMSE']
             
     print("Result (rmse) :")
     print(res)
+    
+    for key, val in metrics.items():
+        print(key + " : mae " + str(round(val['MAE'], 4)) + ", coverage " + str(round(val['coverage'], 4))
+              + ", rmse by user (percentiles 5, 25, 50, 75, 95) " + str([round(x, 4) for x in val['usersRMSEPercentiles']]))
         
 
 #--------
@@ -47,39 +54,139 @@ def Evaluate(trainFile, testFile, testTargetFile, featureTypes = ["INTERMEDIATE"
 # featureTypes : list of parametres configuration to be used from Movie Metadata Matrix (list of strings)
 # ratingTypes : list of rating's prediction computation to be done (list of strings)
 # Log : to display the logs
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
 # @return : (void) The output will generated in a file (resultFile)
 #--------
-def RunPredictor(trainFile, testFile, resultFile, featureType = "INTERMEDIATE", ratingType = "DOTPRODUCT", Log = False):
+def RunPredictor(trainFile, testFile, resultFile, featureType = "INTERMEDIATE", ratingType = "DOTPRODUCT", Log = False, MetadataDir = ""):
     
     if resultFile == "":
         resultFile = featureType+"_"+ratingType+"_Run.csv"
     
-    LRPredictor.EngineRunnerLRPred([trainFile, testFile, resultFile], featureType, ratingType, Log)
+    LRPredictor.EngineRunnerLRPred([trainFile, testFile, resultFile], featureType, ratingType, Log, MetadataDir = MetadataDir)
     
     print("The Run has Finished. The output is in the file : "+resultFile+".")
 
 
+#--------
+# To Run the training only, the users' profiles are registered (see UserProfiles.py)
+#--------
+# trainFile : path to file that has the previous ratings (string)
+# featureType : parametres configuration to be used from Movie Metadata Matrix (string)
+# Log : to display the logs
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : (void) The profiles will be registered in .dat files
+#--------
+def RunTrainer(trainFile, featureType = "INTERMEDIATE", Log = False, MetadataDir = ""):
+    
+    LRPredictor.EngineRunnerLRTrain(trainFile, featureType, Log, MetadataDir = MetadataDir)
+    
+    print("The Training has Finished. The profiles are in the file : "+env.PROFILES_DATAFRAME+".")
+
+
+#--------
+# To Run the incremental training, the registered users' profiles are updated with new ratings (see RunTrainer)
+#--------
+# deltaFile : path to file that has the new ratings (string)
+# featureType : must be the one of the training (string)
+# Log : to display the logs
+# @return : (void) The profiles of the users of deltaFile will be updated in the .dat files
+#--------
+def RunUpdater(deltaFile, featureType = "INTERMEDIATE", Log = False):
+    
+    if LRPredictor.EngineRunnerLRUpdate(deltaFile, featureType, Log):
+        print("The Update has Finished. The profiles are in the file : "+env.PROFILES_DATAFRAME+".")
+    else:
+        print("The Update has Failed. The profiles have not been updated.")
+
+
+#--------
+# To Run the prediction only, from the registered users' profiles (see RunTrainer)
+#--------
+# testFile : path to file that has the couple (userId, movieID) to be rated (string)
+# resultFile : path to file that will contain the output
+# featureType : must be the one of the training (string)
+# ratingType : rating's prediction computation to be done (string)
+# Log : to display the logs
+# MetadataDir : the directory of the processed movie metadata (string) (empty : the one of the training)
+# @return : (void) The output will generated in a file (resultFile)
+#--------
+def RunProfilesPredictor(testFile, resultFile, featureType = "INTERMEDIATE", ratingType = "DOTPRODUCT", Log = False, MetadataDir = ""):
+    
+    if resultFile == "":
+        resultFile = featureType+"_"+ratingType+"_Run.csv"
+    
+    if LRPredictor.EngineRunnerLRPredict([testFile, resultFile], featureType, ratingType, Log, MetadataDir = MetadataDir):
+        print("The Prediction has Finished. The output is in the file : "+resultFile+".")
+    else:
+        print("The Prediction has Failed. No output has been written.")
+
+
 #--------
 # Main Function : Arguments [0 : output file] [1 : directory of the input files] [2 : -v If Logs wanted]
+#                 With -train : [0 : directory of the input files] : the metadata is processed and the profiles are registered.
+#                 With -update : [0 : file of the new ratings] : the registered profiles are updated with the new ratings.
+#                 With -predict : [0 : output file] [1 : directory of the input files] : prediction from the registered files.
+#                 With -evict : [0 : number of kept directories (optional)] : the processed metadata is removed from the cache.
 #--------
 def Main():
     
     # Arguments
     if len(sys.argv) == 1:
         print("Need arguments : > Main.py [PathOutputFile] [InputDatasDirectory with /] [-v (optional)]")
+        print("            or : > Main.py -train [InputDatasDirectory with /] [-v (optional)]")
+        print("            or : > Main.py -update [PathNewRatingsFile] [-v (optional)]")
+        print("            or : > Main.py -predict [PathOutputFile] [InputDatasDirectory with /] [-v (optional)]")
+        print("            or : > Main.py -evict [NumberOfKeptMetadataCaches (optional)]")
         return
     
-    outputFile = sys.argv[1]       
-    dataDirectory = sys.argv[2] if len(sys.argv) > 2 else ""
     log = True if "-v" in sys.argv else False
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+    
+    if "-train" in sys.argv:
+        
+        dataDirectory = args[0] if len(args) > 0 else ""
+        
+        # Process the MetaData of the movies (kept for the prediction)
+        metadataDir = movieMdat.MovieMetadataProcessor(dataDirectory+env.IN_MOVIES_METADATA, "", log)
+        
+        RunTrainer(dataDirectory+env.IN_RATINGS, env.FEATURE_TYPE, log, metadataDir)
+        return
+    
+    if "-evict" in sys.argv:
+        
+        removed = movieMdat.MovieMetadataCacheEvictor(int(args[0]) if len(args) > 0 else 0)
+        print("Removed from the metadata cache : " + str(len(removed)) + " directories")
+        return
+    
+    if "-update" in sys.argv:
+        
+        if len(args) == 0:
+            print("Need arguments : > Main.py -update [PathNewRatingsFile] [-v (optional)]")
+            return
+        
+        RunUpdater(args[0], env.FEATURE_TYPE, log)
+        return
+    
+    outputFile = args[0] if len(args) > 0 else ""
+    dataDirectory = args[1] if len(args) > 1 else ""
+    
+    if "-predict" in sys.argv:
+        
+        # The metadata of the input directory (already in the cache after -train)
+        metadataDir = movieMdat.MovieMetadataProcessor(dataDirectory+env.IN_MOVIES_METADATA, "", log)
+        
+        RunProfilesPredictor(dataDirectory+env.IN_EVALUATION_RATINGS, outputFile, env.FEATURE_TYPE, env.RATING_TYPE, log, metadataDir)
+        return
     
     # Process the MetaData of the movies
-    movieMdat.MovieMetadataProcessor(dataDirectory+env.IN_MOVIES_METADATA, "", log)
+    metadataDir = movieMdat.MovieMetadataProcessor(dataDirectory+env.IN_MOVIES_METADATA, "", log)
     
     # The prediction Algorithm
-    RunPredictor(dataDirectory+env.IN_RATINGS, dataDirectory+env.IN_EVALUATION_RATINGS, outputFile, env.FEATURE_TYPE, env.RATING_TYPE, log)
+    RunPredictor(dataDirectory+env.IN_RATINGS, dataDirectory+env.IN_EVALUATION_RATINGS, outputFile, env.FEATURE_TYPE, env.RATING_TYPE, log, metadataDir)
     
-    # Clean the Data
-    movieMdat.cleaner()
+    # Clean the Data (without cache, the metadata is processed again at each run)
+    if env.MMDT_CACHE_DIR == "":
+        movieMdat.cleaner(metadataDir)
 
-Main()
\ No newline at end of file
+if __name__ == "__main__":
+    Main()
@@ -1,22 +1,169 @@
 # -*- coding: utf-8 -*-
 #
 #   To compute the Distance between Movies.
+#   The cosine distances are computed by tiles (products of blocks of the normalized matrix), spread over processes,
+#   and written in a binary file (MoviesDistance), or only the K nearest movies of each movie are kept (MoviesNeighbours).
 # 
 
 
 import Tools as rtools
 import MovieMetadataReader as movMtdata
-from scipy.spatial import distance
+import env
 
+import multiprocessing
+import numpy as np
 import time
+import sys
+import os
 
-def MoviesDistance(FeaturesType = "BASIC", outputFile = "", log = True):
+
+# The options of the list of parameters that can be used
+featureTypes = {"BASIC":["genre", "releaseDate"]
+, "INTERMEDIATE": ["genre", "releaseDate", "popularity", "voteAverage"]
+, "ADVANCED": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime"]
+, "ALL": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime", "collection", "language"]}
+
+
+# The data of the current process (filled by initDistanceWorker)
+workerData = {}
+
+
+
+# @condensedOffset : To get the position of the distance between the movies i and i+1 in the distance file
+#-------
+# i : row number of the movie (integer)
+# nbMovies : number of movies (integer)
+# @return : the position (integer). The distance between i and j > i is at condensedOffset(i, nbMovies) + j - i - 1
+#-------
+# The distance file is the upper triangle of the distance matrix, row per row (as scipy.spatial.distance.pdist)
+#-------
+def condensedOffset(i, nbMovies):
+    
+    return i * nbMovies - i * (i + 1) // 2
+
+
+
+# @initDistanceWorker : To open the normalized Movie's Metadata and the distance file in the current process
+#-------
+# neededColumns : list of string indicating the columns (parameters) of the data that will be kept.
+# outputFile : path to the distance file (already created with its size) (string) (empty : no distance file, for MoviesNeighbours)
+# MetadataDir : the directory of the processed metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : (void) workerData will be filled with dfTF (normalized) and distances (numpy.memmap)
+#-------
+def initDistanceWorker(neededColumns, outputFile = "", MetadataDir = ""):
+    
+    dfTF = movMtdata.MovieMetadataRetriever(neededColumns, True, MetadataDir)[0]
+    nbMovies = dfTF.shape[0]
+    
+    workerData['dfTF'] = dfTF
+    
+    if outputFile != "":
+        workerData['distances'] = np.memmap(outputFile, dtype='float32', mode='r+', shape=(nbMovies * (nbMovies - 1) // 2,))
+
+
+
+# @DistanceBand : To compute and write the distances of a band of movies with the next ones
+#-------
+# band : (first row, last row (excluded), number of movies per tile)
+# @return : the number of rows of the band (integer)
+#-------
+# The band is computed tile per tile : only a tile of distances is in memory at once.
+#-------
+def DistanceBand(band):
     
-    # The options of the list of parameters that can be used
-    featureTypes = {"BASIC":["genre", "releaseDate"]
-    , "INTERMEDIATE": ["genre", "releaseDate", "popularity", "voteAverage"]
-    , "ADVANCED": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime"]
-    , "ALL": ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime", "collection", "language"]}
+    first, last, tileRows = band
+    
+    dfTF = workerData['dfTF']
+    distances = workerData['distances']
+    nbMovies = dfTF.shape[0]
+    
+    rows = rtools.rowsAsArray(dfTF, slice(first, last), 'float32')
+    
+    for firstColumn in range(first, nbMovies, tileRows):
+        
+        lastColumn = min(firstColumn + tileRows, nbMovies)
+        
+        tile = rtools.cosineDistanceBlock(rows, rtools.rowsAsArray(dfTF, slice(firstColumn, lastColumn), 'float32'))
+        
+        # Only the distances with the next movies (j > i) of each row
+        for i in range(first, last):
+            
+            firstJ = max(firstColumn, i + 1)
+            
+            if firstJ >= lastColumn:
+                continue
+            
+            offset = condensedOffset(i, nbMovies) + firstJ - i - 1
+            distances[offset:offset + lastColumn - firstJ] = tile[i - first, firstJ - firstColumn:]
+    
+    distances.flush()
+    
+    return last - first
+
+
+
+# @NeighboursBand : To find the K nearest movies of a band of movies
+#-------
+# band : (first row, last row (excluded), number of movies per tile, K)
+# @return : the first row, the rows of the K nearest movies of each movie of the band (numpy.array Num_Rows x K, int64),
+#           and their distances (numpy.array Num_Rows x K, float32), from the nearest
+#-------
+# The distances are computed tile per tile, with all the movies : only the K nearest ones so far are kept (argpartition).
+#-------
+def NeighboursBand(band):
+    
+    first, last, tileRows, K = band
+    
+    dfTF = workerData['dfTF']
+    nbMovies = dfTF.shape[0]
+    
+    rows = rtools.rowsAsArray(dfTF, slice(first, last), 'float32')
+    
+    bestRows = np.zeros((last - first, 0), dtype='int64')
+    bestDistances = np.zeros((last - first, 0), dtype='float32')
+    
+    for firstColumn in range(0, nbMovies, tileRows):
+        
+        lastColumn = min(firstColumn + tileRows, nbMovies)
+        
+        tile = rtools.cosineDistanceBlock(rows, rtools.rowsAsArray(dfTF, slice(firstColumn, lastColumn), 'float32'))
+        
+        # A movie is not one of its neighbours
+        itself = np.arange(max(first, firstColumn), min(last, lastColumn))
+        tile[itself - first, itself - firstColumn] = np.inf
+        
+        # The candidates : the K nearest so far and the movies of the tile
+        candidateRows = np.hstack([bestRows, np.broadcast_to(np.arange(firstColumn, lastColumn), tile.shape)])
+        candidateDistances = np.hstack([bestDistances, tile])
+        
+        if candidateDistances.shape[1] <= K:
+            bestRows, bestDistances = candidateRows, candidateDistances
+            continue
+        
+        kept = np.argpartition(candidateDistances, K - 1, axis=1)[:, :K]
+        bestRows = np.take_along_axis(candidateRows, kept, axis=1)
+        bestDistances = np.take_along_axis(candidateDistances, kept, axis=1)
+    
+    # From the nearest movie
+    order = np.argsort(bestDistances, axis=1, kind='stable')
+    
+    return first, np.take_along_axis(bestRows, order, axis=1), np.take_along_axis(bestDistances, order, axis=1)
+
+
+
+# @MoviesDistance : To compute the cosine distances between all the movies
+#-------
+# FeaturesType : the parameters of the movies (see featureTypes) (string)
+# outputFile : path to the distance file (string)
+# log : to display the logs
+# nbWorkers : number of processes computing the tiles (0 : env.NB_WORKERS)
+# tileRows : number of movies per tile (0 : env.DISTANCE_TILE_ROWS)
+# MetadataDir : the directory of the processed metadata (string) (see MovieMetadataReader.metadataPath)
+# @return :
+#       - Create the outputFile : the distances (float32) between the movies i < j, row per row (see condensedOffset)
+#       - Create the outputFile.index file : the movie_id of the rows (int64, in the order of movieIndex.dat)
+#-------
+def MoviesDistance(FeaturesType = "BASIC", outputFile = "", log = True, nbWorkers = 0, tileRows = 0, MetadataDir = ""):
         
     if outputFile == "":
         print("Please specify the output file")
@@ -26,6 +173,12 @@ def MoviesDistance(FeaturesType = "BASIC", outputFile = "", log = True):
         print("FeaturesType not right")
         return
     
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+    
+    if tileRows == 0:
+        tileRows = env.DISTANCE_TILE_ROWS
+    
     if log:
         print("----------------------------------------")
         print("Reading Movie's Metadata from .dat files")
@@ -33,44 +186,229 @@ def MoviesDistance(FeaturesType = "BASIC", outputFile = "", log = True):
     
     start = time.time()
     
-    # Getting the MovieMetadata as matrix and its row indexes as list of strings
-    dfTF, dfIndex = movMtdata.MovieMetadataRetriever(featureTypes[FeaturesType])
+    # Getting the MovieMetadata as normalized matrix and its row indexes as list of strings
+    # (the normalized matrix is registered here once, before the workers open it)
+    dfTF, dfIndex, dfLookUp = movMtdata.MovieMetadataRetriever(featureTypes[FeaturesType], True, MetadataDir)
                                                                   
     end = time.time()
     if log:
-        print( "Reading Memmap DataMatrix & index execution time : " + str(end - start)) 
+        print( "Reading Memmap normalized DataMatrix & index execution time : " + str(end - start)) 
+        
+        
+    if log:
+        print("---------------------------------")
+        print("Write the movies distances")
+        print("---------------------------------")  
+    
+    start = time.time()
     
+    nbMovies = len(dfIndex)
+    nbDistances = nbMovies * (nbMovies - 1) // 2
     
     if log:
-        print("-----------------------------------")
-        print("Normalize Data Frame on Movie Data")
-        print("-----------------------------------")    
+        print(str(nbMovies) + " movies : " + str(nbDistances) + " distances")
     
-    start = time.time()
+    # The movie_id of the rows
+    np.array(dfIndex, dtype='int64').tofile(outputFile + ".index")
+    
+    # Creating the file with its size, then each band writes its part (np.memmap can't create an empty file)
+    if nbDistances == 0:
+        open(outputFile, "wb").close()
+        return
+    
+    distances = np.memmap(outputFile, dtype='float32', mode='w+', shape=(nbDistances,))
+    del distances
     
-    dfTF = rtools.normalize(dfTF)
+    # The first bands are the longest ones (more next movies) : they are given first
+    bands = [(first, min(first + tileRows, nbMovies), tileRows) for first in range(0, nbMovies, tileRows)]
+    workerArgs = (featureTypes[FeaturesType], outputFile, MetadataDir)
+    
+    nbRows = 0
+    
+    if nbWorkers == 1:
+        
+        initDistanceWorker(*workerArgs)
+        
+        for bandRows in map(DistanceBand, bands):
+            nbRows += bandRows
+            
+    else:
+        
+        # Each worker opens the .dat files by itself, and writes its bands in the distance file
+        with multiprocessing.Pool(nbWorkers, initializer=initDistanceWorker, initargs=workerArgs) as pool:
+            for bandRows in pool.imap_unordered(DistanceBand, bands):
+                nbRows += bandRows
+                if log:
+                    print(str(nbRows) + " / " + str(nbMovies) + " movies")
     
     end = time.time()
     if log:
-        print( "Data Normalization execution time : " + str(end - start))
+        print( "Distances execution time : " + str(end - start))
+
+
+
+# @MoviesNeighbours : To find the K nearest movies (cosine distance) of every movie
+#-------
+# FeaturesType : the parameters of the movies (see featureTypes) (string)
+# outputFile : the beginning of the path of the files (string) (empty : env.NEIGHBOURS_FILE)
+# K : number of nearest movies kept for each movie (0 : env.NEIGHBOURS_K) (at most the number of movies - 1)
+# log : to display the logs
+# nbWorkers : number of processes computing the tiles (0 : env.NB_WORKERS)
+# tileRows : number of movies per tile (0 : env.DISTANCE_TILE_ROWS)
+# MetadataDir : the directory of the processed metadata (string) (see MovieMetadataReader.metadataPath)
+# @return :
+#       - Create the outputFile_ids.dat file : the movie_id of the K nearest movies of each movie (int64, Num_Movies x K), from the nearest
+#       - Create the outputFile_distances.dat file : their distances (float32, Num_Movies x K)
+#       - Create the outputFile_index.dat file : the movie_id of the rows (int64, in the order of movieIndex.dat)
+#-------
+def MoviesNeighbours(FeaturesType = "BASIC", outputFile = "", K = 0, log = True, nbWorkers = 0, tileRows = 0, MetadataDir = ""):
+    
+    if FeaturesType not in featureTypes: 
+        print("FeaturesType not right")
+        return
+    
+    if outputFile == "":
+        outputFile = env.NEIGHBOURS_FILE
+    
+    if K == 0:
+        K = env.NEIGHBOURS_K
+    
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+    
+    if tileRows == 0:
+        tileRows = env.DISTANCE_TILE_ROWS
+    
+    start = time.time()
+    
+    # Getting the MovieMetadata as normalized matrix and its row indexes as list of strings
+    # (the normalized matrix is registered here once, before the workers open it)
+    dfTF, dfIndex, dfLookUp = movMtdata.MovieMetadataRetriever(featureTypes[FeaturesType], True, MetadataDir)
+    
+    nbMovies = len(dfIndex)
+    K = min(K, nbMovies - 1)
+    
+    movieIds = np.array(dfIndex, dtype='int64')
+    movieIds.tofile(outputFile + "_index.dat")
+    
+    if K <= 0:
+        open(outputFile + "_ids.dat", "wb").close()
+        open(outputFile + "_distances.dat", "wb").close()
+        return
+    
+    neighbourIds = np.memmap(outputFile + "_ids.dat", dtype='int64', mode='w+', shape=(nbMovies, K))
+    neighbourDistances = np.memmap(outputFile + "_distances.dat", dtype='float32', mode='w+', shape=(nbMovies, K))
+    
+    bands = [(first, min(first + tileRows, nbMovies), tileRows, K) for first in range(0, nbMovies, tileRows)]
+    
+    nbRows = 0
+    
+    if nbWorkers == 1:
+        
+        initDistanceWorker(featureTypes[FeaturesType], "", MetadataDir)
+        results = map(NeighboursBand, bands)
+        
+    else:
+        
+        pool = multiprocessing.Pool(nbWorkers, initializer=initDistanceWorker, initargs=(featureTypes[FeaturesType], "", MetadataDir))
+        results = pool.imap_unordered(NeighboursBand, bands)
+    
+    # The K nearest movies of each band are small : they are written here
+    for first, bestRows, bestDistances in results:
         
+        neighbourIds[first:first + len(bestRows)] = movieIds[bestRows]
+        neighbourDistances[first:first + len(bestRows)] = bestDistances
         
+        nbRows += len(bestRows)
+        if log:
+            print(str(nbRows) + " / " + str(nbMovies) + " movies")
+    
+    if nbWorkers != 1:
+        pool.close()
+        pool.join()
+    
+    neighbourIds.flush()
+    neighbourDistances.flush()
+    
+    end = time.time()
     if log:
-        print("---------------------------------")
-        print("Write CSV of movies distances")
-        print("---------------------------------")  
-  
-    nbMovies = len(dfIndex)
-    print(nbMovies)
-    with open(outputFile, "w", encoding="utf8") as ofile:
+        print( "Neighbours execution time : " + str(end - start))
+
+
+
+# The neighbours files opened by similarMovies in this process
+openedNeighbours = {}
+
+# @similarMovies : To get the nearest movies of a movie, from the files of MoviesNeighbours
+#-------
+# movie_id : the movie (string or integer)
+# k : number of nearest movies (at most the K of MoviesNeighbours) (0 : all the registered ones)
+# neighboursFile : the beginning of the path of the files of MoviesNeighbours (string) (empty : env.NEIGHBOURS_FILE)
+# @return : list of (movie_id (integer), cosine distance (float)), from the nearest movie ([] if the movie is unknown)
+#-------
+# The files are opened once per process (again if they have been written again).
+#-------
+def similarMovies(movie_id, k = 0, neighboursFile = ""):
+    
+    if neighboursFile == "":
+        neighboursFile = env.NEIGHBOURS_FILE
+    
+    signature = [(os.stat(neighboursFile + suffix).st_size, os.stat(neighboursFile + suffix).st_mtime_ns) for suffix in ["_ids.dat", "_distances.dat", "_index.dat"]]
+    
+    if neighboursFile not in openedNeighbours or openedNeighbours[neighboursFile]['signature'] != signature:
         
-        ofile.write("movieId,movieId,distance\n")
+        movieIds = np.fromfile(neighboursFile + "_index.dat", dtype='int64')
+        K = signature[0][0] // 8 // len(movieIds) if len(movieIds) != 0 else 0
         
-        for i in range(nbMovies):
-            
-            for j in range(i):
-                    
-                dist = distance.cosine(dfTF[i,:], dfTF[j,:])
-                ofile.write(dfIndex[i] + "," + dfIndex[j] + "," + str(dist) + "\n")
-                    
-MoviesDistance("INTERMEDIATE","movie_distance_2.csv")
\ No newline at end of file
+        openedNeighbours[neighboursFile] = {
+            'signature': signature,
+            'rowOf': {int(movieId): row for row, movieId in enumerate(movieIds)},
+            'ids': np.memmap(neighboursFile + "_ids.dat", dtype='int64', mode='r', shape=(len(movieIds), K)) if K != 0 else np.zeros((len(movieIds), 0), dtype='int64'),
+            'distances': np.memmap(neighboursFile + "_distances.dat", dtype='float32', mode='r', shape=(len(movieIds), K)) if K != 0 else np.zeros((len(movieIds), 0), dtype='float32')
+        }
+    
+    neighbours = openedNeighbours[neighboursFile]
+    
+    row = neighbours['rowOf'].get(int(movie_id))
+    
+    if row is None:
+        print("The movie " + str(movie_id) + " is not in " + neighboursFile)
+        return []
+    
+    if k == 0:
+        k = neighbours['ids'].shape[1]
+    
+    return list(zip(neighbours['ids'][row, :k].tolist(), neighbours['distances'][row, :k].tolist()))
+
+
+
+""" MoviesDistanceRetriever : Function to get the distances from the registered files """
+#-------
+# distanceFile : path to the distance file written by MoviesDistance (string)
+# @return : the distances (numpy.memmap, read only, see condensedOffset), the movie_id of the rows (numpy.array of int64)
+#           scipy.spatial.distance.squareform(distances) gives the whole matrix.
+#-------
+def MoviesDistanceRetriever(distanceFile):
+    
+    movieIds = np.fromfile(distanceFile + ".index", dtype='int64')
+    
+    if len(movieIds) < 2:
+        return np.zeros(0, dtype='float32'), movieIds
+    
+    return np.memmap(distanceFile, dtype='float32', mode='r'), movieIds
+
+
+
+# > python MovieDistanceComputer.py [neighbours|distances] [$FeaturesType] [$DirectoryOfInputDataFiles]
+#   neighbours (by default) : the K nearest movies of each movie (MoviesNeighbours), distances : all the distances (MoviesDistance)
+#   With the directory, its movie metadata is processed (or found in the cache), otherwise the last used metadata is read.
+if __name__ == "__main__":
+    
+    mode = sys.argv[1] if len(sys.argv) > 1 else "neighbours"
+    features = sys.argv[2] if len(sys.argv) > 2 else "INTERMEDIATE"
+    metadataDir = movMtdata.MovieMetadataProcessor(sys.argv[3] + env.IN_MOVIES_METADATA) if len(sys.argv) > 3 else ""
+    
+    if mode == "distances":
+        MoviesDistance(features, "movie_distance_2.dat", MetadataDir = metadataDir)
+    else:
+        MoviesNeighbours(features, MetadataDir = metadataDir)
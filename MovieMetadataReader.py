@@ -7,22 +7,59 @@
 import Tools as rtools
 import env
 import csv
-import pandas as pd
 import numpy as np
+import scipy.sparse as sparse
+import pickle
+import hashlib
+import tempfile
+import glob
+import json
+import shutil
 import time
 import os
 
 
+# The order of the parameters in the columns of movieDF :
+# each features type (see LRPredictor.featureTypes) adds parameters to the previous one,
+# so that the columns of a features type are the first columns of movieDF (a slice, not a copy)
+COLUMN_GROUPS = ["genre", "releaseDate", "popularity", "voteAverage", "adult", "runtime", "collection", "language"]
+
+# The parameters of the processing (see MovieMetadataProcessor) : the processed files of other parameters are not reused
+PROCESSING_PARAMETERS = {
+    'popularityPercentileMax': 99.95,
+    'popularityCategories': 4,
+    'releaseDateCategories': 10,
+    'collectionPercentage': 80,
+    'voteAverageBoundaries': [2.5, 5.0, 6.125, 7.5],
+    'runtimeBoundaries': [60, 180]
+}
+
+# The version of the processed files : the cache of another version is not reused
+CACHE_VERSION = 1
+
+# The file that completes a directory of the cache (see MovieMetadataProcessor), and the file of the last used directory
+CACHE_INFO = "cacheInfo.csv"
+CACHE_CURRENT = "current.txt"
+
+
 """ @MovieMetadataProcessor:  Main Function that process the data """
 # This function process the parameters of the metadatas of movies.
 #-------
 # FileArg : path to the metadata_movie CSV File. (string)
 # OutpurDir : path to the directory for the output files with / at the end. (string)
+#             (empty : the directory of the cache of this file, see metadataCacheDir, or the current directory if env.MMDT_CACHE_DIR is empty)
 # Log : to display the logs
 # @return :
 #       - Create a movieDF.dat file : the numpy array that has been processed. 
+#         (or with env.MMDT_SPARSE, the movieDF_data.dat, movieDF_indices.dat, movieDF_indptr.dat files : the same matrix as CSR)
 #       - Create a movieIndex.dat file : the index of the rows of movieDF (movie_id as integers)
-#       - Create a moviesColumns.csv file : the header of the columns of movieDF
+#       - Create a movieLookUp.pkl file : the dict movie_id (string) -> row number in movieDF
+#       - Create a moviesColumns.csv file : the header of the columns of movieDF (the parameters in the order of COLUMN_GROUPS)
+#       && the directory of the processed files (string), to be given as MetadataDir to the next functions of this file
+#       (without it, they read the last used directory of the cache, see metadataPath)
+#
+# With the cache, the directory is named by a hash of the content of the file, of PROCESSING_PARAMETERS and of the options :
+# the files are only processed if this directory doesn't exist (it is written as a temporary directory renamed at the end).
 #
 # In the process chosen: 
 #       Identification : 'movie_id' as main Id
@@ -37,15 +74,51 @@ def MovieMetadataProcessor(FileArg, OutpurDir = "", Log = False):
         metadataFile = FileArg
     else : 
         print("Should indicate the path to the movie metadata file.")
-        return
+        return ""
+    
+    # Checked before the key of the cache : nothing is processed nor cached with a wrong policy
+    if env.MMDT_DEDUP_POLICY not in ["FIRST", "LAST", "MERGE"]:
+        print("MMDT_DEDUP_POLICY not right")
+        return ""
+    
+    if OutpurDir == "" and metadataCacheRoot() != "":
+        
+        cacheDir = metadataCacheDir(metadataFile)
+        
+        if not os.path.exists(os.path.join(cacheDir, CACHE_INFO)):
+            
+            os.makedirs(metadataCacheRoot(), exist_ok=True)
+            tmpDir = tempfile.mkdtemp(dir=metadataCacheRoot(), prefix=os.path.basename(cacheDir) + ".", suffix=".tmp")
+            
+            MovieMetadataProcessor(metadataFile, tmpDir + os.sep, Log)
+            
+            with open(os.path.join(tmpDir, CACHE_INFO), "w") as output:
+                writer = csv.writer(output, lineterminator='\n')
+                writer.writerow([os.path.abspath(metadataFile), str(CACHE_VERSION)])
+            
+            try:
+                os.rename(tmpDir, cacheDir)
+            except OSError:
+                # Processed at the same time by another run : its directory is kept
+                shutil.rmtree(tmpDir)
+        
+        elif Log:
+            print("Reading the processed metadata from the cache " + cacheDir)
+        
+        # The last used directory : the most recent time of its info file, and the directory read without MovieMetadataProcessor
+        os.utime(os.path.join(cacheDir, CACHE_INFO))
+        with open(os.path.join(metadataCacheRoot(), CACHE_CURRENT), "w") as output:
+            output.write(os.path.basename(cacheDir))
+        
+        return cacheDir + os.sep
     
     if Log:
         print("--------------------------------")
         print("Reading Movie's Metadata")
         print("--------------------------------")
     
-    # Reading Csv in list a
-    a = rtools.readcsv(metadataFile)    
+    # Reading the Csv row per row (the file is not kept in memory)
+    rows = rtools.readcsvRows(metadataFile)
     
     
     if Log:
@@ -73,19 +146,17 @@ def MovieMetadataProcessor(FileArg, OutpurDir = "", Log = False):
     
     start = time.time()
     
-    # Getting the data from list to the dict
-    rtools.getData(a, instances, collectionLookUp, genresLookUp, languagesLookUp)
+    # First pass : getting the data from the rows to the dict (a few values per movie)
+    nbDuplicates = rtools.getData(rows, instances, collectionLookUp, genresLookUp, languagesLookUp)
+    
+    if nbDuplicates < 0:
+        return ""
     
     end = time.time()
     
     if Log:
         print( "getData() execution time : " + str(end - start))
-    
-    # Cleaning ... 
-    rtools.free(a)
-    rtools.free(collectionLookUp)
-    rtools.free(genresLookUp)
-    rtools.free(languagesLookUp)
+        print("Number of duplicated movie_id lines (" + env.MMDT_DEDUP_POLICY + ") : " + str(nbDuplicates))
     
     # Asserting so that the rest will be coherent
     assert rtools.verifyNbInstancesAlign(instances)
@@ -98,64 +169,33 @@ def MovieMetadataProcessor(FileArg, OutpurDir = "", Log = False):
     # Parameter 'Popularity' : 
     #   Since some values were 'too high' -> replacement of those greater the 99.95 percentile by the mean.
     #   To categorize -> In four equal parts according to the percentiles.
-    keptPopularity = rtools.removingInsecureValues(instances['popularity'], 99.95, 0)
-    popularityList = rtools.determineCategoriesBoudaries(keptPopularity, 4)
-    popularityVect = rtools.categorizeVectContinuousVar(keptPopularity, popularityList)
+    keptPopularity = rtools.removingInsecureValues(instances['popularity'], PROCESSING_PARAMETERS['popularityPercentileMax'], 0)
+    popularityList = rtools.determineCategoriesBoudaries(keptPopularity, PROCESSING_PARAMETERS['popularityCategories'])
     
     # Parameter 'Release_Date' : 
     #   Since some values were equal to 0 -> replacement of those values by the mean.
     #   To categorize -> In ten equal parts according to the percentiles.
     keptDates = rtools.removingNullValues(instances['release_date'], True)
-    dateList = rtools.determineCategoriesBoudaries(keptDates, 10)
-    releaseDatesVect = rtools.categorizeVectContinuousVar(keptDates, dateList)
-    
-    # Parameter 'Vote_Average' : 
-    #   To categorize -> In five parts with the inner boundaries as [2.5, 5.0, 6.125, 7.5].
-    keptAverages = instances['vote_average']
-    voteAveragesVect = rtools.categorizeVectContinuousVar(keptAverages, [2.5, 5.0, 6.125, 7.5])
-    
-    # Parameter 'Runtime' : 
-    #   To categorize -> In 3 parts with the inner boundaries as [60,180].
-    keptRuntime = instances['runtime']
-    runtimeVect = rtools.categorizeVectContinuousVar(keptRuntime, [60,180])
-    
-    # Parameter 'Adult' :
-    keptAdult = instances['adult']    
-    adultVect = keptAdult
-    
-    # Cleaning ... 
-    rtools.free(keptDates)
-    rtools.free(keptPopularity)
-    rtools.free(keptAverages)
-    rtools.free(keptRuntime)
-    rtools.free(keptAdult)
+    dateList = rtools.determineCategoriesBoudaries(keptDates, PROCESSING_PARAMETERS['releaseDateCategories'])
     
     # Parameter 'Collection' :
     #   Since the list is wide -> keeping only frequent collections at 80%.
-    collectionList = rtools.getListOfRelevantItemInFeatures(instances['collection'], 80)
-    collectionVect = rtools.categorizeVectVar(instances['collection'], collectionList)
+    collectionList = rtools.getListOfRelevantItemInFeatures(instances['collection'], PROCESSING_PARAMETERS['collectionPercentage'])
     
     # Parameter 'Genres' :
     genresList = [ x for x in list(genresLookUp.keys()) if x != 0]
-    genresVect = rtools.categorizeVectVar(instances['genres'], genresList)
     
     # Parameter 'Languages' :
     languagesList = [ x for x in list(languagesLookUp.keys()) if x != 0]
-    languagesVect = rtools.categorizeVectVar(instances['languages'], languagesList)
-    
-    
-    ## Combining each parameters : Data and Columns
-    ## The order must be respected
-    
-    data = [instances['movie_id'], popularityVect, releaseDatesVect, voteAveragesVect, runtimeVect, adultVect
-            , collectionVect, genresVect, languagesVect]
     
     # The list of parameters : Continuous and Categorical
+    #   'Vote_Average' : To categorize -> In five parts with the inner boundaries as [2.5, 5.0, 6.125, 7.5].
+    #   'Runtime' : To categorize -> In 3 parts with the inner boundaries as [60,180].
     continuousData = [
         ['popularity', popularityList]
         , ['releaseDate', dateList]
-        , ['voteAverage', [2.5, 5.0, 6.125, 7.5]]
-        , ['runtime', [60,180]]
+        , ['voteAverage', PROCESSING_PARAMETERS['voteAverageBoundaries']]
+        , ['runtime', PROCESSING_PARAMETERS['runtimeBoundaries']]
     ]
     categoricalData = [
         ['adult',['isAdult'], False]
@@ -163,111 +203,392 @@ def MovieMetadataProcessor(FileArg, OutpurDir = "", Log = False):
         , ['genre',genresList, True]
         , ['language',languagesList, True]
     ]
-    columnsDF = ['movie_id'] + rtools.formingColumnsDF(continuousData, categoricalData)
     
-    # Writing the columns (without the movie_id column)
+    # The columns of each parameter, put in the order of COLUMN_GROUPS
+    groupColumns = {name: rtools.formingColumnsDF([[name, boundaries]], []) for name, boundaries in continuousData}
+    groupColumns.update({name: rtools.formingColumnsDF([], [[name, categories, nullable]]) for name, categories, nullable in categoricalData})
+    
+    firstColumnOf = {}
+    columnsDF = []
+    for name in COLUMN_GROUPS:
+        firstColumnOf[name] = len(columnsDF)
+        columnsDF += groupColumns[name]
+    
+    # Writing the columns
     with open(OutpurDir + env.MMDT_COLUMNS, "w") as output:
         writer = csv.writer(output, lineterminator='\n')
-        for val in columnsDF[1:]:
+        for val in columnsDF:
             writer.writerow([val])
     
-    # Cleaning ...
-    rtools.free(popularityList)
-    rtools.free(popularityVect)
-    rtools.free(dateList)
-    rtools.free(releaseDatesVect)
-    rtools.free(voteAveragesVect)
-    rtools.free(runtimeVect)
-    rtools.free(adultVect)
-    rtools.free(collectionVect)
-    rtools.free(genresVect)
-    rtools.free(languagesVect)
-    rtools.free(collectionList)
-    rtools.free(genresList)
-    rtools.free(languagesList)
-    
-    # Asserting so that the rest will be coherent (That we haven't lost any instance)
-    assert rtools.verifyNbInstancesList(data,nbinstances)
-    
-    # Having a list of row (instances)
-    newData = rtools.formingTheDictForDF(data)
+    ## The continuous parameters : the column of the category of each movie
+    ## The order must be respected
+    continuousCategories = []
+    for values, (name, boundaries) in zip([keptPopularity, keptDates, instances['vote_average'], instances['runtime']], continuousData):
+        continuousCategories.append(firstColumnOf[name] + rtools.categoryIndexes(values, boundaries))
     
-    # Asserting so that the rest will be coherent
-    assert len(newData) == nbinstances
-    assert len(newData[0]) == len(columnsDF)
+    # Parameter 'Adult' : a single column with the value
+    adultColumn = firstColumnOf['adult']
     
-    ## Making a DataFrame out it. (Historically, wanted to work to DataFrames, 
-    ##  but it turned out that numpy.array were much better for my case.)
-    df = pd.DataFrame(newData, columns=columnsDF)
+    # The categorical parameters : the categories and the first column (then the 'unknown' column after the categories)
+    categoricalColumns = []
+    for key, (name, categories, nullable) in zip(['collection', 'genres', 'languages'], categoricalData[1:]):
+        categoricalColumns.append([key, categories, firstColumnOf[name]])
     
-    rtools.free(data)
-    rtools.free(newData)
-    rtools.free(columnsDF)
+    # Asserting so that the rest will be coherent (That we haven't lost any column)
+    assert len(columnsDF) == sum(len(columns) for columns in groupColumns.values())
     
-    df.set_index('movie_id', inplace=True)
+    # Cleaning ... 
+    rtools.free(keptDates)
+    rtools.free(keptPopularity)
     
     if Log:
         print("----------------------------------")
         print("Registering the Data as .dat files")
         print("----------------------------------")
         
-    # Registering the Indexes of the Data Frame as Integer values (.dat) for futher use
-    dfIndex = df.index
-    dfIndexAsInt = [int(elem) for elem in dfIndex]
-    indexMemmap = np.memmap(OutpurDir + env.MMDT_ROWINDEX, dtype='int64', mode='w+', shape=dfIndex.shape)
+    # Registering the Indexes of the rows as Integer values (.dat) for futher use
+    dfIndexAsInt = [int(elem) for elem in instances['movie_id']]
+    indexMemmap = np.memmap(OutpurDir + env.MMDT_ROWINDEX, dtype='int64', mode='w+', shape=(nbinstances,))
     indexMemmap[:] = dfIndexAsInt[:]
+    
+    # Registering the LookUp movie_id (string) -> row number, to avoid scanning the index
+    dfLookUp = {str(elem): row for row, elem in enumerate(dfIndexAsInt)}
+    with open(OutpurDir + env.MMDT_ROWLOOKUP, "wb") as output:
+        pickle.dump(dfLookUp, output, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    rtools.free(dfLookUp)
+    
+    # Second pass : the rows of the Data are written directly in the .dat file (Numpy.Array), by blocks of movies
+    if env.MMDT_SPARSE:
+        # Only the values that are not 0 : appended block per block
+        dataFile = open(OutpurDir + env.MMDT_SPARSE_DATA, "wb")
+        indicesFile = open(OutpurDir + env.MMDT_SPARSE_INDICES, "wb")
+        indptrFile = open(OutpurDir + env.MMDT_SPARSE_INDPTR, "wb")
+        np.zeros(1, dtype='int64').tofile(indptrFile)
+        nbValues = 0
+    else:
+        dfMemmap = np.memmap(OutpurDir + env.MMDT_DATAFRAME, dtype='float32', mode='w+', shape=(nbinstances, len(columnsDF)))
+    
+    for first in range(0, nbinstances, env.MMDT_BLOCK_ROWS):
+        
+        last = min(first + env.MMDT_BLOCK_ROWS, nbinstances)
+        block = np.zeros((last - first, len(columnsDF)), dtype='float32')
+        blockRows = np.arange(last - first)
+        
+        # A 1 in the column of the category of each continuous parameter
+        for categories in continuousCategories:
+            block[blockRows, categories[first:last]] = 1
+        
+        block[:, adultColumn] = instances['adult'][first:last]
+        
+        # A 1 in the column of each kept category of the movie, or in the 'unknown' column
+        for key, categories, firstCategory in categoricalColumns:
+            block[:, firstCategory:firstCategory + len(categories) + 1] = rtools.categorizeVectVar(instances[key][first:last], categories)
+        
+        if env.MMDT_SPARSE:
+            blockCSR = sparse.csr_matrix(block)
+            blockCSR.data.astype('float32').tofile(dataFile)
+            blockCSR.indices.astype('int32').tofile(indicesFile)
+            (blockCSR.indptr[1:].astype('int64') + nbValues).tofile(indptrFile)
+            nbValues += blockCSR.nnz
+        else:
+            dfMemmap[first:last] = block
+    
+    if env.MMDT_SPARSE:
+        dataFile.close()
+        indicesFile.close()
+        indptrFile.close()
+    else:
+        dfMemmap.flush()
+    
+    # The next functions read these files
+    return OutpurDir
+    
+    
+    
+# @metadataCacheDir : To get the directory of the cache of a metadata file
+#---------
+# metadataFile : path to the movies_metadata.csv file (string)
+# @return : the path of the directory in the cache (string), named by a hash of the content of the file,
+#           of PROCESSING_PARAMETERS, of the options of the processing (env) and of CACHE_VERSION
+#---------
+def metadataCacheDir(metadataFile):
+    
+    key = hashlib.sha256()
+    
+    key.update(json.dumps([CACHE_VERSION, PROCESSING_PARAMETERS, COLUMN_GROUPS, env.MMDT_DEDUP_POLICY, env.MMDT_SPARSE], sort_keys=True).encode("utf8"))
+    
+    with open(metadataFile, "rb") as inputFile:
+        for block in iter(lambda: inputFile.read(env.READ_CHUNK_BYTES), b""):
+            key.update(block)
+    
+    return os.path.join(metadataCacheRoot(), key.hexdigest()[:32])
+
+# @metadataCacheRoot : To get the directory of the cache
+#---------
+# @return : env.MMDT_CACHE_DIR, with the home directory of the user for ~ (string) (empty : no cache)
+#---------
+def metadataCacheRoot():
+    
+    return os.path.expanduser(env.MMDT_CACHE_DIR)
 
-    # Registering the Data Frame as Numpy.Array .dat
-    dfTF = df.values    
-    dfMemmap = np.memmap(OutpurDir + env.MMDT_DATAFRAME, dtype='float32', mode='w+', shape=dfTF.shape)
-    dfMemmap[:] = dfTF[:]
+# @metadataPath : To get the path of a processed file
+#---------
+# filename : the name of the file (string) (example env.MMDT_DATAFRAME)
+# MetadataDir : the directory of the processed files, as returned by MovieMetadataProcessor (string)
+# @return : the path in MetadataDir, or else (empty MetadataDir) in the last used directory of the cache,
+#           or else in the current directory (string)
+#---------
+def metadataPath(filename, MetadataDir = ""):
+    
+    if MetadataDir != "":
+        return os.path.join(MetadataDir, filename)
     
+    currentFile = os.path.join(metadataCacheRoot(), CACHE_CURRENT)
     
+    if metadataCacheRoot() != "" and os.path.exists(currentFile):
+        with open(currentFile, "r") as inputCurrent:
+            return os.path.join(metadataCacheRoot(), inputCurrent.read().strip(), filename)
     
+    return filename
+
+# @metadataDirectory : To get the directory of the processed files that are read
+#---------
+# MetadataDir : the directory of the processed files (string) (see metadataPath)
+# @return : the absolute path of the directory, with / at the end (string) (to be given as MetadataDir by another run)
+#---------
+def metadataDirectory(MetadataDir = ""):
     
+    return os.path.join(os.path.dirname(os.path.abspath(metadataPath(env.MMDT_COLUMNS, MetadataDir))), "")
+
 """ MovieMetadataRetriever : Function to get the data from the registered files """
 #
 # neededColumns: list of string indicating the columns (parameters) of the data that will be kept.
 #                example: ["genre", "releaseDate", "popularity", "voteAverage"]
+# normalized: to get the data normalized by rows (see Tools.normalize), registered once in a .dat file (see MovieMetadataNormalizedFile)
+# MetadataDir : the directory of the processed files (string) (see metadataPath)
 #------
-# It will return the data as a numpy.array and the rowIndex as a list of strings
-# @return: dfTF (numpy.array), dfIndex (list of strings)
+# It will return the data as a numpy.array (a scipy.sparse.csr_matrix with env.MMDT_SPARSE), the rowIndex as a list of strings
+# and the LookUp dict to get the row number of a movie_id
+# The files are opened once per process (see MovieMetadataFiles) : the returned values are shared and must not be modified.
+# With the columns of a features type (the first columns, see COLUMN_GROUPS), the numpy.array is a view on movieDF.dat (read only).
+# @return: dfTF (numpy.array or scipy.sparse.csr_matrix), dfIndex (list of strings), dfLookUp (dict string -> integer)
 #------
-def MovieMetadataRetriever(neededColumns):    
+def MovieMetadataRetriever(neededColumns, normalized = False, MetadataDir = ""):    
+    
+    files = MovieMetadataFiles(MetadataDir)
+    
+    # Getting the Columns of the data matrix
+    dfColumns, dfColumnsNames = MovieMetadataColumns(neededColumns, files['columns'])
+    
+    if normalized and not env.MMDT_SPARSE:
+        
+        # The registered normalized matrix ( Num_Movie_ids x Num_Columns of neededColumns )
+        dfTF = np.memmap(MovieMetadataNormalizedFile(neededColumns, MetadataDir), dtype='float32', mode='r', shape=(len(files['dfIndex']), len(dfColumns)))
+        
+        return dfTF, files['dfIndex'], files['dfLookUp']
+    
+    dfTF = files['dfTF']
+    
+    # From the Data matrix, getting only the wanted columns :
+    # a slice when they follow each other (a view on the memmap), otherwise a copy of them
+    if len(dfColumns) != 0 and dfColumns == list(range(dfColumns[0], dfColumns[-1] + 1)):
+        dfTF = dfTF[:, dfColumns[0]:dfColumns[-1] + 1]
+    else:
+        dfTF = dfTF[:, dfColumns]
+    
+    # The sparse matrix is normalized here (only its values that are not 0)
+    if normalized:
+        dfTF = rtools.normalize(dfTF)
+    
+    return dfTF, files['dfIndex'], files['dfLookUp']
+
+# @MovieMetadataNormalizedFile : To register the data matrix of neededColumns normalized by rows, if it is not already
+#---------
+# neededColumns: list of string indicating the columns (parameters) of the data that will be kept.
+# MetadataDir : the directory of the processed files (string) (see metadataPath)
+#------
+# The file is env.MMDT_NORMALIZED with a key of the names of the columns. It is written again if movieDF.dat is more recent.
+# It is written by blocks of rows (the whole matrix is not in memory), as a temporary file renamed at the end (for the workers).
+# @return: the path to the file (string) : a numpy.array float32 ( Num_Movie_ids x Num_Columns of neededColumns )
+#---------
+def MovieMetadataNormalizedFile(neededColumns, MetadataDir = ""):
+    
+    files = MovieMetadataFiles(MetadataDir)
+    dfColumns, dfColumnsNames = MovieMetadataColumns(neededColumns, files['columns'])
+    
+    key = hashlib.md5("\n".join(dfColumnsNames).encode("utf8")).hexdigest()[:16]
+    normalizedFile = metadataPath(env.MMDT_NORMALIZED.format(key), MetadataDir)
+    
+    if os.path.exists(normalizedFile) and os.stat(normalizedFile).st_mtime_ns >= os.stat(metadataPath(env.MMDT_DATAFRAME, MetadataDir)).st_mtime_ns:
+        return normalizedFile
+    
+    dfTF = MovieMetadataRetriever(neededColumns, False, MetadataDir)[0]
+    
+    tmpFile, tmpName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(normalizedFile)), suffix=".tmp")
+    os.close(tmpFile)
+    
+    normalizedMemmap = np.memmap(tmpName, dtype='float32', mode='w+', shape=dfTF.shape)
+    rtools.normalize(dfTF, out = normalizedMemmap)
+    normalizedMemmap.flush()
+    del normalizedMemmap
+    
+    os.replace(tmpName, normalizedFile)
+    
+    return normalizedFile
+
+# The registered files opened by MovieMetadataFiles in this process
+openedFiles = {}
+
+# @MovieMetadataFiles : To open the registered files, once per process (again if they have been processed again, or for another directory)
+#---------
+# MetadataDir : the directory of the processed files (string) (see metadataPath)
+# @return: dict with the keys 'dfTF' (the whole matrix : numpy.memmap, or scipy.sparse.csr_matrix with env.MMDT_SPARSE),
+#          'dfIndex' (list of strings), 'dfLookUp' (dict string -> integer), 'columns' (the names of the columns, list of strings)
+#---------
+def MovieMetadataFiles(MetadataDir = ""):
+    
+    dataFiles = [env.MMDT_SPARSE_DATA, env.MMDT_SPARSE_INDICES, env.MMDT_SPARSE_INDPTR] if env.MMDT_SPARSE else [env.MMDT_DATAFRAME]
+    
+    # What identifies the current version of the files
+    signature = [(filename, os.stat(filename).st_size, os.stat(filename).st_mtime_ns)
+                 for filename in [metadataPath(name, MetadataDir) for name in [env.MMDT_ROWINDEX, env.MMDT_ROWLOOKUP, env.MMDT_COLUMNS] + dataFiles]]
+    
+    if openedFiles.get('signature') == signature:
+        return openedFiles
     
     # Getting the Indexes of the rows 'Movie_id'
-    dfTFIndex = np.memmap(env.MMDT_ROWINDEX, dtype='int64', mode='r')
-    dfIndex = [str(elem) for elem in dfTFIndex]
+    dfTFIndex = np.memmap(metadataPath(env.MMDT_ROWINDEX, MetadataDir), dtype='int64', mode='r')
+    dfIndex = dfTFIndex.astype(str).tolist()
     
-    # Getting the Data as Numpy.Array
-    dfTF = np.memmap(env.MMDT_DATAFRAME, dtype='float32', mode='r')
+    # Getting the LookUp movie_id -> row number
+    with open(metadataPath(env.MMDT_ROWLOOKUP, MetadataDir), "rb") as inputLookUp:
+        dfLookUp = pickle.load(inputLookUp)
     
-    # Reshaping as matrix ( Num_Movie_ids x Num_Parameters )
-    dfTF = dfTF.reshape((len(dfTFIndex), int(len(dfTF)/len(dfTFIndex))))
+    # Getting the names of the Columns of the data matrix
+    with open(metadataPath(env.MMDT_COLUMNS, MetadataDir), "r") as inputColumns:
+        columns = [val.strip() for val in inputColumns]
+    
+    if env.MMDT_SPARSE:
+        
+        # Getting the Data as a sparse matrix ( Num_Movie_ids x Num_Parameters ) on the memmaps
+        dfTF = sparse.csr_matrix((MovieMetadataSparseFile(metadataPath(env.MMDT_SPARSE_DATA, MetadataDir), 'float32'),
+                                  MovieMetadataSparseFile(metadataPath(env.MMDT_SPARSE_INDICES, MetadataDir), 'int32'),
+                                  np.memmap(metadataPath(env.MMDT_SPARSE_INDPTR, MetadataDir), dtype='int64', mode='r')),
+                                 shape=(len(dfTFIndex), len(columns)))
+    else:
+        
+        # Getting the Data as Numpy.Array, reshaped as matrix ( Num_Movie_ids x Num_Parameters )
+        dfTF = np.memmap(metadataPath(env.MMDT_DATAFRAME, MetadataDir), dtype='float32', mode='r', shape=(len(dfTFIndex), len(columns)))
+    
+    openedFiles.clear()
+    openedFiles.update({'signature': signature, 'dfTF': dfTF, 'dfIndex': dfIndex, 'dfLookUp': dfLookUp, 'columns': columns})
+    
+    return openedFiles
+
+# @MovieMetadataColumns : To get the columns of the data matrix that are kept for neededColumns
+#---------
+# neededColumns: list of string indicating the columns (parameters) of the data that will be kept.
+# columns: the names of all the columns (list of strings) (None : read from env.MMDT_COLUMNS)
+# MetadataDir : the directory of the processed files, to read env.MMDT_COLUMNS (string) (see metadataPath)
+# @return: the column numbers (list of integers) and the column names (list of strings)
+#---------
+def MovieMetadataColumns(neededColumns, columns = None, MetadataDir = ""):
+    
+    if columns is None:
+        with open(metadataPath(env.MMDT_COLUMNS, MetadataDir), "r") as inputColumns:
+            columns = [val.strip() for val in inputColumns]
     
-    # Getting the Columns of the data matrix
     dfColumns = []
-    with open(env.MMDT_COLUMNS, "r") as inputColumns:        
-        index = 0        
-        for val in inputColumns:
-            
-            # keeping only the selected columns from the input neededColumns
-            if val.split('_')[0] in neededColumns:
-                dfColumns += [index]
-                
-            index += 1
+    dfColumnsNames = []
     
-    # From the Data matrix, getting only the wanted columns    
-    dfTF = dfTF[:, dfColumns]
+    for index, val in enumerate(columns):
+        
+        # keeping only the selected columns from the input neededColumns
+        if val.split('_')[0] in neededColumns:
+            dfColumns += [index]
+            dfColumnsNames += [val]
     
-    return dfTF, dfIndex
+    return dfColumns, dfColumnsNames
 
-# @cleaner : Remove create dat files
+# @MovieMetadataSparseFile : To open a file of the sparse movieDF (np.memmap can't open an empty file)
+#---------
+# filename : path to the file (string)
+# dtype : type of the values (string)
+# @return: numpy.memmap (read only), or an empty numpy.array
 #---------
-def cleaner():
-    os.remove(env.MMDT_ROWINDEX)
-    os.remove(env.MMDT_DATAFRAME)
-    os.remove(env.MMDT_COLUMNS)
+def MovieMetadataSparseFile(filename, dtype):
     
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=dtype)
+    
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+# @cleaner : Remove create dat files (and their directory if it is in the cache)
+#---------
+# MetadataDir : the directory of the processed files (string) (see metadataPath)
+#---------
+def cleaner(MetadataDir = ""):
+    os.remove(metadataPath(env.MMDT_ROWINDEX, MetadataDir))
+    os.remove(metadataPath(env.MMDT_ROWLOOKUP, MetadataDir))
+    os.remove(metadataPath(env.MMDT_COLUMNS, MetadataDir))
+    
+    if env.MMDT_SPARSE:
+        os.remove(metadataPath(env.MMDT_SPARSE_DATA, MetadataDir))
+        os.remove(metadataPath(env.MMDT_SPARSE_INDICES, MetadataDir))
+        os.remove(metadataPath(env.MMDT_SPARSE_INDPTR, MetadataDir))
+    else:
+        os.remove(metadataPath(env.MMDT_DATAFRAME, MetadataDir))
+    
+    for normalizedFile in glob.glob(metadataPath(env.MMDT_NORMALIZED.format("*"), MetadataDir)):
+        os.remove(normalizedFile)
+    
+    if os.path.exists(metadataPath(CACHE_INFO, MetadataDir)):
+        os.remove(metadataPath(CACHE_INFO, MetadataDir))
+        os.rmdir(os.path.dirname(metadataPath(CACHE_INFO, MetadataDir)))
+        removeStaleCurrent()
+
+# @MovieMetadataCacheEvictor : Remove directories of the cache (env.MMDT_CACHE_DIR, see metadataCacheRoot)
+#---------
+# nbKept : number of directories kept, the last used ones (integer) (0 : the cache is emptied)
+# @return : the removed directories (list of strings)
+#---------
+# The unfinished directories (an interrupted processing) are removed too : not to be run during a MovieMetadataProcessor.
+#---------
+def MovieMetadataCacheEvictor(nbKept = 0):
+    
+    if metadataCacheRoot() == "" or not os.path.isdir(metadataCacheRoot()):
+        return []
+    
+    directories = [os.path.join(metadataCacheRoot(), name) for name in os.listdir(metadataCacheRoot())]
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+    
+    # The complete directories, from the last used
+    complete = [directory for directory in directories if os.path.exists(os.path.join(directory, CACHE_INFO))]
+    complete.sort(key=lambda directory: os.stat(os.path.join(directory, CACHE_INFO)).st_mtime_ns, reverse=True)
+    
+    removed = complete[nbKept:] + [directory for directory in directories if directory not in complete]
+    
+    for directory in removed:
+        shutil.rmtree(directory)
+    
+    removeStaleCurrent()
+    
+    return removed
+
+# @removeStaleCurrent : Remove the file of the last used directory of the cache, if this directory is not there anymore
+#---------
+def removeStaleCurrent():
+    
+    currentFile = os.path.join(metadataCacheRoot(), CACHE_CURRENT)
+    
+    if metadataCacheRoot() != "" and os.path.exists(currentFile):
+        
+        with open(currentFile, "r") as inputCurrent:
+            current = inputCurrent.read().strip()
+        
+        if not os.path.isdir(os.path.join(metadataCacheRoot(), current)):
+            os.remove(currentFile)
+
 #MovieMetadataProcessor('movies_metadata.csv')
 #MovieMetadataRetriever(["genre", "releaseDate"])
\ No newline at end of file
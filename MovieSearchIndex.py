@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# Approximate search of the best movies for a user profile, over the whole catalog.
+# The normalized movies are split in lists around centroids (spherical k-means, as an IVF index) :
+# a search only scores the movies of the nprobe lists nearest to the profile (more lists : better recall, more time).
+#
+# The movies are normalized (see Tools.normalize) : the best inner products x.theta are also the best cosine similarities.
+#
+
+import Tools as rtools
+import LRPredictor
+import MovieMetadataReader as movMtdata
+import UserProfiles as usrProfiles
+import env
+
+import csv
+import os
+import numpy as np
+
+
+# The files of the index : the end of their path, after env.SEARCH_INDEX_FILE
+SEARCH_FILES = {'centroids': "_centroids.dat", 'movies': "_movies.dat", 'movieIds': "_ids.dat", 'listPtr': "_listPtr.dat", 'info': "_info.csv"}
+
+
+
+# @assignLists : To get the nearest centroid (best inner product) of each movie
+#-------
+# movies : numpy.array (Num_Movies x Num_Parameters), normalized rows
+# centroids : numpy.array (Num_Lists x Num_Parameters), normalized rows
+# blockRows : number of movies compared at once (bounded memory)
+# @return : numpy.array (Num_Movies) of the list number of each movie
+#-------
+def assignLists(movies, centroids, blockRows = 0):
+    
+    if blockRows == 0:
+        blockRows = env.DISTANCE_TILE_ROWS
+    
+    lists = np.zeros(len(movies), dtype='int64')
+    
+    for first in range(0, len(movies), blockRows):
+        lists[first:first + blockRows] = movies[first:first + blockRows].dot(centroids.T).argmax(axis=1)
+    
+    return lists
+
+
+
+# @sphericalKMeans : To find the centroids of the lists (k-means on the cosine similarity)
+#-------
+# movies : numpy.array (Num_Movies x Num_Parameters), normalized rows
+# nbLists : number of centroids (integer)
+# iterations : number of iterations of the k-means (integer)
+# seed : seed of the random choice of the first centroids (integer)
+# @return : numpy.array (Num_Lists x Num_Parameters) of the centroids, normalized rows
+#-------
+# The first centroids are distinct movies (many movies have the same features). A list that becomes empty keeps its centroid.
+#-------
+def sphericalKMeans(movies, nbLists, iterations, seed = 0):
+    
+    distinctMovies = np.unique(movies, axis=0)
+    nbLists = min(nbLists, len(distinctMovies))
+    
+    rng = np.random.default_rng(seed)
+    centroids = distinctMovies[rng.choice(len(distinctMovies), nbLists, replace=False)].astype('float32')
+    
+    for iteration in range(iterations):
+        
+        lists = assignLists(movies, centroids)
+        
+        # The sum of the movies of each list, then normalized
+        sums = np.zeros(centroids.shape, dtype='float64')
+        np.add.at(sums, lists, movies)
+        
+        filled = np.bincount(lists, minlength=nbLists) != 0
+        centroids[filled] = rtools.normalize(sums[filled]).astype('float32')
+    
+    return centroids
+
+
+
+""" @MovieSearchIndexBuilder : Function that builds the search index of the movies """
+#-------
+# FeaturesType : the parameters of the movies (as for the user profiles) (string)
+# nbLists : number of lists (0 : env.SEARCH_NB_LISTS, or the square root of the number of movies)
+# log : to display the logs
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return :
+#       - Create the env.SEARCH_INDEX_FILE + "_centroids.dat" file : the centroids of the lists (float32, Num_Lists x Num_Parameters)
+#       - Create the "_movies.dat" file : the normalized movies, list after list (float32, Num_Movies x Num_Parameters)
+#       - Create the "_ids.dat" file : the movie_id of the rows of "_movies.dat" (int64)
+#       - Create the "_listPtr.dat" file : the first row of each list in "_movies.dat" (and the number of movies at the end, int64)
+#       - Create the "_info.csv" file : the FeaturesType and the directory of the movie metadata on the first line, then the columns
+#-------
+def MovieSearchIndexBuilder(FeaturesType = "BASIC", nbLists = 0, log = False, MetadataDir = ""):
+    
+    if FeaturesType not in LRPredictor.featureTypes: 
+        print("FeaturesType not right")
+        return
+    
+    # Getting the MovieMetadata as normalized matrix
+    dfTF, dfIndex, dfLookUp = movMtdata.MovieMetadataRetriever(LRPredictor.featureTypes[FeaturesType], True, MetadataDir)
+    columns = movMtdata.MovieMetadataColumns(LRPredictor.featureTypes[FeaturesType], None, MetadataDir)[1]
+    
+    movies = rtools.rowsAsArray(dfTF, slice(None), 'float32')
+    
+    if nbLists == 0:
+        nbLists = env.SEARCH_NB_LISTS if env.SEARCH_NB_LISTS != 0 else max(1, int(np.sqrt(len(movies))))
+    
+    centroids = sphericalKMeans(movies, nbLists, env.SEARCH_KMEANS_ITERATIONS)
+    lists = assignLists(movies, centroids)
+    
+    # The movies list after list
+    order = np.argsort(lists, kind='stable')
+    listPtr = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(centroids)))])
+    
+    if log:
+        print(str(len(movies)) + " movies in " + str(len(centroids)) + " lists (largest list : " + str(np.diff(listPtr).max()) + " movies)")
+    
+    prefix = env.SEARCH_INDEX_FILE
+    
+    centroids.tofile(prefix + SEARCH_FILES['centroids'])
+    movies[order].tofile(prefix + SEARCH_FILES['movies'])
+    np.array(dfIndex, dtype='int64')[order].tofile(prefix + SEARCH_FILES['movieIds'])
+    listPtr.astype('int64').tofile(prefix + SEARCH_FILES['listPtr'])
+    
+    # Written at the end : an index without it is not complete
+    with open(prefix + SEARCH_FILES['info'], "w") as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow([FeaturesType, movMtdata.metadataDirectory(MetadataDir)])
+        for val in columns:
+            writer.writerow([val])
+
+
+
+# The search index opened by MovieSearchIndexRetriever in this process
+openedIndex = {}
+
+""" MovieSearchIndexRetriever : Function to get the search index from the registered files """
+#-------
+# The files are opened once per process (again if they have been built again).
+# @return : dict with the keys 'FeaturesType', 'MetadataDir', 'columns', 'centroids', 'movies', 'movieIds', 'listPtr' (see MovieSearchIndexBuilder)
+#-------
+def MovieSearchIndexRetriever():
+    
+    prefix = env.SEARCH_INDEX_FILE
+    
+    signature = [(os.stat(prefix + suffix).st_size, os.stat(prefix + suffix).st_mtime_ns) for suffix in SEARCH_FILES.values()]
+    
+    if openedIndex.get('signature') == signature:
+        return openedIndex
+    
+    with open(prefix + SEARCH_FILES['info'], "r") as inputInfo:
+        lines = [val.strip() for val in inputInfo]
+    
+    firstRow = next(csv.reader([lines[0]]))
+    nbColumns = len(lines) - 1
+    movieIds = np.fromfile(prefix + SEARCH_FILES['movieIds'], dtype='int64')
+    
+    openedIndex.clear()
+    openedIndex.update({
+        'signature': signature,
+        'FeaturesType': firstRow[0],
+        'MetadataDir': firstRow[1] if len(firstRow) > 1 else "",
+        'columns': lines[1:],
+        'centroids': np.fromfile(prefix + SEARCH_FILES['centroids'], dtype='float32').reshape((-1, nbColumns)),
+        'movies': np.memmap(prefix + SEARCH_FILES['movies'], dtype='float32', mode='r', shape=(len(movieIds), nbColumns)),
+        'movieIds': movieIds,
+        'listPtr': np.fromfile(prefix + SEARCH_FILES['listPtr'], dtype='int64')
+    })
+    
+    return openedIndex
+
+
+
+# @topMovies : To get the best movies for a user profile (approximate search)
+#-------
+# userProfile : numpy.array (Num_Parameters) of the user's feature vector (as returned by the gradient descent)
+# N : number of movies (integer)
+# nprobe : number of lists searched, the nearest ones to the profile (0 : env.SEARCH_NPROBE) (all the lists : exact search)
+# @return : list of (movie_id (integer), score x.theta (float)), from the best movie
+#-------
+def topMovies(userProfile, N = 10, nprobe = 0):
+    
+    index = MovieSearchIndexRetriever()
+    
+    userProfile = np.asarray(userProfile, dtype='float32')
+    
+    if len(userProfile) != index['movies'].shape[1]:
+        print("The profile has " + str(len(userProfile)) + " parameters, the search index has " + str(index['movies'].shape[1]) + " (" + index['FeaturesType'] + ")")
+        return []
+    
+    if nprobe == 0:
+        nprobe = env.SEARCH_NPROBE
+    
+    centroids = index['centroids']
+    listPtr = index['listPtr']
+    nprobe = min(nprobe, len(centroids))
+    
+    if nprobe < len(centroids):
+        # The nprobe lists with the best centroids, and the rows of their movies (each list is a slice of the movies)
+        probed = np.argpartition(-centroids.dot(userProfile), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(listPtr[l], listPtr[l + 1]) for l in probed])
+        scores = index['movies'][rows].dot(userProfile)
+    else:
+        # All the lists : exact search
+        rows = np.arange(len(index['movieIds']))
+        scores = index['movies'].dot(userProfile)
+
+    N = min(N, len(scores))
+    
+    if N == 0:
+        return []
+    
+    best = np.argpartition(-scores, N - 1)[:N]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    
+    return list(zip(index['movieIds'][rows[best]].tolist(), scores[best].tolist()))
+
+
+
+# The registered profiles opened by RecommendMovies in this process
+openedProfiles = {}
+
+# @RecommendMovies : To get the best movies for a registered user (see UserProfiles)
+#-------
+# user_id : the user (integer)
+# N : number of movies (integer)
+# nprobe : number of lists searched (0 : env.SEARCH_NPROBE)
+# InputDir : path to the directory of the registered profiles with / at the end. (string)
+# @return : list of (movie_id (integer), score (float)), from the best movie ([] if the user is unknown)
+#-------
+# The profiles are opened once per process (again if they, or the index, have changed).
+# They must have been trained on the movie metadata of the index.
+#-------
+def RecommendMovies(user_id, N = 10, nprobe = 0, InputDir = ""):
+    
+    index = MovieSearchIndexRetriever()
+    
+    profilesFiles = [InputDir + env.PROFILES_DATAFRAME, InputDir + env.PROFILES_ROWINDEX, InputDir + env.PROFILES_COLUMNS]
+    signature = [index['signature']] + [(os.stat(name).st_size, os.stat(name).st_mtime_ns) for name in profilesFiles]
+    
+    if openedProfiles.get('InputDir') != InputDir or openedProfiles.get('signature') != signature:
+        
+        openedProfiles.clear()
+        
+        metadataDir = usrProfiles.UserProfilesMetadataDir(InputDir)
+        
+        if metadataDir != "" and index['MetadataDir'] != "" and os.path.abspath(metadataDir) != os.path.abspath(index['MetadataDir']):
+            print("The user profiles have been trained on the movie metadata of " + metadataDir + ", the search index is built on " + index['MetadataDir'])
+            return []
+        
+        userProfiles, userLookUp = usrProfiles.UserProfilesRetriever(index['FeaturesType'], index['columns'], InputDir)
+        
+        if userProfiles is None:
+            return []
+        
+        openedProfiles.update({'InputDir': InputDir, 'signature': signature, 'userProfiles': userProfiles, 'userLookUp': userLookUp})
+    
+    if int(user_id) not in openedProfiles['userLookUp']:
+        print("The user " + str(user_id) + " has no registered profile")
+        return []
+    
+    return topMovies(openedProfiles['userProfiles'][openedProfiles['userLookUp'][int(user_id)]], N, nprobe)
+
+
+
+# @cleaner : Remove the files of the search index
+#---------
+def cleaner():
+    
+    for suffix in SEARCH_FILES.values():
+        if os.path.exists(env.SEARCH_INDEX_FILE + suffix):
+            os.remove(env.SEARCH_INDEX_FILE + suffix)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# To search the best configuration of the engine : every combination of features type, rating type, learning rate and epochs
+# is trained and scored against the right ratings (as Main.Evaluate), without writing the predictions in files.
+#
+# The ratings, the evaluation and the targets are read once. The profiles only depend on the features type, the learning rate
+# and the epochs : they are trained once for all the rating types. These trainings are spread over processes.
+#
+# > python ParameterSweep.py [$DirectoryOfInputDataFiles] [$TargetFilePath] [$ResultsFilePath]
+#
+
+import Tools as rtools
+import LinearRegressionGradientDescent as LRGR
+import LRPredictor
+import MovieMetadataReader as movMtdata
+import env
+
+import csv
+import itertools
+import multiprocessing
+import numpy as np
+import sys
+import time
+
+
+# The data of the current process (filled by initSweepWorker)
+workerData = {}
+
+
+
+# @sweepShards : To prepare the users needed for the evaluation, once for all the configurations
+#-------
+# trainingFile : path to the ratings file (string)
+# testFile : path to the file that has the couple (userId, movieId) to be rated (string)
+# maxRate : maxRate in data (5 in our case)
+# log : to display the logs
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : list of shards (as in EngineRunnerLRPred), a shard is a dict with the numpy.arrays
+#       - 'userIds' : the users with at least one rated movie in our dataset
+#       - 'userPtr', 'ratedRows', 'ratedRates' : their ratings (see LRPredictor.usersToCSR)
+#       - 'evalPtr', 'evalRows', 'evalMovieIds' : their movies to be rated that are in our dataset (the movies of the user u
+#         are at evalPtr[u]:evalPtr[u+1]), as dfTF's row numbers and as movie_id
+#-------
+# The rows of the movies are the same for all the features types.
+#-------
+def sweepShards(trainingFile, testFile, maxRate, log = False, MetadataDir = ""):
+
+    dfLookUp = movMtdata.MovieMetadataFiles(MetadataDir)['dfLookUp']
+
+    evalutionByUser = rtools.readCsvEvaluationData(testFile, log)
+
+    counts = {'rownum': 0, 'errornum': 0}
+    usersRatings = LRPredictor.readRatingsByUser(trainingFile, maxRate, counts, log)
+
+    shards = []
+
+    for shard in LRPredictor.shardingUsers(usersRatings, evalutionByUser, env.SHARD_NB_USERS):
+
+        kept, userPtr, ratedRows, ratedRates = LRPredictor.usersToCSR(shard, dfLookUp)
+
+        evalMovies = [[movieid for movieid in shard[position][3] if movieid in dfLookUp] for position in kept]
+
+        shards.append({
+            'userIds': np.array([shard[position][0] for position in kept], dtype='int64'),
+            'userPtr': userPtr, 'ratedRows': ratedRows, 'ratedRates': ratedRates,
+            'evalPtr': np.concatenate([[0], np.cumsum([len(movies) for movies in evalMovies], dtype='int64')]).astype('int64'),
+            'evalRows': np.array([dfLookUp[movieid] for movies in evalMovies for movieid in movies], dtype='int64'),
+            'evalMovieIds': np.array([movieid for movies in evalMovies for movieid in movies], dtype='int64')
+        })
+
+    if log:
+        print("Finish reading file "+ trainingFile +" : number of lines : "+ str(counts['rownum']) + ': number of skipped lines : ' + str(counts['errornum']))
+
+    return shards
+
+
+
+# @initSweepWorker : To give the shared data to the current process (a worker of the pool, or the main process)
+#-------
+# shards : the users needed for the evaluation (see sweepShards)
+# targets : dict with the numpy.arrays 'userId', 'movieId', 'rating' of the right ratings
+# maxRate : maxRate in data (5 in our case)
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+#-------
+def initSweepWorker(shards, targets, maxRate, MetadataDir = ""):
+
+    workerData['shards'] = shards
+    workerData['targets'] = targets
+    workerData['maxRate'] = maxRate
+    workerData['MetadataDir'] = MetadataDir
+
+
+
+# @SweepConfiguration : To train the profiles of a configuration and score them for several rating types
+#-------
+# configuration : (FeaturesType, list of RatingType, learningRate, epochs)
+# @return : list of [FeaturesType, RatingType, learningRate, epochs, RMSE, MAE, coverage, seconds], one per RatingType
+#-------
+def SweepConfiguration(configuration):
+
+    FeaturesType, RatingTypes, learningRate, epochs = configuration
+
+    start = time.time()
+
+    dfTF = movMtdata.MovieMetadataRetriever(LRPredictor.featureTypes[FeaturesType], True, workerData['MetadataDir'])[0]
+    maxRate = workerData['maxRate']
+
+    users = []
+    movies = []
+    predictions = {ratingType: [] for ratingType in RatingTypes}
+
+    for shard in workerData['shards']:
+
+        userProfiles = LRGR.LinearRegressionAllUsers(shard['userPtr'], rtools.rowsAsArray(dfTF, shard['ratedRows']), shard['ratedRates'], epochs, learningRate)
+
+        evalPtr = shard['evalPtr']
+
+        for user, userProfile in enumerate(userProfiles):
+
+            moviesRows = shard['evalRows'][evalPtr[user]:evalPtr[user + 1]]
+
+            if len(moviesRows) == 0:
+                continue
+
+            for ratingType in RatingTypes:
+                predictions[ratingType].append(LRPredictor.ScoreMovies(userProfile, moviesRows, dfTF, maxRate, ratingType))
+
+        users.append(np.repeat(shard['userIds'], np.diff(evalPtr)))
+        movies.append(shard['evalMovieIds'])
+
+    users = np.concatenate(users + [np.zeros(0, dtype='int64')])
+    movies = np.concatenate(movies + [np.zeros(0, dtype='int64')])
+
+    res = []
+
+    for ratingType in RatingTypes:
+
+        ratings = np.concatenate(predictions[ratingType] + [np.zeros(0)])
+        metrics = rtools.evaluationMetrics(workerData['targets'], {'userId': users, 'movieId': movies, 'rating': ratings})
+
+        res.append([FeaturesType, ratingType, learningRate, epochs, metrics['RMSE'], metrics['MAE'], metrics['coverage'], time.time() - start])
+
+    return res
+
+
+
+""" SweepRunner : Main Function """
+# Trains and scores every combination of the parameters (see Main.Evaluate for one configuration).
+#-------
+# trainingFile : path to the ratings file (string)
+# testFile : path to the file that has the couple (userId, movieId) to be rated (string)
+# targetFile : path to the file that has the right ratings, for the couples of testFile (string)
+# FeaturesTypes, RatingTypes : lists of the features types and of the rating types (lists of strings) (see EngineRunnerLRPred)
+# learningRates, epochs : lists of the values of the gradient descent (empty : env.SWEEP_LEARNINGRATES, env.SWEEP_EPOCHS)
+# log : to display the logs
+# nbWorkers : number of processes (integer) (0 : env.NB_WORKERS, 1 : no parallelization)
+# outputFile : path to the csv file of the results (string) (empty : no file)
+# MetadataDir : the directory of the processed movie metadata (string) (see MovieMetadataReader.metadataPath)
+# @return : the results table, sorted by RMSE : list of [FeaturesType, RatingType, learningRate, epochs, RMSE, MAE, coverage, seconds]
+#           && print the table
+#-------
+# The movie metadata must have been processed before (see MovieMetadataReader.MovieMetadataProcessor).
+# seconds is the time of the training and the scoring of the configuration (shared by its rating types).
+#-------
+def SweepRunner(trainingFile, testFile, targetFile, FeaturesTypes = ["INTERMEDIATE"], RatingTypes = ["DOTPRODUCT", "COSINE", "BRAYCURTIS"]
+                , learningRates = [], epochs = [], log = False, nbWorkers = 0, outputFile = "", MetadataDir = ""):
+
+    for FeaturesType in FeaturesTypes:
+        if FeaturesType not in LRPredictor.featureTypes:
+            print("FeaturesType not right")
+            return []
+
+    for RatingType in RatingTypes:
+        if RatingType not in ["DOTPRODUCT", "BRAYCURTIS", "COSINE"]:
+            print("DistanceType not right")
+            return []
+
+    if len(learningRates) == 0:
+        learningRates = env.SWEEP_LEARNINGRATES
+
+    if len(epochs) == 0:
+        epochs = env.SWEEP_EPOCHS
+
+    if nbWorkers == 0:
+        nbWorkers = env.NB_WORKERS
+
+    # Max value of rating
+    maxRate = 5
+
+    start = time.time()
+
+    # The inputs shared by all the configurations
+    shards = sweepShards(trainingFile, testFile, maxRate, log, MetadataDir)
+    targets = rtools.readCsvArrays(targetFile, rtools.SCORED_COLUMNS, log)[0]
+
+    # The normalized matrices are registered once, before the workers open them
+    if not env.MMDT_SPARSE:
+        for FeaturesType in FeaturesTypes:
+            movMtdata.MovieMetadataNormalizedFile(LRPredictor.featureTypes[FeaturesType], MetadataDir)
+
+    if log:
+        print("Reading the inputs execution time : " + str(time.time() - start))
+
+    configurations = [(FeaturesType, RatingTypes, learningRate, epoch) for FeaturesType, learningRate, epoch in itertools.product(FeaturesTypes, learningRates, epochs)]
+
+    res = []
+
+    if nbWorkers == 1:
+
+        initSweepWorker(shards, targets, maxRate, MetadataDir)
+
+        for configurationRes in map(SweepConfiguration, configurations):
+            res += configurationRes
+
+    else:
+
+        if log:
+            print("Sweep of " + str(len(configurations)) + " trainings with " + str(nbWorkers) + " workers")
+
+        with multiprocessing.Pool(nbWorkers, initializer=initSweepWorker, initargs=(shards, targets, maxRate, MetadataDir)) as pool:
+            for configurationRes in pool.imap_unordered(SweepConfiguration, configurations):
+                res += configurationRes
+
+    res.sort(key=lambda row: (row[4], row[0], row[1], row[2], row[3]))
+
+    header = ["featureType", "ratingType", "learningRate", "epochs", "rmse", "mae", "coverage", "seconds"]
+
+    print(" ".join(name.rjust(12) for name in header))
+    for row in res:
+        print(" ".join(str(val if i < 4 else round(val, 4)).rjust(12) for i, val in enumerate(row)))
+
+    if outputFile != "":
+        with open(outputFile, "w", encoding="utf8") as ofile:
+            writer = csv.writer(ofile, lineterminator='\n')
+            writer.writerow(header)
+            writer.writerows(res)
+
+    if log:
+        print("Sweep execution time : " + str(time.time() - start))
+
+    return res
+
+
+
+if __name__ == "__main__":
+
+    dataDirectory = sys.argv[1] if len(sys.argv) > 1 else ""
+    targetFile = sys.argv[2] if len(sys.argv) > 2 else dataDirectory + "evaluation_targets.csv"
+    resultsFile = sys.argv[3] if len(sys.argv) > 3 else "sweep_results.csv"
+
+    metadataDir = movMtdata.MovieMetadataProcessor(dataDirectory + env.IN_MOVIES_METADATA, "", False)
+
+    SweepRunner(dataDirectory + env.IN_RATINGS, dataDirectory + env.IN_EVALUATION_RATINGS, targetFile
+                , ["BASIC", "INTERMEDIATE", "ADVANCED", "ALL"], outputFile = resultsFile, MetadataDir = metadataDir)
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+#
+# Online prediction : a local HTTP server that answers the predictions of the registered users' profiles (see Main.py -train).
+# The movie metadata and the profiles are opened once. The requests that arrive together are gathered in one batch,
+# computed with one matrix operation (LRPredictor.ScorePairs, ScoreAllMovies) : the same scores as the batch prediction.
+#
+# > python PredictionServer.py [$DirectoryOfProfiles] [$Port]
+#
+#   GET /predict?user=1&movies=10,20,30  ->  {"user": 1, "predictions": [[10, 3.5], [30, 4.0]]}  (the movies of our dataset)
+#   GET /top?user=1&n=10                 ->  {"user": 1, "movies": [[movie_id, rating], ...]}  (the best predictions first)
+#   GET /stats                           ->  {"requests": ..., "p50_ms": ..., "p99_ms": ..., "batches": ..., "mean_batch": ...}
+#
+
+import Tools as rtools
+import LRPredictor
+import MovieMetadataReader as movMtdata
+import UserProfiles as usrProfiles
+import env
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import numpy as np
+import sys
+import time
+import urllib.parse
+
+
+# The data of the server (filled by initServer)
+serverData = {}
+
+
+
+# @initServer : To open the movie metadata and the registered profiles, once
+#-------
+# InputDir : path to the directory of the registered profiles with / at the end (string)
+# RatingType : how to compute the prediction from the userProfile (string) (empty : env.RATING_TYPE)
+# MetadataDir : the directory of the processed movie metadata (string) (empty : the one of the training, see UserProfilesWriter)
+# @return : True if the server can start, False otherwise (the reason is printed)
+#-------
+def initServer(InputDir = "", RatingType = "", MetadataDir = ""):
+
+    if RatingType == "":
+        RatingType = env.RATING_TYPE
+
+    if RatingType not in ["DOTPRODUCT", "BRAYCURTIS", "COSINE"]:
+        print("DistanceType not right")
+        return False
+
+    # The profiles are trained with a FeaturesType : the movies are read with the same one, from the same metadata
+    FeaturesType = usrProfiles.UserProfilesInfo(InputDir)[0]
+    
+    if MetadataDir == "":
+        MetadataDir = usrProfiles.UserProfilesMetadataDir(InputDir)
+
+    if FeaturesType not in LRPredictor.featureTypes:
+        print("FeaturesType not right")
+        return False
+
+    columns = movMtdata.MovieMetadataColumns(LRPredictor.featureTypes[FeaturesType], None, MetadataDir)[1]
+    userProfiles, userLookUp = usrProfiles.UserProfilesRetriever(FeaturesType, columns, InputDir)
+
+    if userProfiles is None:
+        return False
+
+    dfTF, dfIndex, dfLookUp = movMtdata.MovieMetadataRetriever(LRPredictor.featureTypes[FeaturesType], True, MetadataDir)
+
+    serverData.update({
+        'userProfiles': userProfiles,
+        'userLookUp': userLookUp,
+        # The movies in memory, as a dense matrix, for the products of the batches
+        'movies': rtools.rowsAsArray(dfTF, slice(None)),
+        'movieIds': np.array(dfIndex, dtype='int64'),
+        'dfLookUp': dfLookUp,
+        'RatingType': RatingType,
+        'maxRate': 5,
+        'latencies': collections.deque(maxlen=env.SERVER_LATENCY_WINDOW),
+        'nbRequests': 0,
+        'nbBatches': 0,
+        'nbBatchedRequests': 0
+    })
+
+    return True
+
+
+
+# @ComputeBatch : To answer a batch of requests with one matrix operation per kind of request
+#-------
+# requests : list of (kind, user row, argument) : ("predict", row, list of dfTF's rows) or ("top", row, n)
+# @return : list of the answers, in the order of the requests : list of (movie_id, rating) (the best first for "top")
+#-------
+def ComputeBatch(requests):
+
+    userProfiles = serverData['userProfiles']
+    movies = serverData['movies']
+    movieIds = serverData['movieIds']
+    maxRate = serverData['maxRate']
+    RatingType = serverData['RatingType']
+
+    res = [None] * len(requests)
+
+    # All the couples (user, movie) of the "predict" requests
+    predicts = [position for position, request in enumerate(requests) if request[0] == "predict"]
+
+    if len(predicts) != 0:
+
+        counts = [len(requests[position][2]) for position in predicts]
+        userRows = np.repeat([requests[position][1] for position in predicts], counts)
+        movieRows = np.array([row for position in predicts for row in requests[position][2]], dtype='int64')
+
+        ratings = LRPredictor.RoundScores(LRPredictor.ScorePairs(userProfiles[userRows], movies[movieRows], maxRate, RatingType), maxRate)
+
+        first = 0
+        for position, count in zip(predicts, counts):
+            res[position] = list(zip(movieIds[movieRows[first:first + count]].tolist(), ratings[first:first + count].tolist()))
+            first += count
+
+    # The scores of all the movies for the users of the "top" requests
+    tops = [position for position, request in enumerate(requests) if request[0] == "top"]
+
+    if len(tops) != 0:
+
+        scores = LRPredictor.ScoreAllMovies(userProfiles[[requests[position][1] for position in tops]], movies, maxRate, RatingType)
+
+        for scoresRow, position in zip(scores, tops):
+
+            n = min(requests[position][2], len(scoresRow))
+
+            if n == 0:
+                res[position] = []
+                continue
+
+            best = np.argpartition(-scoresRow, n - 1)[:n]
+            best = best[np.argsort(-scoresRow[best], kind='stable')]
+
+            res[position] = list(zip(movieIds[best].tolist(), LRPredictor.RoundScores(scoresRow[best], maxRate).tolist()))
+
+    return res
+
+
+
+# @batcher : To gather the requests that arrive together and compute them at once (in another thread : the server keeps reading)
+#-------
+# queue : asyncio.Queue of (kind, user row, argument, future)
+# executor : the thread that computes the batches
+#-------
+# A batch waits env.SERVER_BATCH_WAIT_MS after its first request, or until it has env.SERVER_MAX_BATCH requests.
+#-------
+async def batcher(queue, executor):
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+
+        batch = [await queue.get()]
+        deadline = loop.time() + env.SERVER_BATCH_WAIT_MS / 1000.
+
+        while len(batch) < env.SERVER_MAX_BATCH:
+
+            timeout = deadline - loop.time()
+
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        serverData['nbBatches'] += 1
+        serverData['nbBatchedRequests'] += len(batch)
+
+        try:
+            answers = await loop.run_in_executor(executor, ComputeBatch, [request[:3] for request in batch])
+        except Exception as error:
+            # Only this batch fails : the batcher keeps answering the next requests
+            for request in batch:
+                if not request[3].done():
+                    request[3].set_exception(error)
+            continue
+
+        # A request might have been cancelled while waiting (its connection closed)
+        for request, answer in zip(batch, answers):
+            if not request[3].done():
+                request[3].set_result(answer)
+
+
+
+# @latencyStats : To get the statistics of the last requests
+#-------
+# @return : dict with the number of requests, the p50 and p99 latencies (ms) of the last env.SERVER_LATENCY_WINDOW requests,
+#           the number of batches and their mean size
+#-------
+def latencyStats():
+
+    latencies = list(serverData['latencies'])
+
+    return {
+        'requests': serverData['nbRequests'],
+        'p50_ms': float(np.percentile(latencies, 50) * 1e3) if len(latencies) != 0 else 0,
+        'p99_ms': float(np.percentile(latencies, 99) * 1e3) if len(latencies) != 0 else 0,
+        'batches': serverData['nbBatches'],
+        'mean_batch': serverData['nbBatchedRequests'] / serverData['nbBatches'] if serverData['nbBatches'] != 0 else 0
+    }
+
+
+
+# @answerRequest : To answer the request of a path
+#-------
+# target : the path and the query of the request (string)
+# queue : asyncio.Queue of the batcher
+# @return : the HTTP status (integer) and the answer (dict)
+#-------
+async def answerRequest(target, queue):
+
+    url = urllib.parse.urlsplit(target)
+    query = urllib.parse.parse_qs(url.query)
+
+    if url.path == "/stats":
+        return 200, latencyStats()
+
+    if url.path not in ["/predict", "/top"]:
+        return 404, {'error': "Unknown path " + url.path}
+
+    try:
+        user_id = int(query['user'][0])
+        n = int(query.get('n', ["10"])[0])
+    except (KeyError, ValueError):
+        return 400, {'error': "The user (and n) must be integers"}
+
+    if user_id not in serverData['userLookUp']:
+        return 404, {'error': "The user " + str(user_id) + " has no registered profile"}
+
+    userRow = serverData['userLookUp'][user_id]
+    future = asyncio.get_running_loop().create_future()
+
+    if url.path == "/predict":
+
+        # Only the movies of our dataset can be predicted
+        moviesToBeRated = [movieid for value in query.get('movies', []) for movieid in value.split(",")]
+        moviesRows = [serverData['dfLookUp'][movieid] for movieid in moviesToBeRated if movieid in serverData['dfLookUp']]
+
+        await queue.put(("predict", userRow, moviesRows, future))
+
+        return 200, {'user': user_id, 'predictions': await future}
+
+    await queue.put(("top", userRow, max(0, n), future))
+
+    return 200, {'user': user_id, 'movies': await future}
+
+
+
+# @handleConnection : To read the HTTP requests of a connection (kept alive) and write their answers
+#-------
+# queue : asyncio.Queue of the batcher
+# @return : the handler of the connections (for asyncio.start_server)
+#-------
+def handleConnection(queue):
+
+    async def handler(reader, writer):
+
+        try:
+            while True:
+
+                requestLine = await reader.readline()
+
+                if not requestLine:
+                    break
+
+                start = time.perf_counter()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in [b"\r\n", b"\n", b""]:
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                # The body is not used (the arguments are in the query)
+                if int(headers.get("content-length", "0")) > 0:
+                    await reader.readexactly(int(headers["content-length"]))
+
+                parts = requestLine.decode("latin-1").split()
+
+                if len(parts) != 3 or parts[0] != "GET":
+                    status, answer = 405, {'error': "Only GET requests"}
+                else:
+                    status, answer = await answerRequest(parts[1], queue)
+
+                body = json.dumps(answer).encode("utf8")
+                keepAlive = parts[-1:] == ["HTTP/1.1"] and headers.get("connection", "").lower() != "close"
+
+                writer.write(("HTTP/1.1 " + str(status) + (" OK" if status == 200 else " Error") + "\r\n"
+                              + "Content-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\n"
+                              + "Connection: " + ("keep-alive" if keepAlive else "close") + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+
+                serverData['nbRequests'] += 1
+                serverData['latencies'].append(time.perf_counter() - start)
+
+                if not keepAlive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    return handler
+
+
+
+""" PredictionServer : Main Function """
+# Starts the server, until it is stopped (Ctrl+C), and prints the latency statistics at the end.
+#-------
+# InputDir : path to the directory of the registered profiles with / at the end (string)
+# host, port : the address of the server (empty, 0 : env.SERVER_HOST, env.SERVER_PORT)
+# RatingType : how to compute the prediction from the userProfile (string) (empty : env.RATING_TYPE)
+# MetadataDir : the directory of the processed movie metadata (string) (empty : the one of the training, see UserProfilesWriter)
+#-------
+# The movie metadata must have been processed, and the profiles trained (see Main.py -train).
+#-------
+async def PredictionServer(InputDir = "", host = "", port = 0, RatingType = "", MetadataDir = ""):
+
+    if not initServer(InputDir, RatingType, MetadataDir):
+        return
+
+    queue = asyncio.Queue()
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+
+        batcherTask = asyncio.ensure_future(batcher(queue, executor))
+        server = await asyncio.start_server(handleConnection(queue), host if host != "" else env.SERVER_HOST, port if port != 0 else env.SERVER_PORT)
+
+        print("Prediction server on " + ", ".join(str(sock.getsockname()) for sock in server.sockets) + " (" + serverData['RatingType'] + ")")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcherTask.cancel()
+            print("Latency : " + json.dumps(latencyStats()))
+
+
+
+if __name__ == "__main__":
+
+    try:
+        asyncio.run(PredictionServer(sys.argv[1] if len(sys.argv) > 1 else "", "", int(sys.argv[2]) if len(sys.argv) > 2 else 0))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# Data Processing of the ratings file (ratings.csv)
+# The ratings are saved once in .dat files (sorted by user), and read back without parsing the csv again.
+#
+
+import Tools as rtools
+import env
+import csv
+import numpy as np
+import time
+import os
+import shutil
+import tempfile
+
+
+# The version of the .dat files : a cache of another version is rebuilt
+CACHE_VERSION = 1
+
+# The columns of the cache : name and dtype
+CACHE_COLUMNS = [('userId', 'int32'), ('userPtr', 'int64'), ('movieId', 'int32'), ('rating', 'float32'), ('timestamp', 'int64')]
+
+
+
+# @cachePrefix : To get the beginning of the path of the cache files of a ratings file
+#-------
+# ratingsFile : path to the ratings file (string)
+# @return : the path, to be completed by the name of a column (string)
+#-------
+def cachePrefix(ratingsFile):
+
+    # In env.RATINGS_CACHE_DIR (a relative path is in the directory of the ratings file)
+    cacheDir = os.path.join(os.path.dirname(ratingsFile), env.RATINGS_CACHE_DIR)
+
+    return os.path.join(cacheDir, os.path.basename(ratingsFile) + ".cache_")
+
+
+
+# @sourceSignature : To get what identifies the current version of the ratings file
+#-------
+# ratingsFile : path to the ratings file (string)
+# @return : list of strings [version, size, modification time]
+#-------
+def sourceSignature(ratingsFile):
+
+    stat = os.stat(ratingsFile)
+
+    return [str(CACHE_VERSION), str(stat.st_size), str(stat.st_mtime_ns)]
+
+
+
+# @sortedRun : To sort by user the ratings of some chunks of the ratings file
+#-------
+# chunks : list of dicts name -> numpy.array (as from Tools.readCsvArraysChunks)
+# @return : dict name -> numpy.array of the ratings (userId, movieId, rating, timestamp), sorted by user
+#           (stable : the order of the file is kept for a same user)
+#-------
+def sortedRun(chunks):
+
+    run = {name: np.concatenate([chunk[name] for chunk in chunks] + [np.zeros(0, dtype=dtype)]).astype(dtype) for name, dtype in CACHE_COLUMNS if name != 'userPtr'}
+    order = np.argsort(run['userId'], kind='stable')
+
+    return {name: column[order] for name, column in run.items()}
+
+
+
+# @spillRun : To write a sorted run in temporary files, and open them back as numpy.memmap
+#-------
+# run : dict name -> numpy.array (as from sortedRun), not empty
+# spillDir : directory of the temporary files (string)
+# @return : dict name -> numpy.memmap (read only) of the run
+#-------
+def spillRun(run, spillDir):
+
+    spillPrefix = os.path.join(spillDir, "run_" + str(len(os.listdir(spillDir))) + "_")
+
+    for name, column in run.items():
+        column.tofile(spillPrefix + name + ".dat")
+
+    return {name: np.memmap(spillPrefix + name + ".dat", dtype=column.dtype, mode='r') for name, column in run.items()}
+
+
+
+# @mergeRuns : To merge sorted runs into the cache files, block per block
+#-------
+# runs : list of dicts name -> numpy.array (as from sortedRun or spillRun), in the order of the file
+# prefix : the beginning of the path of the cache files (see cachePrefix)
+# blockRows : number of rows taken from each run at once (integer)
+# @return : the number of ratings (integer)
+#       && write the cache columns (see RatingsProcessor)
+#-------
+# A block ends with a user whose ratings are all in the block (for all the runs) : the users and userPtr are written
+# block per block. For a same user, the ratings of a run come before the ones of the next run (the order of the file).
+#-------
+def mergeRuns(runs, prefix, blockRows):
+
+    outputs = {name: open(prefix + name + ".dat", "wb") for name, dtype in CACHE_COLUMNS}
+
+    try:
+
+        cursors = [0] * len(runs)
+        nbRatings = 0
+
+        while True:
+
+            active = [position for position, run in enumerate(runs) if cursors[position] < len(run['userId'])]
+
+            if len(active) == 0:
+                break
+
+            # The smallest of the last users of the next blocks of the runs
+            lastUser = min(runs[position]['userId'][min(cursors[position] + blockRows, len(runs[position]['userId'])) - 1] for position in active)
+            ends = [int(np.searchsorted(run['userId'], lastUser, side='right')) for run in runs]
+
+            block = {name: np.concatenate([run[name][cursor:end] for run, cursor, end in zip(runs, cursors, ends)]) for name in runs[0]}
+            order = np.argsort(block['userId'], kind='stable')
+            users, firsts = np.unique(block['userId'][order], return_index=True)
+
+            users.tofile(outputs['userId'])
+            (firsts + nbRatings).astype('int64').tofile(outputs['userPtr'])
+            for name in ['movieId', 'rating', 'timestamp']:
+                block[name][order].tofile(outputs[name])
+
+            nbRatings += len(order)
+            cursors = ends
+
+        np.array([nbRatings], dtype='int64').tofile(outputs['userPtr'])
+
+    finally:
+        for output in outputs.values():
+            output.close()
+
+    return nbRatings
+
+
+
+""" @RatingsProcessor : Function that process the ratings file """
+# This function read the ratings file and save it as .dat files, the ratings sorted by user.
+#-------
+# ratingsFile : path to the ratings file (string)
+# Log : to display the logs
+# chunkRows : maximum number of ratings sorted in memory at once (integer) (0 : env.SORT_CHUNK_ROWS)
+# tmpDir : directory of the temporary files (string) (empty : env.SORT_TMP_DIR, or the system's one)
+# @return :
+#       - Create a .cache_userId.dat file : the users (sorted, int32)
+#       - Create a .cache_userPtr.dat file : the offset of the first rating of each user (and the total at the end, int64)
+#       - Create .cache_movieId.dat, .cache_rating.dat, .cache_timestamp.dat files : the ratings (int32, float32, int64)
+#       - Create a .cache_info.csv file : the signature of the ratings file, the number of ratings and of skipped lines
+#
+# The ratings of the user u are the rows userPtr[u] to userPtr[u+1] (in the order of the file).
+#-------
+# The memory is bounded (external sort, as LRPredictor.sortingRatingsByUser) : the file is read by chunks, every chunkRows ratings
+# are sorted and written to temporary files, then these runs are merged into the cache files.
+#-------
+def RatingsProcessor(ratingsFile, Log = False, chunkRows = 0, tmpDir = ""):
+
+    if Log:
+        print("--------------------------------")
+        print("Processing Ratings as .dat files")
+        print("--------------------------------")
+
+    start = time.time()
+
+    if chunkRows == 0:
+        chunkRows = env.SORT_CHUNK_ROWS
+
+    if tmpDir == "":
+        tmpDir = env.SORT_TMP_DIR
+
+    prefix = cachePrefix(ratingsFile)
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+
+    counts = {'rownum': 0, 'errornum': 0}
+    spillDir = tempfile.mkdtemp(prefix="ratings_", dir=(tmpDir if tmpDir != "" else None))
+
+    try:
+
+        runs = []
+        chunks = []
+        nbRows = 0
+
+        for chunk in rtools.readCsvArraysChunks(ratingsFile, rtools.RATINGS_COLUMNS, counts, Log):
+
+            chunks.append(chunk)
+            nbRows += len(chunk['userId'])
+
+            if nbRows >= chunkRows:
+                runs.append(spillRun(sortedRun(chunks), spillDir))
+                chunks = []
+                nbRows = 0
+
+        # The last run stays in memory
+        if nbRows != 0 or len(runs) == 0:
+            runs.append(sortedRun(chunks))
+
+        nbRatings = mergeRuns(runs, prefix, max(1, chunkRows // len(runs)))
+
+        del runs
+
+    finally:
+        shutil.rmtree(spillDir, ignore_errors=True)
+
+    # Written at the end : a cache without it is not complete
+    with open(prefix + "info.csv", "w") as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(sourceSignature(ratingsFile))
+        writer.writerow([str(nbRatings), str(counts['errornum'])])
+
+    end = time.time()
+    if Log:
+        print( "RatingsProcessor() execution time : " + str(end - start))
+
+if env.TESTMODE:
+    # Three runs (the user 1 is in the first and the last one), merged by blocks of one rating
+    testDir = tempfile.mkdtemp()
+    testRuns = [sortedRun([{'userId': np.array(users), 'movieId': np.array(movies), 'rating': np.ones(len(users)), 'timestamp': np.zeros(len(users))}])
+                for users, movies in [([2, 1], [10, 11]), ([3, 2], [12, 13]), ([1], [14])]]
+    assert mergeRuns(testRuns, os.path.join(testDir, "test_"), 1) == 5
+    assert np.fromfile(os.path.join(testDir, "test_userId.dat"), dtype='int32').tolist() == [1, 2, 3]
+    assert np.fromfile(os.path.join(testDir, "test_userPtr.dat"), dtype='int64').tolist() == [0, 2, 4, 5]
+    assert np.fromfile(os.path.join(testDir, "test_movieId.dat"), dtype='int32').tolist() == [11, 14, 10, 13, 12]
+    shutil.rmtree(testDir, ignore_errors=True)
+
+
+
+# @RatingsCacheIsValid : To know if the cache of a ratings file exists and is up to date
+#-------
+# ratingsFile : path to the ratings file (string)
+# @return : True if the cache can be used, False if it should be (re)built (boolean)
+#-------
+def RatingsCacheIsValid(ratingsFile):
+
+    infoFile = cachePrefix(ratingsFile) + "info.csv"
+
+    if not os.path.exists(infoFile):
+        return False
+
+    with open(infoFile, "r") as inputInfo:
+        signature = next(csv.reader(inputInfo), [])
+
+    return signature == sourceSignature(ratingsFile)
+
+
+
+""" RatingsRetriever : Function to get the ratings from the registered files """
+#
+# ratingsFile : path to the ratings file (string)
+# Log : to display the logs
+#------
+# The cache is built (RatingsProcessor) if it doesn't exist, or if the size or the modification time of ratingsFile have changed.
+# @return: a dict of numpy.memmap (read only) with the keys 'userId', 'userPtr', 'movieId', 'rating', 'timestamp' (see RatingsProcessor),
+#          and the number of skipped lines of the ratings file (integer)
+#------
+def RatingsRetriever(ratingsFile, Log = False):
+
+    if not RatingsCacheIsValid(ratingsFile):
+        RatingsProcessor(ratingsFile, Log)
+    elif Log:
+        print("Reading the ratings from the cache of " + ratingsFile)
+
+    prefix = cachePrefix(ratingsFile)
+
+    with open(prefix + "info.csv", "r") as inputInfo:
+        errornum = int(list(csv.reader(inputInfo))[1][1])
+
+    ratings = {}
+
+    for name, dtype in CACHE_COLUMNS:
+
+        if os.path.getsize(prefix + name + ".dat") == 0:
+            ratings[name] = np.zeros(0, dtype=dtype)
+        else:
+            ratings[name] = np.memmap(prefix + name + ".dat", dtype=dtype, mode='r')
+
+    return ratings, errornum
+
+
+
+# @cleaner : Remove the cache files of a ratings file
+#---------
+def cleaner(ratingsFile):
+
+    prefix = cachePrefix(ratingsFile)
+
+    for name in [name for name, dtype in CACHE_COLUMNS] :
+        if os.path.exists(prefix + name + ".dat"):
+            os.remove(prefix + name + ".dat")
+
+    if os.path.exists(prefix + "info.csv"):
+        os.remove(prefix + "info.csv")
+
+    # The directory of the cache, if nothing else is in it
+    if os.path.isdir(os.path.dirname(prefix)) and len(os.listdir(os.path.dirname(prefix))) == 0:
+        os.rmdir(os.path.dirname(prefix))
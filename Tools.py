@@ -4,9 +4,16 @@
 # And other functions ...like to normalize, to compute the cosine distance.
 #
 
+import ast
 import csv
+import functools
+import io
+import os
+import re
+import tempfile
 import numpy as np
-import statistics
+import pandas as pd
+import scipy.sparse as sparse
 import scipy.stats as stats
 from collections import Counter
 from sklearn.metrics.pairwise import cosine_distances
@@ -30,7 +37,11 @@ def free(var):
 # res : is a list, not necessarily empty.
 # @return : res or a new list that will contain the lines of read file. (list)
 #--------
-def readcsv(filename, res = []):
+def readcsv(filename, res = None):
+    
+    if res is None:
+        res = []
+    
     ifile = open(filename, "r", encoding="utf8")
     reader = csv.reader(ifile, delimiter=",")
 
@@ -61,7 +72,47 @@ def readcsv(filename, res = []):
     
     return res
 
-	
+
+
+
+# @readcsvRows : to Read a csv file, row per row (without keeping the file in memory)
+#--------
+# filename : is full path or relative to the current directory (string).
+# log : to display the logs (boolean)
+# @return : generator of the lines of the file (lists of strings)
+#--------
+def readcsvRows(filename, log = True):
+    
+    with open(filename, "r", encoding="utf8") as ifile:
+        
+        rownum = 0
+        
+        for row in csv.reader(ifile, delimiter=","):
+            
+            # To write down the progression
+            if log and rownum % 50000 == 0:
+                print("Reading file "+ filename +" : line count ... "+ str(rownum))
+            
+            yield row
+            
+            rownum += 1
+    
+    if log:
+        print("Finish reading file "+ filename +" : number of lines : "+ str(rownum))
+
+
+
+# The tokens of the metadata fields (Python literal or JSON list of dicts) :
+#   a closing brace, a key (quoted) with its value (quoted, or as None/number until the next separator), or a quoted string alone
+#   (the quoted strings are read as a whole : the commas, colons and braces in the names are not separators)
+JSON_STRING = r"'(?:[^'\\]|\\.)*'" + r'|"(?:[^"\\]|\\.)*"'
+JSON_TOKENS = re.compile(
+    r"(\})"
+    r"|(" + JSON_STRING + r")\s*:\s*(" + JSON_STRING + r"|[^,{}\[\]]*)"
+    r"|(?:" + JSON_STRING + r")"
+)
+
+
 
 # @getElemFromJson : To get value from JsonValue in the Movie metadate file 
 # while remembering new values in a lookUpList
@@ -83,6 +134,86 @@ def readcsv(filename, res = []):
 #--------
 def getElemFromJson(json, idLabel, nameLabel, lookUpList, intVal):
     
+    # The same fields come back often (genres, languages, collections) : parsed once
+    res, lookUpItems = parseJsonField(json, idLabel, nameLabel, intVal)
+    
+    # updating the LookUpList
+    lookUpList.update(lookUpItems)
+    
+    return list(res)
+
+# @parseJsonField : To parse a field for getElemFromJson, in one pass on the tokens of the text (with a cache of the last fields)
+#--------
+# json, idLabel, nameLabel, intVal : as in getElemFromJson
+# @return : the values corresponding to idLabel (tuple), the updates of the LookUpList in order (tuple of (key, value))
+#--------
+@functools.lru_cache(maxsize = 65536)
+def parseJsonField(json, idLabel, nameLabel, intVal):
+    
+    res = []
+    lookUpItems = []
+    
+    # The keys as they are written in the text
+    idKeys = ("'" + idLabel + "'", '"' + idLabel + '"')
+    nameKeys = ("'" + nameLabel + "'", '"' + nameLabel + '"')
+    
+    # Default values (as for the text after the last dict)
+    id_ = 0 if intVal else ""
+    name = ""
+    
+    # One pass on the tokens : a closing brace, or a key with its value
+    for brace, key, value in JSON_TOKENS.findall(json):
+        
+        if brace:
+            # End of a dict
+            lookUpItems.append((id_, name))
+            
+            id_ = 0 if intVal else ""
+            name = ""
+            
+        # If it is the key we search
+        elif key in idKeys:
+            
+            if (intVal):
+                # if it is an integer value
+                id_ = int(unquoteJsonValue(value))
+            else:
+                id_ = unquoteJsonValue(value)
+                
+            res.append(id_)
+            
+        # If it is the name of value we search
+        elif key in nameKeys:
+            name = unquoteJsonValue(value)
+    
+    # After the last dict (as with a split on "}")
+    lookUpItems.append((id_, name))
+        
+    return tuple(res), tuple(lookUpItems)
+
+# @unquoteJsonValue : To get the text of a token of getElemFromJson
+#--------
+# token : a quoted string (with ' or ") or a bare value (string)
+# @return : the string without the quotes and the escapes (string)
+#--------
+def unquoteJsonValue(token):
+    
+    token = token.strip()
+    
+    if len(token) < 2 or token[0] not in "'\"" or token[-1] != token[0]:
+        return token
+    
+    if '\\' in token:
+        return ast.literal_eval(token)
+    
+    return token[1:-1]
+
+
+
+# @getElemFromJsonSplit : The previous version of getElemFromJson (with split and replace), as reference for the tests
+#--------
+def getElemFromJsonSplit(json, idLabel, nameLabel, lookUpList, intVal):
+    
     res = []
     
     # First Split to separate differents values in case it is a list
@@ -132,6 +263,59 @@ if env.TESTMODE:
     assert [35, 10751] == getElemFromJson("[{'id': 35, 'name': 'Comedy'}, {'id':10751, 'name':'Family'}]", 'id', 'name', lookUp, True)
     assert lookUp[35] == 'Comedy'
     assert lookUp[10751] == 'Family'
+    # Same results as the split version on simple fields (with the 0 and "" keys in the LookUpList)
+    for testJson, testId, testName, testInt in [
+            ["[{'id': 35, 'name': 'Comedy'}, {'id':10751, 'name':'Family'}]", 'id', 'name', True],
+            ["{'id': 10194, 'name': 'Toy Story Collection', 'poster_path': None, 'backdrop_path': '/9FBw.jpg'}", 'id', 'name', True],
+            ["[{'iso_639_1': 'en', 'name': 'English'}, {'iso_639_1': '', 'name': ''}]", 'iso_639_1', 'name', False],
+            ["[]", 'id', 'name', True], ["", 'iso_639_1', 'name', False]]:
+        testLookUp, testLookUpSplit = {}, {}
+        assert getElemFromJson(testJson, testId, testName, testLookUp, testInt) == getElemFromJsonSplit(testJson, testId, testName, testLookUpSplit, testInt)
+        assert testLookUp == testLookUpSplit
+    # The commas, colons and quotes in the names
+    lookUp = {}
+    assert [119, 8] == getElemFromJson("[{'id': 119, 'name': \"Ocean's Collection, Vol: 1\"}, {'id': 8, 'name': 'A \\'b\\' {c}'}]", 'id', 'name', lookUp, True)
+    assert lookUp == {119: "Ocean's Collection, Vol: 1", 8: "A 'b' {c}", 0: ""}
+
+
+
+# @getInstance : To get the values of the selected parameters from a line of movies_metadata.csv
+# while remembering new values in lookUp list for 'collection', 'genres', 'languages'
+#--------
+# inst: a line of movies_metadata.csv (list of 24 strings)
+# collectionLookUp, genresLookUp, languagesLookUp: as in getData (dict)
+# @return : dict with the keys of instances in getData and the values of this movie (dict)
+#--------
+def getInstance(inst, collectionLookUp, genresLookUp, languagesLookUp):
+    
+    return {
+        # adult
+        'adult': 0 if  inst[0] == 'False' else 1,
+        
+        # collection : get the list of collection's id
+        'collection': getElemFromJson(inst[1], "id", "name", collectionLookUp, True),
+        
+        # genres : get the list of genres' is
+        'genres': getElemFromJson(inst[3], "id", "name", genresLookUp, True),
+        
+        # movie_id
+        'movie_id': inst[5],
+        
+        # popularity
+        'popularity': float(inst[10]),
+        
+        # release_date : only the year
+        'release_date': 0.0 if inst[14] == "" else float(inst[14].split("-")[0]),
+        
+        # runtime
+        'runtime': 0.0 if inst[16] == "" else float(inst[16]),
+        
+        # languages : original_languages + sopken_languages : distinct list
+        'languages': list(set([inst[7]] + getElemFromJson(inst[17], "iso_639_1", "name", languagesLookUp, False))),
+        
+        # revenue
+        'vote_average': float(inst[22])
+    }
 
 
 
@@ -139,50 +323,91 @@ if env.TESTMODE:
 # while remembering new values in lookUp list for 'collection', 'genres', 'languages'
 #--------
 # listinput: list of lists that will contain in order the data from movies_metadata.csv (list)
+#            or any iterable of rows (as from readcsvRows)
 # instances: dict that have the following keys 'adult', 'collection', 'genres', 'movie_id',
 #           'popularity', 'release_date', 'runtime', 'languages', 'vote_average' (fields that are being used for the analysis) (dict)
 # collectionLookUp: dict that will contained the association key/value for every collection in the data (dict)
 # genresLookUp: dict that will contained the association key/value for every genre in the data (dict)
 # languagesLookUp: dict that will contained the association key/value for every language in the data (dict)
-# @return : the input values instances, collectionLookUp, genresLookUp, languagesLookUp will be updated (void)
+# dedupPolicy: what to do with a movie_id already read (string) (empty : env.MMDT_DEDUP_POLICY)
+#              "FIRST" : the first line is kept, the next ones are skipped
+#              "LAST" : the values of the last line are kept (at the place of the first line)
+#              "MERGE" : the lists ('collection', 'genres', 'languages') are merged,
+#                        the other values are the ones of the first line (but the missing 'release_date' and 'runtime')
+# @return : the number of duplicated lines (integer) (-1 : dedupPolicy not right), the input values instances, collectionLookUp, genresLookUp, languagesLookUp will be updated
 #--------
-def getData(listinput, instances, collectionLookUp, genresLookUp, languagesLookUp):
+def getData(listinput, instances, collectionLookUp, genresLookUp, languagesLookUp, dedupPolicy = ""):
 
-    # range from 1 to skip the header
-    for i in range(1, len(listinput)-1):
-        inst = listinput[i]
+    if dedupPolicy == "":
+        dedupPolicy = env.MMDT_DEDUP_POLICY
+    
+    if dedupPolicy not in ["FIRST", "LAST", "MERGE"]:
+        print("dedupPolicy not right")
+        return -1
+    
+    # The position of each movie_id in instances : to include only one per id
+    seen = {movie_id: pos for pos, movie_id in enumerate(instances['movie_id'])}
+    nbDuplicates = 0
+    
+    # As a list from readcsv, or a generator of rows from readcsvRows
+    rows = iter(listinput)
+    
+    # to skip the header
+    next(rows, None)
+    
+    # The last line is not read (as with range(1, len(listinput)-1)) : a line is used once the next one has been read
+    nextInst = next(rows, None)
+    
+    for following in rows:
+        
+        inst, nextInst = nextInst, following
         
         if len(inst) != 24: # If there is a skipped field in the data
             continue
         
-        if inst[5] not in instances['movie_id']: # To include only one per id
-
-            # adult
-            instances['adult'].append(0 if  inst[0] == 'False' else 1)
-        
-            # collection : get the list of collection's id
-            instances['collection'].append(getElemFromJson(inst[1], "id", "name", collectionLookUp, True)) 
-        
-            # genres : get the list of genres' is
-            instances['genres'].append(getElemFromJson(inst[3], "id", "name", genresLookUp, True))      
-        
-            # movie_id
-            instances['movie_id'].append(inst[5])
-                
-            # popularity
-            instances['popularity'].append(float(inst[10]))
+        if inst[5] not in seen:
+            
+            seen[inst[5]] = len(instances['movie_id'])
+            
+            for key, value in getInstance(inst, collectionLookUp, genresLookUp, languagesLookUp).items():
+                instances[key].append(value)
+            
+            continue
         
-            # release_date : only the year
-            instances['release_date'].append(0.0 if inst[14] == "" else float(inst[14].split("-")[0]))
+        # A duplicated movie_id
+        nbDuplicates += 1
         
-            # runtime
-            instances['runtime'].append(0.0 if inst[16] == "" else float(inst[16]))
+        if dedupPolicy == "FIRST":
+            continue
         
-            # languages : original_languages + sopken_languages : distinct list
-            instances['languages'].append(list(set([inst[7]] + getElemFromJson(inst[17], "iso_639_1", "name", languagesLookUp, False)))) 
+        pos = seen[inst[5]]
+        newInst = getInstance(inst, collectionLookUp, genresLookUp, languagesLookUp)
         
-            # revenue        
-            instances['vote_average'].append(float(inst[22]))
+        for key, value in newInst.items():
+            
+            if dedupPolicy == "LAST":
+                instances[key][pos] = value
+                
+            elif key in ['collection', 'genres', 'languages']:
+                instances[key][pos] = instances[key][pos] + [x for x in value if x not in instances[key][pos]]
+                
+            elif key in ['release_date', 'runtime'] and instances[key][pos] == 0.0:
+                instances[key][pos] = value
+    
+    return nbDuplicates
+
+if env.TESTMODE:
+    testRow = ['False', '', '', "[{'id': 35, 'name': 'Comedy'}]", '', '12', '', 'en', '', '', '1.5', '', '', '', '1999-01-01', '', '', '[]', '', '', '', '', '6.5', '']
+    testDup = list(testRow)
+    testDup[3], testDup[14], testDup[22] = "[{'id': 18, 'name': 'Drama'}]", '2001-05-01', '7.5'
+    testOther = list(testRow)
+    testOther[5] = '13'
+    for testPolicy, testGenres, testYear in [["FIRST", [35], 1999.0], ["LAST", [18], 2001.0], ["MERGE", [35, 18], 1999.0]]:
+        testInstances = {key: [] for key in ['adult', 'collection', 'genres', 'movie_id', 'popularity', 'release_date', 'runtime', 'languages', 'vote_average']}
+        # The header, the movie 12 twice, the movie 13, and the last line that is not read
+        assert getData([[], testRow, testDup, testOther, testRow], testInstances, {}, {}, {}, testPolicy) == 1
+        assert testInstances['movie_id'] == ['12', '13']
+        assert testInstances['genres'][0] == testGenres and testInstances['release_date'][0] == testYear
 
 
 
@@ -205,150 +430,117 @@ def verifyNbInstancesAlign(instances):
 
 # @removingInsecureValues : to remove values that are too big ( > percentileMax) or too small ( < percentileMin) and replace them with the mean
 #--------
-# vector: list of real values (list)
+# vector: real values (list or numpy.array)
 # percentileMax: percentile that will upper bound the values (int)
 # percentileMin: percentile that will lower bound the values (int)
 # name: Name of the field corresponding to the values (string)
 # log: to print log (boolean)
-# @return : the new list with values with the boundaries (list)
+# @return : the new vector with values with the boundaries (numpy.array of floats)
 #--------
 # COMMENT : the mean should be calculated within the boundaries
 #--------
 def removingInsecureValues(vector, percentileMax = 90, percentileMin = 0, name = "", log = False):
 
+    vector = np.asarray(vector, dtype='float64')
+    
     mean = np.mean(vector)
     maxVariance = stats.scoreatpercentile(vector, percentileMax) # Upper bound
     minVariance = stats.scoreatpercentile(vector, percentileMin) # Lower bound
     
-    newVector = []
-
-    # To indicate the changes that have been done
-    nbChanges = []
-
-    for x in vector:
-
-        if (x > maxVariance or x < minVariance):
-            # Out of bounds, replace with the mean
-            newVector.append(mean)
-            nbChanges.append(x)
-
-        else : 
-            newVector.append(x)
+    # Out of bounds : masked, then replaced with the mean
+    kept = np.ma.masked_outside(vector, minVariance, maxVariance)
+    newVector = kept.filled(mean)
     
     if log:
+        # To indicate the changes that have been done
+        nbChanges = vector[np.ma.getmaskarray(kept)]
+        
         print("--------------------------------- " + str(name))
         print("removingInsecureValues : ")
         print("The mean is " + str(mean))
-        print("The variance is " + str(statistics.stdev(vector) * statistics.stdev(vector))) # there must be a function for it
+        print("The variance is " + str(np.var(vector, ddof=1)))
         print("For percentileMin = " + str(percentileMin) + ", the value is " + str(minVariance))
         print("For percentileMax = " + str(percentileMax) + ", the value is " + str(maxVariance))
         print("The number of changes in the vector is " + str(len(nbChanges)))
-        print(nbChanges)
+        print(nbChanges.tolist())
         print("")
     
     return newVector
 
 if env.TESTMODE:
-    assert removingInsecureValues([1,40,42,45,43,41,53,35,43,44,50,100],95,5) == [44.75, 40, 42, 45, 43, 41, 53, 35, 43, 44, 50, 44.75]
+    assert removingInsecureValues([1,40,42,45,43,41,53,35,43,44,50,100],95,5).tolist() == [44.75, 40, 42, 45, 43, 41, 53, 35, 43, 44, 50, 44.75]
 
 
 
 # @removingNullValues : to replace null values (= 0) with the mean
 #--------
-# vector: list of real values (list)
+# vector: real values (list or numpy.array)
 # intValue: if vector is of Integer values rather that Floats (boolean)
 # name: Name of the field corresponding to the values (string)
 # log: to print log (boolean)
-# @return : the new list with no more null values (list)
+# @return : the new vector with no more null values (numpy.array)
 #--------
 # COMMENT : the mean should be calculated after the remmoval of null values
 #--------
 def removingNullValues(vector, intValue=True, name = "", log = False):
 
+    vector = np.asarray(vector)
+    
     mean = np.mean(vector)
 
     # if it is a vector of int, cast the mean to int
     if intValue:
         mean = int(mean)
-        
-    newVector = []
-
-    # to indicate the number of changes
-    nbChanges = 0
-
-    for x in vector:
-
-        if x == 0:
-            # Null value, replace it with the mean
-            newVector.append(mean)
-            nbChanges += 1
-
-        else : 
-            newVector.append(x)
+    
+    # Null values : masked, then replaced with the mean
+    kept = np.ma.masked_equal(vector, 0)
+    newVector = kept.filled(mean)
     
     if log:
         print("--------------------------------- " + str(name))
         print("removingNullValues : Mean")       
         print("The mean is " + str(mean))
-        print("The number of changes in the vector is " + str(nbChanges))
+        print("The number of changes in the vector is " + str(np.ma.count_masked(kept)))
         print("")
     
     return newVector
 
 if env.TESTMODE:
-    assert removingNullValues([0,40,42,45,43,41,53,35,43,44,50,0],True) == [36, 40, 42, 45, 43, 41, 53, 35, 43, 44, 50, 36]
+    assert removingNullValues([0,40,42,45,43,41,53,35,43,44,50,0],True).tolist() == [36, 40, 42, 45, 43, 41, 53, 35, 43, 44, 50, 36]
 
 
 
 # @categorizeVectContinuousVar : to make categorical features out of continuous features
 #--------
-# vector: values of the continuous feature (list of numbers)
+# vector: values of the continuous feature (list or numpy.array of numbers)
 # categories: list of the inner boundaries that will characterize each new categorie (list of numbers)
 # name: Name of the field corresponding to the values (string)
 # log: to print log (boolean)
-# @return : the new list with categorical values. The categories are represented with [feature vectors]. (list of list of binary numbers)
+# @return : the new matrix with categorical values. The categories are represented with [feature vectors]. (numpy.array of binary numbers, one row per value)
 #--------
 # For further understanding, see example below.
 #--------
 def categorizeVectContinuousVar(vector, categories, name = '', log = False):
     
-    wholeNewVector = []
+    vector = np.asarray(vector, dtype='float64')
+    categories = np.asarray(categories, dtype='float64')
     
-    # to indicate the number of items per categories
-    countingFreq = np.zeros(len(categories)+1)
+    # An item belongs to only one category : the first inner bound greater than the value
+    # Last Category : greater than the last inner bound
+    below = vector[:, None] < categories[None, :]
+    indexes = np.where(below.any(axis=1), below.argmax(axis=1), len(categories))
     
-    for elem in vector:
-        
-        # A [feature vector] for each item
-        newVector = []
-        
-        # An item belongs to only one category
-        foundCat = False
-        
-        # Loop over the bounds
-        for cat in categories:
-            
-            if elem < cat and not foundCat:
-                
-                # If within the bound and have not been already marked
-                newVector.append(1)
-                foundCat = True     
-                
-            else: 
-                newVector.append(0)
-                
-        # Last Category : greater than the last inner bound
-        newVector.append(0 if foundCat else 1)
-        
-        # Add each vector of binary numbers gives us the number of items per category.
-        countingFreq = np.add(countingFreq, newVector)
-        wholeNewVector.append(newVector)
+    wholeNewVector = np.zeros((len(vector), len(categories)+1), dtype='int8')
+    wholeNewVector[np.arange(len(vector)), indexes] = 1
     
     if log:
+        # to indicate the number of items per categories
+        countingFreq = np.bincount(indexes, minlength=len(categories)+1)
+        
         print("--------------------------------- " + str(name))
         print("categorizeVectContinuousVar : Vectorizing")       
         print("The categories inner borders are :")
-        print(categories)
+        print(categories.tolist())
         print("The countingFreq is :")
         print(countingFreq)
         print("The sum of countingFreq is :" + str(sum(countingFreq)))
@@ -359,7 +551,25 @@ def categorizeVectContinuousVar(vector, categories, name = '', log = False):
 if env.TESTMODE:
     # The inner bound is 2. There is then two categories : <2 and >=2. 
     # the value 3 is in the second category, so its [feature vector] is [0, 1]
-    assert categorizeVectContinuousVar([1,2,3], [2]) == [[1, 0], [0, 1], [0, 1]]
+    assert categorizeVectContinuousVar([1,2,3], [2]).tolist() == [[1, 0], [0, 1], [0, 1]]
+
+
+
+# @categoryIndexes : to get the category of each value of a continuous feature (as categorizeVectContinuousVar, without the feature vectors)
+#--------
+# vector: values of the continuous feature (list of numbers)
+# categories: list of the inner boundaries, increasing (list of numbers)
+# @return : numpy.array of the index of the category of each value (the position of the 1 in its [feature vector])
+#--------
+def categoryIndexes(vector, categories):
+    
+    # The first inner bound greater than the value (the last category if there is none)
+    return np.searchsorted(np.asarray(categories, dtype='float64'), np.asarray(vector, dtype='float64'), side='right')
+
+if env.TESTMODE:
+    # As categorizeVectContinuousVar([1,2,3], [2]) == [[1, 0], [0, 1], [0, 1]]
+    assert categoryIndexes([1,2,3], [2]).tolist() == [0, 1, 1]
+    assert categoryIndexes([0.5,2,3,7,2.5], [1,2,2,5]).tolist() == [row.index(1) for row in categorizeVectContinuousVar([0.5,2,3,7,2.5], [1,2,2,5]).tolist()]
 
 
 
@@ -455,40 +665,29 @@ if env.TESTMODE:
 # categories: list of the categories (list of integers)
 # name: Name of the field corresponding to the values (string)
 # log: to print log (boolean)
-# @return : the new list with categorical values. The categories are represented with [feature vectors]. (list of list of binary numbers)
+# @return : the new matrix with categorical values. The categories are represented with [feature vectors]. (numpy.array of binary numbers, one row per item)
 #--------
 # For further understanding, see example below.
 #--------
 def categorizeVectVar(vector, categories, name = '', log = False):
     
-    wholeNewVector = []
+    # The vocabulary : the column of each category
+    columnOf = {cat: pos for pos, cat in enumerate(categories)}
     
-    # to indicate the number of items per categories
-    countingFreq = np.zeros(len(categories)+1)
+    # All the (item, column) of the known categories of the items
+    rows = [row for row, elem in enumerate(vector) for cat in elem if cat in columnOf]
+    columns = [columnOf[cat] for elem in vector for cat in elem if cat in columnOf]
     
-    for elem in vector:
-        
-        # A [feature vector] for each item
-        newVector = []
-        
-        # Loop over each categories
-        for cat in categories:
-            
-            if cat in elem :
-                # the element contains that category cat
-                newVector.append(1)                
-            
-            else: 
-                newVector.append(0)
-                
-        # Last Category : Unknown, when the element contained no categories listed in the input variable
-        newVector.append(0 if 1 in newVector else 1)
-        
-        # To add each vector of binary numbers gives us the number of items per category.
-        countingFreq = np.add(countingFreq, newVector)
-        wholeNewVector.append(newVector)
+    wholeNewVector = np.zeros((len(vector), len(categories)+1), dtype='int8')
+    wholeNewVector[rows, columns] = 1
+    
+    # Last Category : Unknown, when the element contained no categories listed in the input variable
+    wholeNewVector[:, -1] = ~wholeNewVector[:, :-1].any(axis=1)
     
     if log:
+        # to indicate the number of items per categories
+        countingFreq = wholeNewVector.sum(axis=0)
+        
         print("--------------------------------- " + str(name))
         print("categorizeVectContinuousVar : Vectorizing")       
         print("The categories are :")
@@ -502,7 +701,7 @@ def categorizeVectVar(vector, categories, name = '', log = False):
 
 if env.TESTMODE:
     # Each item is now a [feature vector], and the categories are [1, 3, Unknown]
-    assert categorizeVectVar([[1],[2],[3],[4,3],[5,1],[]], [1, 3]) == [[1, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 0], [1, 0, 0], [0, 0, 1]]
+    assert categorizeVectVar([[1],[2],[3],[4,3],[5,1],[]], [1, 3]).tolist() == [[1, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 0], [1, 0, 0], [0, 0, 1]]
 
 
 # @formingColumnsDF : To make the header of columns according to categories in features
@@ -608,24 +807,41 @@ if env.TESTMODE:
 
 # @normalize : To normalize a Numpy.Array by rows
 #--------
-# df_ : a Numpy.Array
-# @return: a numpy.array normalized
+# df_ : a Numpy.Array (or a numpy.memmap, or a scipy.sparse matrix)
+# inPlace : to write the result in df_ (a numpy.array of floats, or a numpy.memmap opened in r+ or w+) (boolean)
+# out : a numpy.array (or a numpy.memmap) of the shape of df_ in which the result is written (None : a new numpy.array)
+# blockRows : number of rows normalized at once, to bound the memory used with a memmap (0 : env.NORMALIZE_BLOCK_ROWS)
+# @return: a numpy.array normalized, of the same type as df_ (float64 for integers).
+#          The rows that are only 0 stay 0.
 #--------
-def normalize(df_):
+def normalize(df_, inPlace = False, out = None, blockRows = 0):
     
-    # Empty numpy array
-    res = np.zeros(df_.shape)
+    if sparse.issparse(df_):
+        return normalizeSparse(df_)
     
-    # To loop over the rows
-    for i in range(df_.shape[0]):
+    if blockRows == 0:
+        blockRows = env.NORMALIZE_BLOCK_ROWS
+    
+    dtype = df_.dtype if np.issubdtype(df_.dtype, np.floating) else np.dtype('float64')
+    
+    if inPlace:
+        res = df_
+    elif out is not None:
+        res = out
+    else:
+        res = np.empty(df_.shape, dtype=dtype)
+    
+    for first in range(0, df_.shape[0], blockRows):
         
-        # Each row
-        row = np.array(df_[i,:])
+        block = np.asarray(df_[first:first + blockRows], dtype=dtype)
         
-        # Norm is Sum( Sqrt( x * x ) )
-        norm_ = np.sqrt((row.dot(row)).sum())
-                    
-        res[i,:] =  df_[i,:] / norm_
+        # Norm is Sqrt( Sum( x * x ) ), for every row of the block
+        norms = np.sqrt(np.einsum('ij,ij->i', block, block))
+        
+        # The rows of 0 are divided by 1
+        norms[norms == 0] = 1
+        
+        res[first:first + blockRows] = block / norms[:, np.newaxis]
             
     return res
 
@@ -634,6 +850,54 @@ if env.TESTMODE:
     normdf = normalize(mydf)
     assert round(normdf[0,0] * 100) == round(0.4472136 * 100)
     assert round(normdf[0,1] * 100) == round(0.89442719 * 100)
+    # The type is kept, the rows of 0 stay 0, by blocks or in place
+    mydf = np.array([[1,2],[0,0],[3,4]], dtype='float32')
+    normdf = normalize(mydf, blockRows = 2)
+    assert normdf.dtype == np.float32 and normdf[1].tolist() == [0, 0]
+    assert np.allclose(normdf[2], [0.6, 0.8])
+    assert normalize(mydf, inPlace = True) is mydf and np.array_equal(mydf, normdf)
+
+
+
+# @normalizeSparse : To normalize a scipy.sparse matrix by rows (as normalize, only on the values that are not 0)
+#--------
+# df_ : a scipy.sparse matrix
+# @return: a scipy.sparse.csr_matrix normalized, of the same type as df_ (float64 for integers)
+#--------
+def normalizeSparse(df_):
+    
+    res = sparse.csr_matrix(df_, copy=True)
+    
+    dtype = res.dtype if np.issubdtype(res.dtype, np.floating) else np.dtype('float64')
+    
+    # The row of each value
+    rows = np.repeat(np.arange(res.shape[0]), np.diff(res.indptr))
+    
+    # Norm is Sqrt( Sum( x * x ) ), in the type of the values as for a numpy.array
+    norms = np.sqrt(np.bincount(rows, weights=res.data.astype('float64') ** 2, minlength=res.shape[0])).astype(dtype)
+    
+    return sparse.csr_matrix(((res.data / norms[rows]).astype(dtype), res.indices, res.indptr), shape=res.shape)
+
+if env.TESTMODE:
+    # The same values as with a numpy.array
+    assert np.array_equal(normalize(sparse.csr_matrix(np.array([[1,2],[3,4],[0,5]], dtype='float32'))).toarray(), normalize(np.array([[1,2],[3,4],[0,5]], dtype='float32')))
+    assert np.array_equal(normalize(sparse.csr_matrix(np.array([[1,2],[0,0],[0,5]]))).toarray(), normalize(np.array([[1,2],[0,0],[0,5]])))
+
+
+
+# @rowsAsArray : To get some rows of a matrix as a numpy.array (from a numpy.array, a numpy.memmap or a scipy.sparse matrix)
+#--------
+# matrix : the matrix (numpy.array or scipy.sparse matrix)
+# rows : the row numbers (list or numpy.array of integers)
+# dtype : type of the result (string)
+# @return: a numpy.array (Num_Rows x Num_Columns)
+#--------
+def rowsAsArray(matrix, rows, dtype = 'float64'):
+    
+    if sparse.issparse(matrix):
+        return matrix[rows].toarray().astype(dtype, copy=False)
+    
+    return np.asarray(matrix[rows], dtype=dtype)
     
     
     
@@ -655,119 +919,297 @@ if env.TESTMODE:
 
 
 
-# @readCsvEvaluationData : To read the evaluation_ratings.csv and get the data
+# @cosineDistanceBlock : To compute the cosine distances between the rows of two normalized Numpy.Arrays (a tile of the distance matrix)
 #--------
-# evalFile: path to the evaluation_ratings.csv file (string)
-# log: to diplay the logs (boolean)
-# @return : a Dict that have for key the user_id (int) and for value the list of movie_id (list of strings).
-#           (movie_id that should be rated for this user.)
+# x : a numpy.array (Num_Rows_x x Num_Parameters), the rows normalized (see normalize)
+# y : a numpy.array (Num_Rows_y x Num_Parameters), the rows normalized
+# @return: a numpy.array (Num_Rows_x x Num_Rows_y) of the cosine distances, in the type of x and y
+#          (1 with a row of 0, where scipy.spatial.distance.cosine gives nan)
 #--------
-def readCsvEvaluationData(evalFile, log = False):
-    
-    evalutionByUser = {}
+def cosineDistanceBlock(x, y):
     
-    ifile = open(evalFile, "r", encoding="utf8")
-    reader = csv.reader(open(evalFile, "r", encoding="utf8"), delimiter=",")
+    # For normalized rows, the cosine distance is 1 - x.y, bounded to [0, 2] as in cosine_distances
+    return np.clip(1 - x.dot(y.T), 0, 2)
+
+if env.TESTMODE:
+    mydf = normalize(np.array([[1,2],[3,4],[0,1]]))
+    assert np.allclose(cosineDistanceBlock(mydf, mydf[1:]), cosineDistance(mydf)[:, 1:])
+
+
+
+
+# The columns (name, dtype) of the ratings file and of the evaluation file for readCsvArrays
+RATINGS_COLUMNS = [('userId', 'int32'), ('movieId', 'int32'), ('rating', 'float32'), ('timestamp', 'int64')]
+EVALUATION_COLUMNS = [('userId', 'int32'), ('movieId', 'int32')]
+
+
+
+# @readCsvArraysChunks : To read columns of a csv file by chunks, as typed numpy.arrays
+#--------
+# filename : path to the csv file (string)
+# columns : list of (name, dtype) of the columns to read (example RATINGS_COLUMNS).
+#           The columns are found by their name in the header (quotes and spaces are ignored).
+#           Without header, the columns are the first ones of the file, in the same order.
+# counts : dict with the keys 'rownum' and 'errornum' that will be updated (dict)
+#          'errornum' is the number of lines that didn't give a valid row (missing, additional or non numeric fields, empty lines)
+# log : to display the logs (boolean)
+# chunkBytes : size of the chunks read at once (integer) (0 : env.READ_CHUNK_BYTES)
+# @return : generator of dicts name -> numpy.array (one dict per chunk, only the valid rows)
+#--------
+def readCsvArraysChunks(filename, columns, counts, log = False, chunkBytes = 0):
     
-    rownum = 0
-    errornum = 0
+    if chunkBytes == 0:
+        chunkBytes = env.READ_CHUNK_BYTES
     
-    for row in reader:
+    with open(filename, "rb") as ifile:
         
-        try:
-                        
-            if len(row) < 2:
-                errornum += 1
-                continue
+        # The position of the columns in the header
+        header = [name.strip().strip('"').strip() for name in next(csv.reader([ifile.readline().decode("utf8")]), [])]
+        
+        if all(name in header for name, dtype in columns):
+            positions = [header.index(name) for name, dtype in columns]
+        else:
+            # No header : the columns are the first ones, in the order of columns, and the first line is data
+            positions = list(range(len(columns)))
+            header = header + [""] * (len(columns) - len(header))
+            ifile.seek(0)
+        
+        rest = b""
+        
+        while True:
+            
+            data = ifile.read(chunkBytes)
+            
+            if data:
+                
+                # The chunk ends with the last complete line
+                block = rest + data
+                end = block.rfind(b"\n") + 1
+                block, rest = block[:end], block[end:]
+                
+                if not block:
+                    continue
+                
+            else:
+                
+                # The last line of the file (without end of line)
+                block, rest = rest, b""
+                
+                if not block:
+                    break
             
-            # to skip the Header
-            if row[0] == 'userId':
-                continue
+            nbLines = block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
             
+            # The lines with more fields than the header are skipped, the missing fields are NaN.
+            # An empty first line (removed after) gives the number of fields to the parser.
+            emptyLine = b"," * (len(header) - 1) + b"\n"
+            readArgs = {'header': None, 'names': list(range(len(header))), 'index_col': False, 'on_bad_lines': 'skip', 'encoding': "utf8"}
             
-            if rownum % 500000 == 0 and log:
-                print("Reading file "+ evalFile +" : line count ... "+ str(rownum))
-        
-            # user_id 
-            user_id = (int(row[0]))
+            try:
+                # Faster when all the fields are numbers
+                chunk = pd.read_csv(io.BytesIO(emptyLine + block), dtype='float64', **readArgs).iloc[1:]
+            except ValueError:
+                chunk = pd.read_csv(io.BytesIO(emptyLine + block), **readArgs).iloc[1:]
             
-            # movie_id
-            movie_id = (row[1])        
+            valid = np.ones(len(chunk), dtype=bool)
+            values = {}
             
-            # Adding the new value to the output dict
-            if user_id in evalutionByUser:
-                evalutionByUser[user_id].append(movie_id)
-            else:
-                evalutionByUser[user_id] = [movie_id]
+            for (name, dtype), position in zip(columns, positions):
+                
+                col = chunk[position]
+                
+                if not pd.api.types.is_numeric_dtype(col.dtype):
+                    # There is something else than numbers : those rows are not valid
+                    col = pd.to_numeric(col, errors='coerce')
+                
+                col = col.to_numpy()
+                
+                if col.dtype.kind == 'f':
+                    valid &= np.isfinite(col)
+                    if np.dtype(dtype).kind == 'i':
+                        valid &= (col == np.floor(col))
+                
+                values[name] = col
             
-            rownum += 1
+            nbValid = int(valid.sum())
             
-        except:
+            counts['rownum'] += nbValid
+            counts['errornum'] += nbLines - nbValid
             
-            # Skipped Rows
-            errornum += 1
-            pass
+            if log:
+                print("Reading file "+ filename +" : line count ... "+ str(counts['rownum']))
+            
+            yield {name: (values[name][valid] if nbValid != len(valid) else values[name]).astype(dtype) for name, dtype in columns}
+
+
+
+# @readCsvArrays : To read columns of a csv file as typed numpy.arrays (see readCsvArraysChunks)
+#--------
+# filename : path to the csv file (string)
+# columns : list of (name, dtype) of the columns to read (example RATINGS_COLUMNS)
+# log : to display the logs (boolean)
+# chunkBytes : size of the chunks read at once (integer) (0 : env.READ_CHUNK_BYTES)
+# @return : a dict name -> numpy.array, and the number of skipped lines (integer)
+#--------
+def readCsvArrays(filename, columns, log = False, chunkBytes = 0):
     
-    ifile.close()
+    counts = {'rownum': 0, 'errornum': 0}
+    
+    chunks = list(readCsvArraysChunks(filename, columns, counts, log, chunkBytes))
+    
+    arrays = {name: np.concatenate([chunk[name] for chunk in chunks] + [np.zeros(0, dtype=dtype)]) for name, dtype in columns}
     
     if log:
-        print("Finish reading file "+ evalFile +" : number of lines : "+ str(rownum))
-        print('Number of skipped lines : ' + str(errornum))
+        print("Finish reading file "+ filename +" : number of lines : "+ str(counts['rownum']))
+        print('Number of skipped lines : ' + str(counts['errornum']))
     
-    return evalutionByUser
+    return arrays, counts['errornum']
 
+if env.TESTMODE:
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as testFile:
+        testFile.write('"userId","movieId","rating","timestamp"\n1,10,3.5,100 \n\n1,x,3,4\n2,20,4\n2,2.5,1,4\n3,30,1,2,9\n3,31,0.5,7')
+    testArrays, testErrors = readCsvArrays(testFile.name, RATINGS_COLUMNS, chunkBytes = 10)
+    os.remove(testFile.name)
+    assert testArrays['userId'].tolist() == [1, 3] and testArrays['userId'].dtype == np.int32
+    assert testArrays['movieId'].tolist() == [10, 31]
+    assert testArrays['rating'].tolist() == [3.5, 0.5] and testArrays['rating'].dtype == np.float32
+    assert testArrays['timestamp'].tolist() == [100, 7] and testArrays['timestamp'].dtype == np.int64
+    assert testErrors == 5
+    
+    # Without header
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as testFile:
+        testFile.write('1,10\n2,20\n')
+    testArrays, testErrors = readCsvArrays(testFile.name, EVALUATION_COLUMNS)
+    os.remove(testFile.name)
+    assert testArrays['movieId'].tolist() == [10, 20] and testErrors == 0
 
 
 
-# @RMSEeval: To calculate the accuracy of the prediction from files
+# @readCsvEvaluationData : To read the evaluation_ratings.csv and get the data
 #--------
-# targetFile : path to the file that have the right ratings, the targets (string)
-#              The columns in the header are : userId, movieId, rating
-# predictionsFile : path to the file that have predictions of the ratings (string)
-#              The columns in the header are : user_id, movie_id, ratings
+# evalFile: path to the evaluation_ratings.csv file (string)
+# log: to diplay the logs (boolean)
+# @return : a Dict that have for key the user_id (int) and for value the list of movie_id (list of strings).
+#           (movie_id that should be rated for this user.)
+#           The users are in the order of their first line, their movies in the order of the file.
 #--------
-def RMSEeval(targetFile, predictionsFile):
+def readCsvEvaluationData(evalFile, log = False):
     
-    # Reading Files and Retrieve the column index according to the Headers
+    evaluation, errornum = readCsvArrays(evalFile, EVALUATION_COLUMNS, log)
     
-    t = readcsv(targetFile)
-    t_ratingIndex = t[0].index("rating")
-    t_movieIndex = t[0].index("movieId")
-    t_userIndex = t[0].index("userId")
+    # Grouping the movies by user, keeping the order of the file
+    order = np.argsort(evaluation['userId'], kind='stable')
+    users, firsts, nbMovies = np.unique(evaluation['userId'][order], return_index=True, return_counts=True)
+    moviesByUser = np.split(evaluation['movieId'][order].astype(str), firsts[1:])
     
-    p = readcsv(predictionsFile)
-    p_ratingIndex = p[0].index("rating")
-    p_movieIndex = p[0].index("movieId")
-    p_userIndex = p[0].index("userId")
+    # The users in the order of their first line
+    firstLines = order[firsts]
     
-    targets = {}
+    return {int(users[pos]): moviesByUser[pos].tolist() for pos in np.argsort(firstLines)}
+
+
+
+# The columns (name, dtype) of the targets file and of the predictions file for RMSEeval
+SCORED_COLUMNS = [('userId', 'int32'), ('movieId', 'int32'), ('rating', 'float64')]
+
+
+
+# @ratingsKeys : To get one integer key per couple (user_id, movie_id)
+#--------
+# users : numpy.array of the user_id (integers)
+# movies : numpy.array of the movie_id (integers, below 2**32)
+# @return : numpy.array of int64 keys, in the order of the users then of the movies
+#--------
+def ratingsKeys(users, movies):
     
-    # Getting all the target values for the couple (user_id, movie_id)
-    for t_elem in t[1:]:
-        
-        if "rating" in t_elem:
-            continue
-        
-        targets[str(t_elem[t_userIndex])+"_"+str(t_elem[t_movieIndex])] = float(t_elem[t_ratingIndex])
+    return (np.asarray(users, dtype='int64') << 32) | np.asarray(movies, dtype='int64')
+
+if env.TESTMODE:
+    assert ratingsKeys([1, 1, 2], [20, 3, 1]).argsort().tolist() == [1, 0, 2]
+
+
+
+# @evaluationMetrics : To compare predictions with targets (joined on the couple user_id, movie_id)
+#--------
+# targets : dict with the numpy.arrays 'userId', 'movieId', 'rating' (the right ratings)
+#           For a couple that is several times in targets, the last line is kept.
+# predictions : dict with the numpy.arrays 'userId', 'movieId', 'rating' (the predicted ratings)
+#           Each line of a couple that is in targets is scored, the others are not.
+# @return : dict with the keys
+#       - 'RMSE', 'MAE' : the errors on the scored predictions (0 if there are none)
+#       - 'nbScored' : number of scored predictions
+#       - 'coverage' : part of the targets that have a prediction (between 0 and 1)
+#       - 'users' : the user_id of the scored predictions (numpy.array)
+#       - 'usersRMSE' : the RMSE of each of these users (numpy.array)
+#       - 'usersRMSEPercentiles' : the percentiles 5, 25, 50, 75, 95 of usersRMSE (list)
+#--------
+def evaluationMetrics(targets, predictions):
     
-    somme = 0
-    denom = 0
+    targetKeys = ratingsKeys(targets['userId'], targets['movieId'])
     
-    for p_elem in p[1:]:
-                
-        # Skipping lines that have no rating
-        if p_elem[p_ratingIndex] == "" or "rating" in p_elem:
-            continue
-        
-        keyUserMovie = str(p_elem[p_userIndex])+"_"+str(p_elem[p_movieIndex]) 
-        
-        # Computing the values the RMSE metric 
-        if keyUserMovie in targets:
-            somme += ( float(p_elem[p_ratingIndex]) - targets[keyUserMovie] )**2
-            denom += 1
-            
-    if denom == 0:
-        return 0
+    # The sorted couples of targets, with the rating of their last line
+    lastLines = len(targetKeys) - 1 - np.unique(targetKeys[::-1], return_index=True)[1]
+    sortedKeys = targetKeys[lastLines]
+    sortedRatings = np.asarray(targets['rating'], dtype='float64')[lastLines]
+    
+    predictionKeys = ratingsKeys(predictions['userId'], predictions['movieId'])
+    
+    # The position of each prediction in the targets (if it is there)
+    positions = np.minimum(np.searchsorted(sortedKeys, predictionKeys), max(0, len(sortedKeys) - 1))
+    scored = (positions < len(sortedKeys)) & (sortedKeys[positions] == predictionKeys) if len(sortedKeys) > 0 else np.zeros(len(predictionKeys), dtype=bool)
+    
+    errors = np.asarray(predictions['rating'], dtype='float64')[scored] - sortedRatings[positions[scored]]
+    
+    res = {'nbScored': len(errors), 'RMSE': 0, 'MAE': 0
+           , 'coverage': len(np.unique(positions[scored])) / len(sortedKeys) if len(sortedKeys) > 0 else 0
+           , 'users': np.zeros(0, dtype='int64'), 'usersRMSE': np.zeros(0), 'usersRMSEPercentiles': []}
+    
+    if len(errors) == 0:
+        return res
+    
+    squaredErrors = errors ** 2
+    
+    res['RMSE'] = float(np.sqrt(squaredErrors.mean()))
+    res['MAE'] = float(np.abs(errors).mean())
+    
+    # The errors by user
+    users, userRows = np.unique(np.asarray(predictions['userId'])[scored], return_inverse=True)
+    res['users'] = users
+    res['usersRMSE'] = np.sqrt(np.bincount(userRows, squaredErrors) / np.bincount(userRows))
+    res['usersRMSEPercentiles'] = np.percentile(res['usersRMSE'], [5, 25, 50, 75, 95]).tolist()
+    
+    return res
+
+if env.TESTMODE:
+    testTargets = {'userId': np.array([1, 1, 2, 2, 1]), 'movieId': np.array([10, 20, 10, 30, 20]), 'rating': np.array([4, 3, 2, 5, 1])}
+    testPredictions = {'userId': np.array([2, 1, 1, 3]), 'movieId': np.array([10, 20, 10, 10]), 'rating': np.array([3, 2, 4, 4])}
+    testMetrics = evaluationMetrics(testTargets, testPredictions)
+    # Errors : 1 (user 2, movie 10), 1 (user 1, movie 20 : its last target is 1), 0 (user 1, movie 10), the user 3 is not in the targets
+    assert testMetrics['nbScored'] == 3 and testMetrics['coverage'] == 0.75
+    assert np.isclose(testMetrics['RMSE'], np.sqrt(2 / 3)) and np.isclose(testMetrics['MAE'], 2 / 3)
+    assert testMetrics['users'].tolist() == [1, 2] and np.allclose(testMetrics['usersRMSE'], [np.sqrt(0.5), 1])
+    assert evaluationMetrics(testTargets, {'userId': np.array([5]), 'movieId': np.array([5]), 'rating': np.array([5])})['RMSE'] == 0
+
+
+
+# @RMSEeval: To calculate the accuracy of the prediction from files
+#--------
+# targetFile : path to the file that have the right ratings, the targets (string)
+#              The columns in the header are : userId, movieId, rating
+# predictionsFile : path to the file that have predictions of the ratings (string)
+#              The columns in the header are : userId, movieId, rating (the lines without rating are skipped)
+# metrics : to get all the metrics of evaluationMetrics rather than the RMSE (boolean)
+# @return : the RMSE (float, 0 if no prediction is in the targets), or the dict of evaluationMetrics
+#--------
+def RMSEeval(targetFile, predictionsFile, metrics = False):
+    
+    targets = readCsvArrays(targetFile, SCORED_COLUMNS)[0]
+    predictions = readCsvArrays(predictionsFile, SCORED_COLUMNS)[0]
+    
+    res = evaluationMetrics(targets, predictions)
+    
+    if metrics:
+        return res
     
-    return np.sqrt(somme/denom)
+    return res['RMSE']
 
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Registering of the users' profiles learned by the training.
+# The profiles are saved in .dat files (as the movie's metadata), so that the prediction doesn't need to train again.
+#
+
+import env
+import csv
+import numpy as np
+import os
+
+
+# @UserProfilesWriter : To register the users' profiles
+#-------
+# userIds : the user ids (list or numpy.array of integers)
+# userProfiles : numpy.array (Num_Users x Num_Parameters), a user profile per row (in the order of userIds)
+# FeaturesType : the parameters of the movie metadata used for the training (string) (example "INTERMEDIATE")
+# columns : the names of the columns of the movie metadata used for the training (list of strings)
+# OutputDir : path to the directory for the output files with / at the end. (string)
+# MetadataDir : the directory of the movie metadata used for the training (string) (see MovieMetadataReader.metadataDirectory)
+# @return :
+#       - Create a userProfiles.dat file : the users' profiles (float64)
+#       - Create a userIndex.dat file : the index of the rows of userProfiles (user_id as integers)
+#       - Create a userProfilesColumns.csv file : the FeaturesType and MetadataDir on the first line, then the columns of userProfiles
+#-------
+def UserProfilesWriter(userIds, userProfiles, FeaturesType, columns, OutputDir = "", MetadataDir = ""):
+    
+    userProfiles = np.asarray(userProfiles, dtype='float64').reshape((len(userIds), len(columns)))
+    
+    # Writing the FeaturesType and the columns
+    with open(OutputDir + env.PROFILES_COLUMNS, "w") as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow([FeaturesType] + ([MetadataDir] if MetadataDir != "" else []))
+        for val in columns:
+            writer.writerow([val])
+    
+    # Registering the user ids as Integer values (.dat)
+    indexMemmap = np.memmap(OutputDir + env.PROFILES_ROWINDEX, dtype='int64', mode='w+', shape=(len(userIds),))
+    indexMemmap[:] = userIds[:]
+    indexMemmap.flush()
+    
+    # Registering the profiles (.dat)
+    profilesMemmap = np.memmap(OutputDir + env.PROFILES_DATAFRAME, dtype='float64', mode='w+', shape=userProfiles.shape)
+    profilesMemmap[:] = userProfiles[:]
+    profilesMemmap.flush()
+
+
+
+# @UserProfilesInfo : To get the FeaturesType and the columns used for the registered profiles
+#-------
+# InputDir : path to the directory of the registered files with / at the end. (string)
+# @return : FeaturesType (string), columns (list of strings)
+#-------
+def UserProfilesInfo(InputDir = ""):
+    
+    with open(InputDir + env.PROFILES_COLUMNS, "r") as inputColumns:
+        lines = [val.strip() for val in inputColumns]
+    
+    return next(csv.reader([lines[0]]))[0], lines[1:]
+
+
+
+# @UserProfilesMetadataDir : To get the directory of the movie metadata used for the registered profiles
+#-------
+# InputDir : path to the directory of the registered files with / at the end. (string)
+# @return : the directory (string) (empty : not registered, or not there anymore)
+#-------
+def UserProfilesMetadataDir(InputDir = ""):
+    
+    with open(InputDir + env.PROFILES_COLUMNS, "r") as inputColumns:
+        firstRow = next(csv.reader(inputColumns))
+    
+    if len(firstRow) < 2:
+        return ""
+    
+    if not os.path.isdir(firstRow[1]):
+        print("The movie metadata of the profiles is not in " + firstRow[1] + " anymore : the last used metadata is read")
+        return ""
+    
+    return firstRow[1]
+
+
+
+# @UserProfilesRetriever : To get the registered users' profiles
+#-------
+# FeaturesType : the parameters of the movie metadata that will be used for the prediction (string)
+# columns : the names of the columns of the movie metadata that will be used for the prediction (list of strings)
+# InputDir : path to the directory of the registered files with / at the end. (string)
+# @return : userProfiles (numpy.memmap, read only, Num_Users x Num_Parameters), userLookUp (dict user_id (integer) -> row number)
+#           None, None if the profiles have been trained with another FeaturesType or other columns
+#-------
+def UserProfilesRetriever(FeaturesType, columns, InputDir = ""):
+    
+    trainedType, trainedColumns = UserProfilesInfo(InputDir)
+    
+    if trainedType != FeaturesType:
+        print("The user profiles have been trained with " + trainedType + ", not with " + FeaturesType)
+        return None, None
+    
+    if trainedColumns != list(columns):
+        
+        # The first column that differs (or the first missing one)
+        position = next((i for i, (trained, column) in enumerate(zip(trainedColumns, columns)) if trained != column), min(len(trainedColumns), len(columns)))
+        trained = trainedColumns[position] if position < len(trainedColumns) else "no column"
+        column = columns[position] if position < len(columns) else "no column"
+        
+        print("The user profiles have been trained with other columns of " + FeaturesType + " : the column " + str(position) + " is " + trained + ", not " + column
+              + ("" if len(trainedColumns) == len(columns) else " (" + str(len(trainedColumns)) + " columns, not " + str(len(columns)) + ")"))
+        return None, None
+    
+    # Getting the user ids
+    userIndex = np.memmap(InputDir + env.PROFILES_ROWINDEX, dtype='int64', mode='r')
+    userLookUp = {user_id: row for row, user_id in enumerate(userIndex.tolist())}
+    
+    # Getting the profiles as a matrix ( Num_Users x Num_Parameters ), without copy
+    userProfiles = np.memmap(InputDir + env.PROFILES_DATAFRAME, dtype='float64', mode='r', shape=(len(userIndex), len(trainedColumns)))
+    
+    return userProfiles, userLookUp
+
+
+
+# @UserProfilesUpdater : To update the registered profiles of some users, without rewriting the others
+#-------
+# userIds : the user ids (list or numpy.array of integers)
+# userProfiles : numpy.array (Num_Users x Num_Parameters), the new profiles (in the order of userIds)
+# InputDir : path to the directory of the registered files with / at the end. (string)
+# @return : (void) the rows of the known users are overwritten, the new users are added at the end of the files
+#-------
+def UserProfilesUpdater(userIds, userProfiles, InputDir = ""):
+    
+    trainedType, trainedColumns = UserProfilesInfo(InputDir)
+    userProfiles = np.asarray(userProfiles, dtype='float64').reshape((len(userIds), len(trainedColumns)))
+    
+    userIndex = np.memmap(InputDir + env.PROFILES_ROWINDEX, dtype='int64', mode='r')
+    userLookUp = {user_id: row for row, user_id in enumerate(userIndex.tolist())}
+    
+    known = [position for position, user_id in enumerate(userIds) if user_id in userLookUp]
+    new = [position for position, user_id in enumerate(userIds) if user_id not in userLookUp]
+    
+    # Overwriting only the rows of the known users
+    if len(known) != 0:
+        profilesMemmap = np.memmap(InputDir + env.PROFILES_DATAFRAME, dtype='float64', mode='r+', shape=(len(userIndex), len(trainedColumns)))
+        profilesMemmap[[userLookUp[userIds[position]] for position in known]] = userProfiles[known]
+        profilesMemmap.flush()
+        del profilesMemmap
+    
+    del userIndex
+    
+    # Adding the new users at the end of the files
+    if len(new) != 0:
+        with open(InputDir + env.PROFILES_ROWINDEX, "ab") as output:
+            output.write(np.array([userIds[position] for position in new], dtype='int64').tobytes())
+        with open(InputDir + env.PROFILES_DATAFRAME, "ab") as output:
+            output.write(np.ascontiguousarray(userProfiles[new]).tobytes())
+
+
+
+# @cleaner : Remove the registered profiles
+#---------
+def cleaner(InputDir = ""):
+    os.remove(InputDir + env.PROFILES_DATAFRAME)
+    os.remove(InputDir + env.PROFILES_ROWINDEX)
+    os.remove(InputDir + env.PROFILES_COLUMNS)
@@ -7,6 +7,59 @@ TESTMODE = True
 LEARNINGRATE = 0.5
 EPOCHS = 5
 
+# The computation of the user profile : "SAMPLE" (movie per movie), "MINIBATCH", "BATCH" or "RIDGE" (closed form)
+SOLVER = "SAMPLE"
+BATCH_SIZE = 32
+RIDGE_LAMBDA = 0.1
+# Maximum number of values computed at once for the "RIDGE" of many users
+RIDGE_CHUNK_VALUES = 8000000
+# Maximum number of values computed at once when the "BRAYCURTIS" scores of all the movies are computed for many users
+SCORE_BLOCK_VALUES = 4000000
+
+# Number of processes for the training and the prediction (1 : no parallelization)
+NB_WORKERS = 1
+# True to save ratings.csv as .dat files the first time, and read them instead of the csv (rebuilt if ratings.csv changes)
+RATINGS_CACHE = True
+# Directory of the ratings .dat files (a relative path is in the directory of ratings.csv)
+RATINGS_CACHE_DIR = "ratingsCache"
+# True if ratings.csv is sorted by userId, False to sort it first (with bounded memory)
+RATINGS_SORTED = False
+# Maximum number of ratings kept in memory while sorting, and directory of the temporary files (empty : system's one)
+SORT_CHUNK_ROWS = 2000000
+SORT_TMP_DIR = ""
+# Size (bytes) of the chunks read at once from the csv files
+READ_CHUNK_BYTES = 33554432
+# Number of users given at once to a process
+SHARD_NB_USERS = 500
+# Number of movies per tile of the distance matrix (MovieDistanceComputer) : a tile is DISTANCE_TILE_ROWS x DISTANCE_TILE_ROWS distances
+DISTANCE_TILE_ROWS = 2048
+# Number of nearest movies registered for each movie (MovieDistanceComputer.MoviesNeighbours)
+NEIGHBOURS_K = 20
+# Number of lists of the search index (0 : the square root of the number of movies), number of iterations of its k-means
+SEARCH_NB_LISTS = 0
+SEARCH_KMEANS_ITERATIONS = 10
+# Number of lists searched for a user profile (more lists : better recall, more time)
+SEARCH_NPROBE = 8
+
+# The values of the learning rate and of the epochs tried by ParameterSweep.SweepRunner
+SWEEP_LEARNINGRATES = [0.1, 0.25, 0.5, 1.0]
+SWEEP_EPOCHS = [1, 5, 10, 20]
+
+# The cross-validation (CrossValidation.CrossValidationRunner) : number of folds (1 : holdout), split "USER" or "TIME",
+# part of the ratings predicted by the holdout, seed of the split by user
+CV_NB_FOLDS = 5
+CV_SPLIT = "USER"
+CV_HOLDOUT_PART = 0.2
+CV_SEED = 0
+
+# The online prediction (PredictionServer) : its address, the time a batch waits for other requests (ms) and its maximum size,
+# number of last requests of the latency statistics
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_BATCH_WAIT_MS = 2
+SERVER_MAX_BATCH = 256
+SERVER_LATENCY_WINDOW = 10000
+
 FEATURE_TYPE = "INTERMEDIATE"
 RATING_TYPE = "DOTPRODUCT"
 
@@ -22,4 +75,38 @@ IN_EVALUATION_RATINGS="evaluation_ratings.csv"
 
 MMDT_DATAFRAME="movieDF.dat"
 MMDT_ROWINDEX="movieIndex.dat"
+MMDT_ROWLOOKUP="movieLookUp.pkl"
 MMDT_COLUMNS="moviesColumns.csv"
+
+# The directory of the cache of the processed metadata : a directory per content of movies_metadata.csv and processing parameters,
+# reused by the next runs (see MovieMetadataReader.MovieMetadataProcessor, and Main.py -evict to remove them)
+# In the home directory of the user (~) : the same cache for all the runs, whatever their current directory
+# (empty : the files are processed again at each run, in the current directory)
+MMDT_CACHE_DIR="~/.cache/movieMetadataCache"
+
+# movieDF as a sparse matrix (CSR) : the values, their column numbers and the first value of each row
+# rather than the dense movieDF.dat (most of the columns of a movie are 0)
+MMDT_SPARSE = False
+MMDT_SPARSE_DATA="movieDF_data.dat"
+MMDT_SPARSE_INDICES="movieDF_indices.dat"
+MMDT_SPARSE_INDPTR="movieDF_indptr.dat"
+
+# The line kept for a movie_id that is several times in movies_metadata.csv : "FIRST", "LAST" or "MERGE"
+MMDT_DEDUP_POLICY = "FIRST"
+# Number of movies written at once in movieDF.dat (or its sparse files)
+MMDT_BLOCK_ROWS = 10000
+# The nearest movies of each movie (MovieDistanceComputer.MoviesNeighbours) : the files are NEIGHBOURS_FILE + "_ids.dat", "_distances.dat", "_index.dat"
+NEIGHBOURS_FILE="movieNeighbours"
+# The search index of the movies for the user profiles (MovieSearchIndex) : the files begin with SEARCH_INDEX_FILE
+SEARCH_INDEX_FILE="movieSearch"
+# The normalized movieDF of a features type (the {} is replaced by a key of its columns)
+MMDT_NORMALIZED="movieDFNorm_{}.dat"
+# Number of rows normalized at once (Tools.normalize)
+NORMALIZE_BLOCK_ROWS = 10000
+
+
+# User Profiles output filenames (training)
+
+PROFILES_DATAFRAME="userProfiles.dat"
+PROFILES_ROWINDEX="userIndex.dat"
+PROFILES_COLUMNS="userProfilesColumns.csv"
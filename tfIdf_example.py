@@ -32,14 +32,10 @@ def computeIDF(df_, nb):
 
 
 def normalize(df_):
-    res = np.zeros(df_.shape)
-    for i in range(df_.shape[0]):
-        iLoc = np.array(df_[i,:])
-        lengthVector = np.sqrt((iLoc.dot(iLoc)).sum())
-        for j in range(df_.shape[1]):
-            val = df_[i,j]
-            res[i,j] = val / lengthVector
-    return res
+    res = np.asarray(df_, dtype='float64')
+    lengthVector = np.sqrt(np.einsum('ij,ij->i', res, res))
+    lengthVector[lengthVector == 0] = 1
+    return res / lengthVector[:, np.newaxis]
 
 
 def cosineDistance(df_):